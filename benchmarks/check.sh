@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+# Fails when the benchmark cases that use the test structures regress
+# against benchmarks/baseline.json. Extra arguments go to wf.benchmark,
+# e.g. --update-baseline after an intended change.
+set -euo pipefail
+cd "$(dirname "$0")/.."
+exec python -m wf.benchmark --cases ubiquitin,dna_ligand --cold-start "$@"
@@ -0,0 +1,121 @@
+"""Lets the suite run outside the workflow image.
+
+The Latch SDK is replaced by stubs when it is not installed; only its task
+decorators, types and the LPath class are used by the code under test, and
+tests that talk to Latch Data swap in a local stand-in. LigandMPNN is taken
+from the image's checkout, or else from the ligandmpnn package, whose bundled
+model params are used as the checkpoints (tests/requirements.txt).
+"""
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+import pytest
+
+DATA_DIR = Path(__file__).parent / "data"
+
+# Node-local caches of the tests, read by wf.cache when it is imported
+os.environ["LIGANDMPNN_CACHE_DIR"] = tempfile.mkdtemp(prefix="ligandmpnn-tests-")
+
+
+class _Stub:
+    """Any attribute of a stubbed module. Used as a decorator (with or
+    without arguments) it returns the function unchanged."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str) -> "_Stub":
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return _Stub(f"{self._name}.{attr}")
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return _Stub(self._name)
+
+    def __getitem__(self, item) -> "_Stub":
+        return self
+
+    def __repr__(self) -> str:
+        return f"<stub {self._name}>"
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, attr: str):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        if attr.endswith("Error"):
+            value = type(attr, (Exception,), {})
+        else:
+            value = _Stub(f"{self.__name__}.{attr}")
+        setattr(self, attr, value)
+        return value
+
+
+class _StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def __init__(self, package: str):
+        self.package = package
+
+    def find_spec(self, name, path, target=None):
+        if name.split(".")[0] != self.package:
+            return None
+        return importlib.machinery.ModuleSpec(name, self, is_package=True)
+
+    def create_module(self, spec):
+        module = _StubModule(spec.name)
+        module.__path__ = []
+        return module
+
+    def exec_module(self, module):
+        pass
+
+
+if importlib.util.find_spec("latch") is None:
+    sys.meta_path.append(_StubFinder("latch"))
+
+
+def _ligandmpnn_source():
+    """(source dir, model params dir) of LigandMPNN, or None."""
+    from wf.checkpoints import BUNDLED_PARAMS_DIR, LIGANDMPNN_DIR
+
+    if (LIGANDMPNN_DIR / "model_utils.py").exists():
+        return LIGANDMPNN_DIR, BUNDLED_PARAMS_DIR
+    spec = importlib.util.find_spec("ligandmpnn")
+    if spec is None or spec.origin is None:
+        return None
+    package = Path(spec.origin).parent
+    return package / "utils", package / "data" / "model_params"
+
+
+_LIGANDMPNN = _ligandmpnn_source()
+if _LIGANDMPNN is not None and importlib.util.find_spec("torch") is not None:
+    import wf.checkpoints
+
+    sys.path.insert(0, str(_LIGANDMPNN[0]))
+    wf.checkpoints.BUNDLED_PARAMS_DIR = _LIGANDMPNN[1]
+else:
+    _LIGANDMPNN = None
+
+
+@pytest.fixture
+def needs_ligandmpnn():
+    """Skip unless torch and LigandMPNN can be imported."""
+    if _LIGANDMPNN is None:
+        pytest.skip("torch or LigandMPNN is not installed")
+
+
+@pytest.fixture
+def structures(tmp_path) -> Path:
+    """A copy of the test structures, so tests can add files next to them."""
+    destination = tmp_path / "structures"
+    shutil.copytree(DATA_DIR, destination)
+    return destination
+
@@ -0,0 +1,98 @@
+import csv
+
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+import wf.analysis
+from wf.analysis import (
+    METRICS_TABLE,
+    TOP_DESIGNS,
+    analyze_designs,
+    max_identity_to_better,
+    mean_distances,
+)
+from wf.outputs import (
+    DESIGN_TABLE,
+    DesignResult,
+    merge_design_tables,
+    write_design_table,
+)
+
+
+def test_distances_match_pairwise_comparison(monkeypatch):
+    monkeypatch.setattr(wf.analysis, "PAIRWISE_CHUNK", 3)
+    S = np.random.default_rng(0).integers(0, 4, size=(8, 12))
+    identity = (S[:, None] == S[None]).mean(2)
+
+    n = len(S)
+    expected_distance = (1 - identity).sum(1) / (n - 1)
+    assert mean_distances(S) == pytest.approx(expected_distance, abs=1e-6)
+
+    expected_best = [np.nan] + [identity[i, :i].max() for i in range(1, n)]
+    assert max_identity_to_better(S) == pytest.approx(
+        expected_best, abs=1e-6, nan_ok=True
+    )
+    assert np.isnan(mean_distances(S[:1])).all()
+
+
+def write_run(run_dir, name, native, sequences, confidence):
+    (run_dir / "seqs").mkdir(parents=True, exist_ok=True)
+    (run_dir / "seqs" / f"{name}.fa").write_text(
+        f">{name}, T=0.1, seed=1\n{native}\n"
+        + "".join(f">{name}, id={i}\n{s}\n" for i, s in enumerate(sequences, 1))
+    )
+    n = len(sequences)
+    result = DesignResult(
+        name=name,
+        seed=1,
+        native_sequence=native,
+        design_ids=list(range(1, n + 1)),
+        sequences=sequences,
+        overall_confidence=confidence,
+        ligand_confidence=[0.5] * n,
+        seq_rec=[0.5] * n,
+    )
+    write_design_table(run_dir / name / DESIGN_TABLE, result, n, 0.1)
+    return run_dir / name / DESIGN_TABLE
+
+
+def test_designs_are_ranked_across_structures(tmp_path):
+    first = write_run(
+        tmp_path, "a", "ACDE", ["ACDE", "ACDF", "GGGG", "AC:DZ"], [0.3, 0.9, 0.1, 0.7]
+    )
+    second = write_run(tmp_path, "b", "KLM", ["KLM", "KLN"], [0.8, 0.9])
+    merge_design_tables([first, second], tmp_path / DESIGN_TABLE)
+
+    summary = analyze_designs(tmp_path, top_k=3)
+    assert summary["designs"] == 6
+    assert summary["structures"] == 2
+    assert summary["best"] == "a design 2"
+
+    metrics = pq.read_table(tmp_path / METRICS_TABLE).to_pydict()
+    assert metrics["rank"] == [5, 1, 6, 4, 3, 2]
+    assert metrics["identity_to_native"][:3] == pytest.approx([1.0, 0.75, 0.0])
+    # Z is not an amino acid, so the fourth design of a is not compared
+    assert np.isnan(metrics["identity_to_native"][3])
+    assert metrics["identity_to_native"][4:] == pytest.approx([1.0, 2 / 3])
+
+    with open(tmp_path / TOP_DESIGNS, newline="") as f:
+        top = list(csv.DictReader(f))
+    assert [(row["pdb"], row["design_id"]) for row in top] == [
+        ("a", "2"),
+        ("b", "2"),
+        ("b", "1"),
+    ]
+    # Each design is compared only with better designs of its own structure
+    assert [row["max_identity_to_better"] for row in top] == ["", "", "0.6667"]
+
+
+def test_ranking_by_another_column(tmp_path):
+    write_run(tmp_path, "a", "ACDE", ["ACDE", "ACDF", "GGGG"], [0.3, 0.9, 0.1])
+    (tmp_path / "a" / DESIGN_TABLE).rename(tmp_path / DESIGN_TABLE)
+
+    summary = analyze_designs(tmp_path, rank_by="identity_to_native")
+    assert summary["best"] == "a design 1"
+    with pytest.raises(ValueError, match="Cannot rank by sequence"):
+        analyze_designs(tmp_path, rank_by="sequence")
+    assert analyze_designs(tmp_path / "a") is None
@@ -0,0 +1,71 @@
+from dataclasses import replace
+
+import pytest
+import torch
+
+from wf.options import DesignOptions
+
+
+@pytest.fixture
+def engine(needs_ligandmpnn):
+    from wf.engine import get_engine
+
+    return get_engine(DesignOptions(), "cpu")
+
+
+def sample(engine, pdb_path, options, batch_indices):
+    prepared = engine.prepare(pdb_path, options)
+    return engine.sample(prepared, options, batch_indices)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        DesignOptions(auto_batch_size=1, batch_size=4, number_of_batches=2),
+        DesignOptions(
+            auto_batch_size=1,
+            batch_size=3,
+            number_of_batches=2,
+            symmetry_residues="A1,A2|A10,A20",
+            symmetry_weights="0.5,0.5|0.5,0.5",
+        ),
+    ],
+    ids=["plain", "symmetric"],
+)
+def test_design_is_the_same_alone_and_in_a_batch(
+    engine, structures, monkeypatch, options
+):
+    pdb_path = structures / "1ubi.pdb"
+    together = sample(engine, pdb_path, options, [0, 1])
+
+    # One design per sampling call
+    monkeypatch.setattr("wf.engine.plan_batch_size", lambda *args, **kwargs: 1)
+    alone = sample(engine, pdb_path, options, [0, 1])
+    assert alone.design_ids == together.design_ids
+    assert torch.equal(alone.S, together.S)
+
+    # Only the second batch
+    second = sample(engine, pdb_path, options, [1])
+    assert torch.equal(second.S, together.S[options.batch_size :])
+
+
+def test_auto_batching_leaves_torch_multinomial_alone(
+    engine, structures, monkeypatch
+):
+    def multinomial(*args, **kwargs):
+        raise AssertionError("sampling called torch.multinomial")
+
+    monkeypatch.setattr(torch, "multinomial", multinomial)
+    options = DesignOptions(auto_batch_size=1, batch_size=2)
+    sampled = sample(engine, structures / "1ubi.pdb", options, [0])
+    assert sampled.S.shape == (2, 76)
+    assert torch.multinomial is multinomial
+
+
+def test_seed_changes_designs(engine, structures):
+    options = DesignOptions(auto_batch_size=1, batch_size=2)
+    first = sample(engine, structures / "1ubi.pdb", options, [0])
+    again = sample(engine, structures / "1ubi.pdb", options, [0])
+    other = sample(engine, structures / "1ubi.pdb", replace(options, seed=5), [0])
+    assert torch.equal(first.S, again.S)
+    assert not torch.equal(first.S, other.S)
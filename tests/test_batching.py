@@ -0,0 +1,75 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from wf.options import DesignOptions
+from wf.preflight import read_residue_ids
+
+
+def trim(source: Path, count: int, destination: Path) -> Path:
+    """A copy of source without the last count residues of its first chain."""
+    residues = read_residue_ids(source)
+    chain = residues[0][0]
+    dropped = set([residue for c, residue in residues if c == chain][-count:])
+    lines = [
+        line
+        for line in source.read_text().splitlines(keepends=True)
+        if not (
+            line[:6] in ("ATOM  ", "HETATM")
+            and line[21] == chain
+            and f"{chain}{int(line[22:26])}{line[26].strip()}" in dropped
+        )
+    ]
+    destination.write_text("".join(lines))
+    return destination
+
+
+def test_length_buckets_limit_padding(needs_ligandmpnn):
+    from wf.engine import LigandMPNNEngine
+
+    engine = SimpleNamespace(k_neighbors=32)
+    # Short structures only share a call with ones of the same length
+    assert LigandMPNNEngine.length_buckets(engine, [100, 20, 124, 126, 20, 30]) == [
+        [1, 4],
+        [5],
+        [0, 2],
+        [3],
+    ]
+
+
+def test_padded_batches_match_per_structure_sampling(
+    needs_ligandmpnn, structures, tmp_path
+):
+    from wf.engine import get_engine
+
+    source = structures / "1ubi.pdb"
+    pdb_paths = [source] + [
+        trim(source, count, tmp_path / f"trimmed_{count}.pdb") for count in (3, 7)
+    ]
+    options = DesignOptions(
+        auto_batch_size=1, number_of_batches=2, batch_size=3, seed=7
+    )
+    engine = get_engine(options, "cpu")
+    prepared = [engine.prepare(pdb_path, options) for pdb_path in pdb_paths]
+    assert all(engine.can_sample_together(p, options) for p in prepared)
+    lengths = [p.feature_dict["mask"].shape[1] for p in prepared]
+    assert len(set(lengths)) == 3
+    assert len(engine.length_buckets(lengths)) == 1
+
+    alone = [
+        engine.design(pdb_path, options, tmp_path / "alone" / pdb_path.stem, [0, 1])
+        for pdb_path in pdb_paths
+    ]
+    together = engine.design_many(
+        [
+            (pdb_path, options, tmp_path / "together" / pdb_path.stem, [0, 1])
+            for pdb_path in pdb_paths
+        ]
+    )
+    for single, padded in zip(alone, together):
+        assert padded.design_ids == single.design_ids
+        assert padded.sequences == single.sequences
+        assert padded.overall_confidence == pytest.approx(
+            single.overall_confidence, abs=1e-4
+        )
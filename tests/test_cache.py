@@ -0,0 +1,212 @@
+import io
+import os
+import shutil
+import tarfile
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from wf import cache
+from wf.cache import ResultCache, result_key, structure_key
+from wf.options import DesignOptions
+
+PDB = (
+    "ATOM      1  CA  ALA A   1      11.639   6.071  -5.147  1.00  0.00           C\n"
+    "ATOM      2  CA  GLY A   2      13.140   5.918  -2.200  1.00  0.00           C\n"
+    "END\n"
+)
+
+
+@pytest.fixture
+def inputs(tmp_path, monkeypatch):
+    # Digests are remembered by path, size and mtime; start from none
+    monkeypatch.setattr(cache, "_file_digests", {})
+    pdb_path = tmp_path / "inputs" / "scaffold.pdb"
+    pdb_path.parent.mkdir()
+    pdb_path.write_text(PDB)
+    checkpoint = tmp_path / "ligandmpnn_v_32_010_25.pt"
+    checkpoint.write_bytes(b"weights")
+    return pdb_path, str(checkpoint)
+
+
+def test_key_is_stable_for_the_same_inputs(inputs, tmp_path):
+    pdb_path, checkpoint = inputs
+    key = result_key(pdb_path, DesignOptions(), checkpoint, [0, 1])
+    assert result_key(pdb_path, DesignOptions(), checkpoint, [0, 1]) == key
+
+    # A copy of the structure elsewhere, as staged by another task
+    copy = tmp_path / "elsewhere" / pdb_path.name
+    copy.parent.mkdir()
+    shutil.copy(pdb_path, copy)
+    assert result_key(copy, DesignOptions(), checkpoint, [0, 1]) == key
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"temperature": 0.2},
+        {"seed": 112},
+        {"fixed_residues": "A1"},
+        {"pack_side_chains": 1},
+    ],
+)
+def test_key_changes_with_sampling_options(inputs, change):
+    pdb_path, checkpoint = inputs
+    options = DesignOptions()
+    assert result_key(pdb_path, replace(options, **change), checkpoint, [0]) != (
+        result_key(pdb_path, options, checkpoint, [0])
+    )
+
+
+def test_key_changes_with_structure_checkpoint_and_batches(inputs, tmp_path):
+    pdb_path, checkpoint = inputs
+    options = DesignOptions()
+    key = result_key(pdb_path, options, checkpoint, [0])
+    assert result_key(pdb_path, options, checkpoint, [1]) != key
+
+    renamed = tmp_path / "other.pdb"
+    shutil.copy(pdb_path, renamed)
+    assert result_key(renamed, options, checkpoint, [0]) != key
+
+    other_checkpoint = tmp_path / "other.pt"
+    other_checkpoint.write_bytes(b"other weights")
+    assert result_key(pdb_path, options, str(other_checkpoint), [0]) != key
+
+
+@pytest.mark.parametrize("change", [{"save_stats": 1}, {"low_memory": 1}])
+def test_key_ignores_output_only_options(inputs, change):
+    pdb_path, checkpoint = inputs
+    options = DesignOptions()
+    assert result_key(
+        pdb_path, replace(options, **change), checkpoint, [0]
+    ) == result_key(pdb_path, options, checkpoint, [0])
+
+
+def test_constraint_files_are_keyed_by_content(inputs, tmp_path):
+    pdb_path, checkpoint = inputs
+    first = tmp_path / "a" / "bias.json"
+    second = tmp_path / "b" / "bias.json"
+    for path in [first, second]:
+        path.parent.mkdir()
+        path.write_text('{"scaffold": {"A1": {"W": 1.0}}}')
+    key = result_key(
+        pdb_path, DesignOptions(bias_AA_jsonl=str(first)), checkpoint, [0]
+    )
+    assert (
+        result_key(pdb_path, DesignOptions(bias_AA_jsonl=str(second)), checkpoint, [0])
+        == key
+    )
+
+    second.write_text('{"scaffold": {"A1": {"W": 2.0}}}')
+    assert (
+        result_key(pdb_path, DesignOptions(bias_AA_jsonl=str(second)), checkpoint, [0])
+        != key
+    )
+
+
+def test_protein_mpnn_key_ignores_the_ligand_checkpoint(inputs):
+    pdb_path, checkpoint = inputs
+    options = DesignOptions(model_type="protein_mpnn")
+    assert result_key(
+        pdb_path,
+        replace(options, checkpoint_ligand_mpnn="/elsewhere/model.pt"),
+        checkpoint,
+        [0],
+    ) == result_key(pdb_path, options, checkpoint, [0])
+
+
+def test_structure_key_ignores_settings_order(inputs):
+    pdb_path, _ = inputs
+    assert structure_key(pdb_path, {"a": 1, "b": [2]}) == structure_key(
+        pdb_path, {"b": [2], "a": 1}
+    )
+    assert structure_key(pdb_path, {"a": 1}) != structure_key(pdb_path, {"a": 2})
+
+
+def outputs(tmp_path, name: str, size: int):
+    out_folder = tmp_path / name
+    (out_folder / "seqs").mkdir(parents=True)
+    (out_folder / "seqs" / f"{name}.fa").write_bytes(b"A" * size)
+    return out_folder
+
+
+def test_oldest_entries_are_evicted_past_max_bytes(tmp_path, monkeypatch):
+    result_cache = ResultCache(root=tmp_path / "cache", max_bytes=250)
+    scans = []
+    evict = result_cache.evict
+
+    def counted_evict():
+        scans.append(1)
+        evict()
+
+    monkeypatch.setattr(result_cache, "evict", counted_evict)
+
+    for i, key in enumerate(["aa1", "bb2"]):
+        result_cache.put(key, outputs(tmp_path, key, 100))
+        os.utime(result_cache._entry(key), (i, i))
+    assert scans == []
+
+    result_cache.put("cc3", outputs(tmp_path, "cc3", 100))
+    assert scans == [1]
+    assert not result_cache._entry("aa1").exists()
+    assert result_cache._entry("bb2").exists()
+    assert result_cache._entry("cc3").exists()
+    assert result_cache._total_bytes == 200
+
+
+def test_remote_entries_cannot_write_outside_the_cache(tmp_path, monkeypatch):
+    def download_if_exists(remote_path, local_path):
+        with tarfile.open(local_path, "w") as tar:
+            member = tarfile.TarInfo("../../escaped.txt")
+            member.size = 2
+            tar.addfile(member, io.BytesIO(b"hi"))
+        return True
+
+    monkeypatch.setattr("wf.staging.download_if_exists", download_if_exists)
+    result_cache = ResultCache(
+        root=tmp_path / "cache", max_bytes=1000, remote_path="latch:///cache"
+    )
+    assert not result_cache.get("aa1", tmp_path / "out")
+    assert not list(tmp_path.rglob("escaped.txt"))
+
+
+def test_structures_round_trip_through_the_disk_cache(
+    needs_ligandmpnn, structures, tmp_path, monkeypatch
+):
+    import torch
+
+    from wf.cache import StructureCache
+    from wf.engine import get_engine
+
+    engine = get_engine(DesignOptions(), "cpu")
+    options = DesignOptions(batch_size=2, seed=3)
+    pdb_path = structures / "3mht.pdb"
+    monkeypatch.setattr(engine, "structure_cache", None)
+    fresh = engine.parse(pdb_path, options)
+    uncached = engine.design(pdb_path, options, tmp_path / "uncached")
+
+    monkeypatch.setattr(engine, "structure_cache", StructureCache(tmp_path / "cache"))
+    engine.parse(pdb_path, options)
+    # A new cache on the same directory has nothing in memory
+    monkeypatch.setattr(engine, "structure_cache", StructureCache(tmp_path / "cache"))
+    loaded = engine.parse(pdb_path, options)
+    assert loaded is not fresh
+
+    for group in ["protein_dict", "feature_dict"]:
+        expected, actual = getattr(fresh, group), getattr(loaded, group)
+        assert expected.keys() == actual.keys()
+        for k, value in expected.items():
+            if isinstance(value, torch.Tensor):
+                assert torch.equal(actual[k], value), k
+            elif isinstance(value, np.ndarray):
+                assert np.array_equal(actual[k], value), k
+    assert loaded.icodes == fresh.icodes
+    assert loaded.other_atoms.numAtoms() == fresh.other_atoms.numAtoms()
+    assert np.array_equal(loaded.backbone.getCoords(), fresh.backbone.getCoords())
+
+    cached = engine.design(pdb_path, options, tmp_path / "cached")
+    assert cached.sequences == uncached.sequences
+    assert (tmp_path / "cached" / "backbones" / "3mht_1.pdb").read_text() == (
+        tmp_path / "uncached" / "backbones" / "3mht_1.pdb"
+    ).read_text()
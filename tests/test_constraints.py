@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from wf.constraints import (
+    ALPHABET,
+    ConstraintIndex,
+    build_constraint_index,
+    is_constraint_index,
+)
+from wf.options import records_for_pdb
+
+RESIDUES = {"A1": 0, "A2": 1, "B1": 2}
+
+
+def index(tmp_path, records, kind, per_pdb):
+    source = tmp_path / "constraints.jsonl"
+    source.write_text(
+        "\n".join(json.dumps({key: value}) for key, value in records.items())
+    )
+    destination = tmp_path / "constraints.idx"
+    build_constraint_index(source, destination, kind, per_pdb)
+    assert is_constraint_index(destination)
+    assert not is_constraint_index(source)
+    return ConstraintIndex(destination)
+
+
+def expected_bias(entry):
+    out = np.full((len(RESIDUES), len(ALPHABET)), np.nan, dtype=np.float32)
+    for residue, biases in entry.items():
+        if residue in RESIDUES:
+            for amino_acid, bias in biases.items():
+                out[RESIDUES[residue], ALPHABET.index(amino_acid)] = bias
+    return out
+
+
+@pytest.mark.parametrize(
+    "pdb_path",
+    [
+        "/inputs/first.pdb",
+        "/elsewhere/first.pdb",
+        "/inputs/second.pdb",
+        "/inputs/third.pdb",
+        "/inputs/missing.pdb",
+    ],
+)
+def test_per_pdb_lookup_matches_records_for_pdb(tmp_path, pdb_path):
+    records = {
+        "/inputs/first.pdb": {"A1": {"W": 2.0}, "B1": {"A": -1.0, "C": 0.5}},
+        "second.pdb": {"A2": {"G": 1.5}, "C7": {"W": 3.0}},
+        "runs/third.pdb": {"A1": {"Y": -2.0}},
+    }
+    constraints = index(tmp_path, records, "bias", per_pdb=True)
+    expected = expected_bias(records_for_pdb(records, Path(pdb_path)))
+    np.testing.assert_array_equal(constraints.dense(pdb_path, RESIDUES), expected)
+
+
+def test_per_residue_lookup(tmp_path):
+    records = {"A2": {"W": 1.0}, "B1": {"P": -3.0}}
+    constraints = index(tmp_path, records, "bias", per_pdb=False)
+    np.testing.assert_array_equal(
+        constraints.dense("/any/scaffold.pdb", RESIDUES), expected_bias(records)
+    )
+
+
+def test_omitted_amino_acids_are_ones(tmp_path):
+    constraints = index(tmp_path, {"scaffold": {"A1": "WC"}}, "omit", per_pdb=True)
+    dense = constraints.dense("scaffold.pdb", RESIDUES)
+    assert dense[0, ALPHABET.index("W")] == 1
+    assert dense[0, ALPHABET.index("C")] == 1
+    assert np.isnan(dense[0, ALPHABET.index("A")])
+    assert np.isnan(dense[1:]).all()
+
+
+def test_empty_file(tmp_path):
+    constraints = index(tmp_path, {}, "bias", per_pdb=False)
+    assert np.isnan(constraints.dense("scaffold.pdb", RESIDUES)).all()
+
+
+def test_long_residue_names_are_refused(tmp_path):
+    with pytest.raises(ValueError, match="too long"):
+        index(tmp_path, {"A" * 17: {"W": 1.0}}, "bias", per_pdb=False)
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+
+from wf.options import DesignOptions
+
+
+@pytest.fixture
+def engine(needs_ligandmpnn):
+    from wf.engine import get_engine
+
+    return get_engine(DesignOptions(), "cpu")
+
+
+def read_fasta(path: Path):
+    records = path.read_text().split(">")[1:]
+    return [record.splitlines() for record in records]
+
+
+def test_engine_is_resident_per_model(engine):
+    from wf.engine import get_engine
+
+    assert get_engine(DesignOptions(seed=7, batch_size=3), "cpu") is engine
+    other = get_engine(DesignOptions(model_type="protein_mpnn"), "cpu")
+    assert other is not engine
+    assert other.model_type == "protein_mpnn"
+
+
+def test_design_writes_run_py_layout(engine, structures, tmp_path):
+    options = DesignOptions(batch_size=2, number_of_batches=2, seed=3)
+    result = engine.design(structures / "1ubi.pdb", options, tmp_path / "out")
+
+    assert result.design_ids == [1, 2, 3, 4]
+    records = read_fasta(tmp_path / "out" / "seqs" / "1ubi.fa")
+    assert records[0][1] == result.native_sequence
+    assert [record[1] for record in records[1:]] == result.sequences
+    assert all(f"id={i}," in record[0] for i, record in enumerate(records[1:], 1))
+    assert all(len(seq) == 76 for seq in result.sequences)
+    for i in result.design_ids:
+        assert (tmp_path / "out" / "backbones" / f"1ubi_{i}.pdb").exists()
+
+
+def test_design_is_reproducible_across_calls(engine, structures, tmp_path):
+    options = DesignOptions(batch_size=2, number_of_batches=1, seed=11)
+    first = engine.design(structures / "1ubi.pdb", options, tmp_path / "first")
+    second = engine.design(structures / "1ubi.pdb", options, tmp_path / "second")
+
+    assert first.sequences == second.sequences
+    assert (tmp_path / "first" / "seqs" / "1ubi.fa").read_text() == (
+        tmp_path / "second" / "seqs" / "1ubi.fa"
+    ).read_text()
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import pytest
+
+from wf import execution
+from wf.execution import available_cpus, plan_workers, split_work
+
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    """Reads of /sys/fs/cgroup go to tmp_path, on a 16-core machine."""
+    monkeypatch.setattr(execution.os, "sched_getaffinity", lambda pid: set(range(16)))
+    monkeypatch.setattr(execution, "Path", lambda path: tmp_path / path.lstrip("/"))
+
+    def write(path: str, text: str) -> None:
+        (tmp_path / path.lstrip("/")).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path.lstrip("/")).write_text(text)
+
+    return write
+
+
+def test_cpus_without_quota_are_the_affinity(cgroup):
+    assert available_cpus() == 16
+    cgroup("/sys/fs/cgroup/cpu.max", "max 100000\n")
+    assert available_cpus() == 16
+
+
+def test_cgroup_v2_quota_limits_cpus(cgroup):
+    cgroup("/sys/fs/cgroup/cpu.max", "400000 100000\n")
+    assert available_cpus() == 4
+    # A fraction of a core still leaves one
+    cgroup("/sys/fs/cgroup/cpu.max", "50000 100000\n")
+    assert available_cpus() == 1
+
+
+def test_cgroup_v1_quota_limits_cpus(cgroup):
+    cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "200000\n")
+    cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "100000\n")
+    assert available_cpus() == 2
+    cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "-1\n")
+    assert available_cpus() == 16
+
+
+@pytest.mark.parametrize(
+    "device, design_workers, expected",
+    [
+        ("cpu", 0, (8, 1)),
+        ("cpu", 2, (2, 4)),
+        ("cpu", 3, (3, 2)),
+        ("cpu", 32, (8, 1)),
+        ("cuda", 0, (1, 8)),
+        ("cuda", 4, (1, 8)),
+    ],
+)
+def test_plan_workers(monkeypatch, device, design_workers, expected):
+    monkeypatch.setattr(execution, "available_cpus", lambda: 8)
+    assert plan_workers(device, design_workers) == expected
+
+
+def test_structures_are_dealt_out_when_there_are_enough():
+    pdbs = [Path(f"{i}.pdb") for i in range(5)]
+    parts = split_work(pdbs, [0, 1, 2], 2)
+    assert parts == [(pdbs[0::2], [0, 1, 2]), (pdbs[1::2], [0, 1, 2])]
+
+
+def test_batches_are_split_into_contiguous_ranges():
+    pdbs = [Path("a.pdb"), Path("b.pdb")]
+    parts = split_work(pdbs, list(range(6)), 4)
+    assert parts == [
+        ([pdbs[0]], [0, 1, 2]),
+        ([pdbs[0]], [3, 4, 5]),
+        ([pdbs[1]], [0, 1, 2]),
+        ([pdbs[1]], [3, 4, 5]),
+    ]
+    # Never more parts per structure than batches
+    assert split_work(pdbs[:1], [0, 1], 8) == [([pdbs[0]], [0]), ([pdbs[0]], [1])]
+
+
+def test_batches_stay_together_without_split_batches():
+    pdbs = [Path("a.pdb")]
+    assert split_work(pdbs, list(range(6)), 4, split_batches=False) == [
+        (pdbs, list(range(6)))
+    ]
+
+
+def test_configure_threads_sets_torch_threads():
+    torch = pytest.importorskip("torch")
+    threads = torch.get_num_threads()
+    try:
+        execution.configure_threads(2)
+        assert torch.get_num_threads() == 2
+        # Inter-op threads can only be set once; later calls leave them be
+        execution.configure_threads(1, inter_op_threads=3)
+        assert torch.get_num_threads() == 1
+    finally:
+        torch.set_num_threads(threads)
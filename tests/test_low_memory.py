@@ -0,0 +1,90 @@
+from pathlib import Path
+
+import pytest
+
+from wf.options import DesignOptions
+
+
+@pytest.fixture
+def engine(needs_ligandmpnn):
+    from wf.engine import get_engine
+
+    return get_engine(DesignOptions(), "cpu")
+
+
+@pytest.fixture
+def two_copies(structures) -> Path:
+    """Ubiquitin as chain A plus a copy as chain B, far out of its reach."""
+    lines = [
+        line
+        for line in (structures / "1ubi.pdb").read_text().splitlines()
+        if line.startswith("ATOM")
+    ]
+    copy = [
+        f"{line[:21]}B{line[22:30]}{float(line[30:38]) + 500:8.3f}{line[38:]}"
+        for line in lines
+    ]
+    path = structures / "two_copies.pdb"
+    path.write_text("\n".join(lines + ["TER"] + copy + ["END"]) + "\n")
+    return path
+
+
+def test_blockwise_neighbours_match_the_full_search(engine, structures, monkeypatch):
+    import torch
+
+    import wf.engine
+
+    monkeypatch.setattr(wf.engine, "LOW_MEMORY_ROWS", 7)
+    prepared = engine.prepare(structures / "3mht.pdb", DesignOptions())
+    X = prepared.feature_dict["X"][:, :, 1, :]
+    mask = prepared.feature_dict["mask"].clone()
+    mask[:, ::5] = 0
+
+    features = engine.model.features
+    D, E_idx = features._dist(X, mask)
+    D_blocks, E_idx_blocks = wf.engine._blockwise_dist(features)(X, mask)
+    assert torch.equal(E_idx_blocks, E_idx)
+    assert torch.allclose(D_blocks, D)
+
+
+def test_low_memory_featurization_is_the_same(engine, structures, monkeypatch):
+    import torch
+
+    import wf.engine
+
+    monkeypatch.setattr(wf.engine, "LOW_MEMORY_ROWS", 7)
+    monkeypatch.setattr(engine, "structure_cache", None)
+    full = engine.parse(structures / "3mht.pdb", DesignOptions())
+    blockwise = engine.parse(structures / "3mht.pdb", DesignOptions(low_memory=1))
+
+    assert full.feature_dict.keys() == blockwise.feature_dict.keys()
+    for k, v in full.feature_dict.items():
+        if isinstance(v, torch.Tensor):
+            assert torch.equal(blockwise.feature_dict[k], v), k
+
+
+def test_context_crop_keeps_the_residues_within_reach(engine, two_copies):
+    import torch
+
+    prepared = engine.prepare(two_copies, DesignOptions(redesigned_residues="A10 A11"))
+    crop = engine.context_crop(prepared)
+    assert torch.equal(crop.keep, torch.arange(76))
+    assert engine.context_crop(engine.prepare(two_copies, DesignOptions())) is None
+
+
+def test_cropped_designs_match_the_full_structure(engine, two_copies, tmp_path):
+    options = DesignOptions(
+        chains_to_design="A", auto_batch_size=1, batch_size=2, number_of_batches=2
+    )
+    full = engine.design(two_copies, options, tmp_path / "full")
+    options.low_memory = 1
+    cropped = engine.design(two_copies, options, tmp_path / "cropped")
+
+    assert cropped.sequences == full.sequences
+    # Chain B is not designed, so it keeps its native residues
+    native_b = full.native_sequence.split(":")[1]
+    assert all(s.split(":")[1] == native_b for s in full.sequences)
+    assert cropped.overall_confidence == pytest.approx(
+        full.overall_confidence, abs=1e-3
+    )
+    assert cropped.seq_rec == full.seq_rec
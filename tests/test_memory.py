@@ -0,0 +1,90 @@
+import pytest
+
+from wf import memory
+from wf.memory import estimate_design_bytes, is_out_of_memory, plan_batch_size
+from wf.options import DesignOptions
+
+CPU = type("Device", (), {"type": "cpu"})()
+
+
+@pytest.fixture
+def meminfo(tmp_path, monkeypatch):
+    """Reads of /proc and /sys/fs/cgroup go to tmp_path."""
+    monkeypatch.setattr(memory, "Path", lambda path: tmp_path / path.lstrip("/"))
+
+    def write(path: str, text: str) -> None:
+        (tmp_path / path.lstrip("/")).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path.lstrip("/")).write_text(text)
+
+    write("/proc/meminfo", "MemTotal: 16000000 kB\nMemAvailable: 8000000 kB\n")
+    return write
+
+
+def test_host_memory_is_limited_by_the_cgroup(meminfo, monkeypatch):
+    assert memory._host_available_bytes() == 8000000 * 1024
+    meminfo("/sys/fs/cgroup/memory.max", "max\n")
+    assert memory._host_available_bytes() == 8000000 * 1024
+    meminfo("/sys/fs/cgroup/memory.max", "3000000000\n")
+    meminfo("/sys/fs/cgroup/memory.current", "1000000000\n")
+    assert memory._host_available_bytes() == 2000000000
+
+    monkeypatch.setattr(memory, "_memory_share", 1)
+    memory.set_memory_share(4)
+    assert memory.available_memory_bytes(CPU) == 500000000
+
+
+def test_batch_size_fits_the_budget(monkeypatch):
+    fixed, per_design = estimate_design_bytes(300, 50, 32)
+    budget = fixed + 10.5 * per_design
+    monkeypatch.setattr(
+        memory, "available_memory_bytes", lambda device: budget / memory.MEMORY_FRACTION
+    )
+    assert plan_batch_size(CPU, 300, 50, 32, max_batch_size=64) == 10
+    assert plan_batch_size(CPU, 300, 50, 32, max_batch_size=4) == 4
+    # There is always room for one
+    assert plan_batch_size(CPU, 3000, 50, 32, max_batch_size=64) == 1
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (MemoryError(), True),
+        (RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"), True),
+        (RuntimeError("DefaultCPUAllocator: can't allocate memory"), True),
+        (RuntimeError("shape mismatch"), False),
+        (ValueError("out of memory"), False),
+    ],
+)
+def test_out_of_memory_errors_are_recognised(error, expected):
+    assert is_out_of_memory(error) is expected
+
+
+def test_sampling_backs_off_on_out_of_memory(
+    needs_ligandmpnn, structures, monkeypatch, capsys
+):
+    import torch
+
+    import wf.engine
+    from wf.engine import get_engine
+
+    engine = get_engine(DesignOptions(), "cpu")
+    options = DesignOptions(auto_batch_size=1, batch_size=3, number_of_batches=2)
+    prepared = engine.prepare(structures / "1ubi.pdb", options)
+    expected = engine.sample(prepared, options).S
+
+    decode = engine._decode
+    calls = []
+
+    def decode_at_most_two(encoding, feature_dict, randn, uniforms):
+        calls.append(randn.shape[0])
+        if randn.shape[0] > 2:
+            raise RuntimeError("CUDA out of memory")
+        return decode(encoding, feature_dict, randn, uniforms)
+
+    monkeypatch.setattr(engine, "_decode", decode_at_most_two)
+    monkeypatch.setattr(wf.engine, "plan_batch_size", lambda *args, **kwargs: 6)
+    S = engine.sample(prepared, options).S
+
+    assert torch.equal(S, expected)
+    assert calls == [6, 3] + [1] * 6
+    assert "retrying with 3 designs per call" in capsys.readouterr().out
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import wf.metrics
+from wf.metrics import StageMetrics, combine_snapshots, report_metrics
+
+
+def test_stages_accumulate_time_and_calls(monkeypatch):
+    metrics = StageMetrics()
+    clock = iter([100.0, 101.5, 102.0, 102.25])
+    monkeypatch.setattr(wf.metrics.time, "time", lambda: next(clock))
+
+    with metrics.stage("design"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.stage("design"):
+            raise RuntimeError
+
+    assert metrics.stages == {"design": {"seconds": 1.75, "calls": 2}}
+
+
+def test_worker_snapshots_are_absorbed():
+    parent = StageMetrics()
+    parent.add_time("parse", 1.0)
+    parent.count(designs=4, residues=400)
+
+    worker = StageMetrics()
+    worker.add_time("parse", 2.0, calls=3)
+    worker.add_time("pack", 5.0)
+    worker.count(designs=6, residues=600, structures=2)
+    snapshot = worker.snapshot()
+    snapshot["peak_rss_mb"] = 1e6
+
+    parent.absorb(snapshot)
+    assert parent.stages == {
+        "parse": {"seconds": 3.0, "calls": 4},
+        "pack": {"seconds": 5.0, "calls": 1},
+    }
+    assert (parent.structures, parent.designs, parent.residues) == (3, 10, 1000)
+    assert parent.snapshot()["peak_rss_mb"] == 1e6
+
+
+def test_metrics_are_written_with_extra_fields(tmp_path):
+    metrics = StageMetrics()
+    metrics.count(designs=8, residues=800)
+    written = metrics.write(tmp_path / "run" / "metrics.json", device="cpu")
+
+    assert json.loads((tmp_path / "run" / "metrics.json").read_text()) == written
+    assert written["device"] == "cpu"
+    assert written["designs"] == 8
+    assert written["designs_per_second"] == pytest.approx(
+        8 / written["wall_seconds"], rel=1e-3
+    )
+    assert written["peak_rss_mb"] > 0
+
+
+def test_shard_snapshots_are_combined(monkeypatch):
+    snapshots = []
+    for seconds, designs in [(10.0, 4), (20.0, 6)]:
+        metrics = StageMetrics()
+        metrics.add_time("design", seconds)
+        metrics.count(designs=designs, residues=designs * 100)
+        snapshot = metrics.snapshot()
+        snapshot["wall_seconds"] = seconds
+        snapshots.append(snapshot)
+
+    combined = combine_snapshots(snapshots)
+    assert combined["wall_seconds"] == 20.0
+    assert combined["stages"] == {"design": {"seconds": 30.0, "calls": 2}}
+    assert (combined["structures"], combined["designs"]) == (2, 10)
+    assert combined["designs_per_second"] == 0.5
+    assert combined["tasks"] == snapshots
+
+    messages = []
+    monkeypatch.setattr(wf.metrics, "message", lambda *args: messages.append(args))
+    report_metrics("Run metrics", combined)
+    assert messages[0][1]["body"].startswith("10 designs of 2 structures in 20.0s")
@@ -0,0 +1,85 @@
+import pyarrow.parquet as pq
+import pytest
+
+from wf.outputs import (
+    DESIGN_SCHEMA,
+    DESIGN_TABLE,
+    collect_design_tables,
+    read_design_result,
+    write_design_table,
+)
+
+NATIVE_HEADER = (
+    ">1ubi, T=0.1, seed=111, num_res=4, num_ligand_res=0, "
+    "use_ligand_context=True, ligand_cutoff_distance=8.0, batch_size=2, "
+    "number_of_batches=3, model_path=./model_params/ligandmpnn_v_32_010_25.pt"
+)
+
+
+def write_fasta(path, n_designs=5):
+    records = [f"{NATIVE_HEADER}\nMQIF"]
+    for i in range(1, n_designs + 1):
+        records.append(
+            f">1ubi, id={i}, T=0.1, seed=111, overall_confidence=0.{i}000, "
+            f"ligand_confidence=0.{i}500, seq_rec=0.2500\nMQI{'ACDEFG'[i]}"
+        )
+    path.write_text("\n".join(records))
+    return path
+
+
+def test_design_result_is_read_from_the_fasta(tmp_path):
+    result = read_design_result(write_fasta(tmp_path / "1ubi.fa"))
+    assert result.name == "1ubi"
+    assert result.seed == 111
+    assert result.native_sequence == "MQIF"
+    assert result.design_ids == [1, 2, 3, 4, 5]
+    assert result.sequences == ["MQIC", "MQID", "MQIE", "MQIF", "MQIG"]
+    assert result.overall_confidence == [0.1, 0.2, 0.3, 0.4, 0.5]
+    assert result.ligand_confidence == [0.15, 0.25, 0.35, 0.45, 0.55]
+    assert result.seq_rec == [0.25] * 5
+
+
+def test_design_table_has_one_row_group_per_batch(tmp_path):
+    result = read_design_result(write_fasta(tmp_path / "1ubi.fa"))
+    path = tmp_path / "1ubi" / DESIGN_TABLE
+    write_design_table(path, result, batch_size=2, temperature=0.1, sweep_index=3)
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.schema_arrow == DESIGN_SCHEMA
+    assert parquet_file.num_row_groups == 3
+    assert [
+        parquet_file.read_row_group(i).column("design_id").to_pylist()
+        for i in range(3)
+    ] == [[1, 2], [3, 4], [5]]
+
+    rows = pq.read_table(path).to_pylist()
+    assert [row["batch_index"] for row in rows] == [0, 0, 1, 1, 2]
+    assert [row["sequence"] for row in rows] == result.sequences
+    assert {row["pdb"] for row in rows} == {"1ubi"}
+    assert {row["sweep_index"] for row in rows} == {3}
+    assert {row["seed"] for row in rows} == {111}
+    assert [row["overall_confidence"] for row in rows] == pytest.approx(
+        result.overall_confidence
+    )
+
+
+def test_design_tables_are_collected_at_the_run_root(tmp_path):
+    result = read_design_result(write_fasta(tmp_path / "1ubi.fa"))
+    for name in ["a", "b"]:
+        result.name = name
+        write_design_table(
+            tmp_path / "out" / name / DESIGN_TABLE, result, 2, temperature=0.1
+        )
+
+    collect_design_tables(tmp_path / "out")
+
+    assert list((tmp_path / "out").rglob(DESIGN_TABLE)) == [
+        tmp_path / "out" / DESIGN_TABLE
+    ]
+    table = pq.read_table(tmp_path / "out" / DESIGN_TABLE)
+    assert table.column("pdb").to_pylist() == ["a"] * 5 + ["b"] * 5
+    assert pq.ParquetFile(tmp_path / "out" / DESIGN_TABLE).num_row_groups == 6
+
+    # A second collection, e.g. of a resumed run, leaves the root table alone
+    collect_design_tables(tmp_path / "out")
+    assert pq.read_table(tmp_path / "out" / DESIGN_TABLE).num_rows == 10
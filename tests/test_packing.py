@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import wf.packing
+from wf.metrics import METRICS, StageMetrics
+from wf.options import DesignOptions
+from wf.outputs import DesignResult
+
+
+@pytest.fixture
+def thread_pool(monkeypatch):
+    """Run pool jobs on threads of this process instead of spawned workers."""
+    monkeypatch.setattr(
+        wf.packing,
+        "ProcessPoolExecutor",
+        lambda max_workers, mp_context, initializer, initargs: ThreadPoolExecutor(
+            max_workers
+        ),
+    )
+
+
+class FakeTensor:
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+def test_pool_packs_in_chunks_and_runs_followups_in_order(thread_pool, monkeypatch):
+    jobs = []
+    release_first = threading.Event()
+
+    def pack_job(pdb_path, options, design_ids, S, out_folder, device):
+        if design_ids[0] == 1:
+            release_first.wait()
+        jobs.append((design_ids, S.tolist()))
+        metrics = StageMetrics()
+        metrics.add_time("packing", 1.0)
+        metrics.count(designs=len(design_ids), residues=0, structures=0)
+        return metrics.snapshot()
+
+    monkeypatch.setattr(wf.packing, "_pack_job", pack_job)
+    METRICS.reset()
+    events = []
+    pool = wf.packing.PackingPool(2, "cpu")
+    S = FakeTensor(np.arange(10).reshape(5, 2))
+    on_packed = lambda: events.append("a")  # noqa: E731
+    pool.submit("a.pdb", DesignOptions(), [1, 2, 3, 4, 5], S, "out", 2, on_packed)
+    pool.after_pending(lambda: events.append("all"))
+    assert events == []
+
+    release_first.set()
+    pool.close()
+    assert sorted(jobs) == [
+        ([1, 2], [[0, 1], [2, 3]]),
+        ([3, 4], [[4, 5], [6, 7]]),
+        ([5], [[8, 9]]),
+    ]
+    assert events == ["a", "all"]
+    assert METRICS.stages["packing"] == {"seconds": 3.0, "calls": 3}
+    assert METRICS.designs == 5
+
+
+def test_pool_close_raises_the_first_failure(thread_pool, monkeypatch):
+    def pack_job(pdb_path, options, design_ids, S, out_folder, device):
+        raise RuntimeError(f"cannot pack {design_ids}")
+
+    monkeypatch.setattr(wf.packing, "_pack_job", pack_job)
+    events = []
+    pool = wf.packing.PackingPool(1, "cpu")
+    pool.submit(
+        "a.pdb", DesignOptions(), [1, 2], FakeTensor(np.zeros((2, 3))), "out", 1
+    )
+    pool.after_pending(lambda: events.append("packed"))
+    with pytest.raises(RuntimeError, match=r"cannot pack \[1\]"):
+        pool.close()
+    assert events == []
+
+
+def test_top_k_designs_are_packed(needs_ligandmpnn):
+    from wf.engine import select_for_packing
+
+    result = DesignResult(
+        name="a",
+        seed=1,
+        native_sequence="A",
+        design_ids=[1, 2, 3, 4],
+        sequences=["A"] * 4,
+        overall_confidence=[0.2, 0.9, 0.1, 0.5],
+        ligand_confidence=[0.0] * 4,
+        seq_rec=[0.0] * 4,
+    )
+    assert select_for_packing(result, 0) == [0, 1, 2, 3]
+    assert select_for_packing(result, 2) == [1, 3]
+    assert select_for_packing(result, 4) == [0, 1, 2, 3]
+
+
+def test_packing_worker_never_builds_the_design_model(
+    needs_ligandmpnn, structures, tmp_path, monkeypatch
+):
+    import wf.engine
+
+    def load_model(self):
+        raise AssertionError("the design model was built")
+
+    monkeypatch.setattr(wf.engine, "_ENGINES", {})
+    monkeypatch.setattr(wf.engine.LigandMPNNEngine, "_load_model", load_model)
+    options = DesignOptions(pack_side_chains=1, number_of_packs_per_design=2)
+    S = np.zeros((2, 76), dtype=np.int64)
+
+    snapshot = wf.packing._pack_job(
+        structures / "1ubi.pdb", options, [3, 4], S, tmp_path, "cpu"
+    )
+
+    assert sorted(p.name for p in (tmp_path / "packed").iterdir()) == [
+        f"1ubi_packed_{i}_{j}.pdb" for i in [3, 4] for j in [1, 2]
+    ]
+    assert {"packer_load", "packing", "writing"} <= set(snapshot["stages"])
+    (engine,) = wf.engine._ENGINES.values()
+    assert engine._model is None
+    assert engine._packer is not None
@@ -0,0 +1,79 @@
+import pytest
+
+from wf.options import DesignOptions
+from wf.preflight import check_structure, read_residue_ids
+
+
+def atom(
+    chain: str,
+    number: int,
+    name: str = "CA",
+    residue: str = "ALA",
+    icode: str = " ",
+    occupancy: float = 1.0,
+    record: str = "ATOM  ",
+) -> str:
+    return (
+        f"{record}    1 {name:<4} {residue} {chain}{number:4d}{icode}   "
+        f"{1.0:8.3f}{2.0:8.3f}{3.0:8.3f}{occupancy:6.2f}{0.0:6.2f}\n"
+    )
+
+
+@pytest.fixture
+def pdb_path(tmp_path):
+    path = tmp_path / "scaffold.pdb"
+    path.write_text(
+        "".join(
+            [
+                atom("A", 1, name="N"),
+                atom("A", 1),
+                atom("A", 1),  # alternate location
+                atom("A", 12),
+                atom("A", 12, icode="B"),
+                atom("A", 13, residue="MSE", record="HETATM"),
+                atom("A", 14, occupancy=0.0),
+                atom("A", 15, name="N"),  # no CA
+                atom("B", 1),
+                atom("L", 1, residue="HEM", record="HETATM"),
+                "TER\n",
+                "ENDMDL\n",
+                atom("C", 1),
+            ]
+        )
+    )
+    return path
+
+
+def test_residue_ids(pdb_path):
+    assert read_residue_ids(pdb_path) == (
+        ("A", "A1"),
+        ("A", "A12"),
+        ("A", "A12B"),
+        ("A", "A13"),
+        ("B", "B1"),
+    )
+
+
+def test_zero_occupancy_residues_when_parsed(pdb_path):
+    residues = read_residue_ids(pdb_path, True)
+    assert ("A", "A14") in residues
+    assert residues.index(("A", "A14")) == residues.index(("A", "A13")) + 1
+
+
+def test_check_structure_names_missing_residues(pdb_path):
+    options = DesignOptions(
+        fixed_residues="A1 A12B A14",
+        chains_to_design="A,C",
+    )
+    assert check_structure(pdb_path, options) == [
+        "scaffold.pdb: chains_to_design chains not in the structure: C",
+        "scaffold.pdb: fixed_residues not in the structure: A14",
+    ]
+    assert check_structure(pdb_path, DesignOptions(fixed_residues="A1 A12B")) == []
+
+
+def test_check_structure_with_parsed_chains_only(pdb_path):
+    options = DesignOptions(parse_these_chains_only="B", fixed_residues="A1")
+    assert check_structure(pdb_path, options) == [
+        "scaffold.pdb: fixed_residues not in the structure: A1"
+    ]
@@ -0,0 +1,37 @@
+from functools import partial
+
+from wf.options import DesignOptions
+from wf.preflight import read_residue_ids
+
+
+def test_structure_split_into_parts_is_counted_once(
+    needs_ligandmpnn, structures, tmp_path, monkeypatch
+):
+    import wf.scoring
+    from wf.engine import get_engine
+    from wf.metrics import METRICS
+
+    engine = get_engine(DesignOptions(), "cpu")
+    length = len(read_residue_ids(structures / "1ubi.pdb"))
+    sequences = tmp_path / "sequences.fa"
+    sequences.write_text(
+        "".join(f">design_{i}\n{'A' * i}{'G' * (length - i)}\n" for i in range(5))
+    )
+    monkeypatch.setattr(
+        wf.scoring, "read_sequences", partial(wf.scoring.read_sequences, part_rows=2)
+    )
+
+    METRICS.reset()
+    parts = list(
+        wf.scoring.score_parts(
+            engine,
+            structures / "1ubi.pdb",
+            DesignOptions(),
+            sequences,
+            single_aa_score=True,
+        )
+    )
+    assert [len(table) for _, table in parts] == [2, 2, 1]
+    assert METRICS.structures == 1
+    assert METRICS.designs == 5
+    assert METRICS.residues == 5 * length
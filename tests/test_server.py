@@ -0,0 +1,127 @@
+import sys
+import threading
+import types
+
+import pytest
+
+from wf.options import DesignOptions
+from wf.outputs import DesignResult
+from wf.server import DesignRequest, DesignServer, RequestError
+
+
+class StubEngine:
+    """Stands in for the resident engine; designs wait for release."""
+
+    checkpoint_path = "stub.pt"
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def design(self, pdb_path, options, out_folder, batch_indices, packing=None):
+        self.started.set()
+        self.release.wait(10)
+        return DesignResult(
+            pdb_path.stem, options.seed, "A", [1], ["A"], [1.0], [1.0], [1.0]
+        )
+
+
+@pytest.fixture
+def make_server(monkeypatch, tmp_path):
+    engine = StubEngine()
+    monkeypatch.setitem(
+        sys.modules, "wf.engine", types.SimpleNamespace(get_engine=lambda *_: engine)
+    )
+
+    def make(**kwargs):
+        options = DesignOptions(auto_batch_size=1)
+        return DesignServer(options, "cpu", tmp_path / "out", **kwargs)
+
+    yield make
+    engine.release.set()
+
+
+@pytest.fixture
+def pdb_text(structures):
+    return (structures / "1ubi.pdb").read_text()
+
+
+def test_parse_request_writes_the_structure(make_server, pdb_text):
+    server = make_server()
+    request = server.parse_request(
+        {"pdb": pdb_text, "name": "ubq.pdb", "options": {"batch_size": 2}}
+    )
+    assert request.pdb_path.name == "ubq.pdb"
+    assert request.pdb_path.read_text() == pdb_text
+    assert request.options.batch_size == 2
+    assert request.out_folder.parent == server.output_dir
+
+
+@pytest.mark.parametrize(
+    "body, error",
+    [
+        ([], "JSON object"),
+        ({"pdb": "x", "options": ["batch_size"]}, "options must be"),
+        ({"pdb": "x", "options": {"batch_sise": 2}}, "Unknown options: batch_sise"),
+        ({"pdb": "x", "options": {"model_type": "protein_mpnn"}}, "model_type is"),
+        ({"pdb": "x", "options": {"temperature": "hot"}}, "Invalid options"),
+        ({"pdb": 42}, "pdb must be"),
+        ({"pdb_path": ["a.pdb"]}, "pdb_path must be"),
+        ({"pdb_path": "/no/such.pdb"}, "No such file"),
+        ({"options": {}}, "pdb_path or pdb"),
+        ({"pdb": "not a structure"}, "no protein residues"),
+    ],
+)
+def test_parse_request_rejects_bad_requests(make_server, body, error):
+    server = make_server()
+    with pytest.raises(RequestError, match=error):
+        server.parse_request(body)
+    assert list(server.output_dir.iterdir()) == []
+
+
+def test_parse_request_turns_unexpected_errors_into_request_errors(
+    make_server, monkeypatch, pdb_text
+):
+    def check_structure(pdb_path, options):
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+
+    monkeypatch.setattr("wf.server.check_structure", check_structure)
+    server = make_server()
+    with pytest.raises(RequestError, match="Cannot read the structure"):
+        server.parse_request({"pdb": pdb_text})
+    assert list(server.output_dir.iterdir()) == []
+
+
+def test_submit_refuses_requests_beyond_max_pending(make_server, structures):
+    server = make_server(max_pending=2, max_batch=1)
+
+    def request(name):
+        out_folder = server.output_dir / name
+        out_folder.mkdir()
+        return DesignRequest(structures / "1ubi.pdb", server.options, out_folder)
+
+    running = server.submit(request("running"))
+    assert server.engine.started.wait(10)
+    queued = server.submit(request("queued"))
+    assert server.submit(request("refused")) is None
+
+    server.engine.release.set()
+    assert running.result(10)["name"] == "1ubi"
+    assert queued.result(10)["name"] == "1ubi"
+    # Finished requests free their slots
+    assert server.submit(request("later")).result(10)["name"] == "1ubi"
+
+
+def test_next_batch_takes_at_most_max_batch(make_server, structures, tmp_path):
+    server = make_server(max_batch=2, batch_window=0.5)
+    # Hold the serving thread in a design so this test drains the queue
+    server.submit(DesignRequest(structures / "1ubi.pdb", server.options, tmp_path))
+    assert server.engine.started.wait(10)
+    requests = [
+        DesignRequest(structures / "1ubi.pdb", server.options, tmp_path)
+        for _ in range(3)
+    ]
+    for request in requests:
+        server._queue.put(request)
+    assert server._next_batch() == requests[:2]
+    assert server._next_batch() == requests[2:]
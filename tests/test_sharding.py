@@ -0,0 +1,66 @@
+import pytest
+
+from wf.execution import split_work
+from wf.options import DesignOptions
+from wf.outputs import merge_design_dirs, read_fasta_records
+
+
+@pytest.mark.parametrize("pdbs", [["a"], ["a", "b", "c"]])
+@pytest.mark.parametrize("number_of_parts", [1, 2, 3, 7])
+@pytest.mark.parametrize("split_batches", [True, False])
+def test_split_work_covers_every_batch_once(pdbs, number_of_parts, split_batches):
+    batch_indices = list(range(5))
+    parts = split_work(pdbs, batch_indices, number_of_parts, split_batches)
+
+    assert 1 <= len(parts) <= number_of_parts
+    covered = sorted(
+        (pdb, batch) for group, batches in parts for pdb in group for batch in batches
+    )
+    assert covered == sorted((pdb, batch) for pdb in pdbs for batch in batch_indices)
+    for _, batches in parts:
+        # Shards are merged in order, so each holds a contiguous range
+        assert batches == list(range(batches[0], batches[-1] + 1))
+
+
+@pytest.mark.parametrize(
+    "pdbs, number_of_batches",
+    [(["1ubi.pdb"], 4), (["1ubi.pdb", "3mht.pdb"], 2)],
+)
+def test_sharded_run_matches_single_node(
+    needs_ligandmpnn, structures, tmp_path, pdbs, number_of_batches
+):
+    from wf.task import run_designs
+
+    pdb_paths = [structures / pdb for pdb in pdbs]
+    options = DesignOptions(number_of_batches=number_of_batches, batch_size=2)
+    single = tmp_path / "single"
+    run_designs(
+        pdb_paths, options, single, per_pdb_outputs=True, execution_profile="cpu_small"
+    )
+
+    shard_dirs = []
+    for i, (group, batch_indices) in enumerate(
+        split_work(pdb_paths, list(range(number_of_batches)), 2)
+    ):
+        shard_dir = tmp_path / f"shard_{i}"
+        run_designs(
+            group,
+            options,
+            shard_dir,
+            per_pdb_outputs=True,
+            batch_indices=batch_indices,
+            execution_profile="cpu_small",
+        )
+        shard_dirs.append(shard_dir)
+    merged = tmp_path / "merged"
+    merge_design_dirs(shard_dirs, merged, per_pdb_outputs=True)
+
+    fastas = sorted(single.rglob("seqs/*.fa"))
+    assert len(fastas) == len(pdbs)
+    for fasta in fastas:
+        assert read_fasta_records(
+            merged / fasta.relative_to(single)
+        ) == read_fasta_records(fasta)
+    assert sorted(
+        p.relative_to(merged) for p in merged.rglob("backbones/*.pdb")
+    ) == sorted(p.relative_to(single) for p in single.rglob("backbones/*.pdb"))
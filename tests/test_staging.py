@@ -0,0 +1,78 @@
+import hashlib
+import shutil
+from pathlib import Path
+
+import pytest
+
+from wf import cache, staging
+from wf.staging import CHECKSUM_SUFFIX, MISSING_PATH, _download
+
+REMOTE = "latch://1.account/inputs/scaffold.pdb"
+CONTENT = b"ATOM      1  CA  ALA A   1\nEND\n"
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """Latch Data stand-in backed by a local directory; corrupt holds the
+    number of downloads still to be damaged."""
+    root = tmp_path / "remote"
+    corrupt = []
+
+    def local(path: str) -> Path:
+        return root / path[len("latch://") :]
+
+    class LocalLPath:
+        def __init__(self, path: str):
+            self.path = local(path)
+
+        def size(self) -> int:
+            return self.path.stat().st_size
+
+        def download(self, dst: Path) -> None:
+            if not self.path.exists():
+                error = staging.LatchPathError(MISSING_PATH)
+                error.message = MISSING_PATH
+                raise error
+            shutil.copy(self.path, dst)
+            if corrupt:
+                corrupt.pop()
+                dst.write_bytes(dst.read_bytes().replace(b"A", b"G"))
+
+    monkeypatch.setattr(staging, "LPath", LocalLPath)
+    monkeypatch.setattr(cache, "_file_digests", {})
+    path = local(REMOTE)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(CONTENT)
+    return path, corrupt
+
+
+def write_checksum(path: Path, content: bytes) -> None:
+    digest = hashlib.sha256(content).hexdigest()
+    path.with_name(path.name + CHECKSUM_SUFFIX).write_text(f"{digest}  {path.name}\n")
+
+
+def test_download_is_checked_against_the_checksum_file(remote, tmp_path):
+    path, corrupt = remote
+    write_checksum(path, CONTENT)
+    # Same size, different bytes: only the checksum notices
+    corrupt.append(1)
+    local_path = _download(REMOTE, tmp_path / "local" / "scaffold.pdb")
+    assert local_path.read_bytes() == CONTENT
+    assert corrupt == []
+    assert not list(local_path.parent.glob(f"*{CHECKSUM_SUFFIX}"))
+
+
+def test_download_fails_when_it_never_matches(remote, tmp_path):
+    path, corrupt = remote
+    write_checksum(path, b"other content")
+    with pytest.raises(IOError, match="SHA-256"):
+        _download(REMOTE, tmp_path / "local" / "scaffold.pdb")
+
+
+def test_download_without_checksum_file_compares_size(remote, tmp_path):
+    path, corrupt = remote
+    corrupt.append(1)
+    local_path = _download(REMOTE, tmp_path / "local" / "scaffold.pdb")
+    # The damaged copy has the right size, so it is accepted
+    assert local_path.read_bytes() != CONTENT
+    assert corrupt == []
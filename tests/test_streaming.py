@@ -0,0 +1,101 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from wf import streaming
+from wf.streaming import MANIFEST, OutputStream, chunk_batches
+
+REMOTE = "latch://1.account/runs/run"
+PARTS = f"{REMOTE}/.parts/shard_0"
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """Latch Data stand-in backed by a local directory."""
+    root = tmp_path / "remote"
+
+    def local(path: str) -> Path:
+        return root / path[len("latch://") :]
+
+    class LocalLPath:
+        def __init__(self, path: str):
+            self.path = local(path)
+
+        def upload_from(self, src: Path) -> None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(src, self.path)
+
+        def download(self, dst: Path) -> None:
+            shutil.copy(self.path, dst)
+
+    def download_if_exists(remote_path: str, local_path: Path) -> bool:
+        if not local(remote_path).exists():
+            return False
+        shutil.copy(local(remote_path), local_path)
+        return True
+
+    monkeypatch.setattr(streaming, "LPath", LocalLPath)
+    monkeypatch.setattr(streaming, "download_if_exists", download_if_exists)
+    return local
+
+
+def write_chunk(chunk_dir: Path) -> None:
+    (chunk_dir / "scaffold" / "seqs").mkdir(parents=True)
+    (chunk_dir / "scaffold" / "seqs" / "scaffold.fa").write_text(">scaffold\nAG\n")
+    (chunk_dir / "scaffold" / "backbones").mkdir()
+    (chunk_dir / "scaffold" / "backbones" / "scaffold_1.pdb").write_text("END\n")
+
+
+def upload_chunk(chunk_dir: Path, fingerprint: str = "run") -> None:
+    write_chunk(chunk_dir)
+    stream = OutputStream(REMOTE, PARTS, fingerprint, per_pdb_outputs=True)
+    stream.submit("chunk_0", chunk_dir)
+    stream.close()
+
+
+def test_uploaded_chunk_is_recorded(remote, tmp_path):
+    chunk_dir = tmp_path / "chunk_0"
+    upload_chunk(chunk_dir)
+
+    assert remote(f"{REMOTE}/scaffold/backbones/scaffold_1.pdb").exists()
+    # Final files are durable remotely, so they are not sent again
+    assert not (chunk_dir / "scaffold" / "backbones" / "scaffold_1.pdb").exists()
+    assert remote(f"{PARTS}/chunk_0/scaffold/seqs/scaffold.fa").exists()
+    assert remote(f"{PARTS}/{MANIFEST}").exists()
+
+
+def test_restart_resumes_from_the_manifest(remote, tmp_path):
+    upload_chunk(tmp_path / "chunk_0")
+
+    stream = OutputStream(REMOTE, PARTS, "run", per_pdb_outputs=True)
+    assert stream.is_durable("chunk_0")
+    assert not stream.is_durable("chunk_1")
+    restored = tmp_path / "restored"
+    stream.restore("chunk_0", restored)
+    assert (restored / "scaffold" / "seqs" / "scaffold.fa").read_text() == (
+        ">scaffold\nAG\n"
+    )
+    assert not (restored / "scaffold" / "backbones").exists()
+
+
+def test_changed_run_starts_over(remote, tmp_path):
+    upload_chunk(tmp_path / "chunk_0")
+
+    stream = OutputStream(REMOTE, PARTS, "other run", per_pdb_outputs=True)
+    assert not stream.is_durable("chunk_0")
+
+
+def test_unreadable_manifest_starts_over(remote, tmp_path):
+    manifest = remote(f"{PARTS}/{MANIFEST}")
+    manifest.parent.mkdir(parents=True)
+    manifest.write_text("{")
+
+    stream = OutputStream(REMOTE, PARTS, "run", per_pdb_outputs=True)
+    assert stream.manifest == {"fingerprint": "run", "chunks": {}}
+
+
+def test_batches_are_chunked_in_order():
+    assert chunk_batches([3, 4, 5, 6, 7], 2) == [[3, 4], [5, 6], [7]]
+    assert chunk_batches([3, 4, 5], 0) == [[3], [4], [5]]
+    assert chunk_batches([], 2) == []
@@ -0,0 +1,97 @@
+import csv
+from contextlib import nullcontext
+from pathlib import Path
+
+import pytest
+
+from wf.options import DesignOptions
+from wf.outputs import DesignResult
+from wf.sweep import (
+    SWEEP_TABLE,
+    load_sweep,
+    parse_sweep_grid,
+    read_sweep_csv,
+    run_sweep,
+)
+
+
+def test_grid_expands_to_every_combination():
+    rows = parse_sweep_grid("temperature=0.1|0.2; seed=1|2;bias_AA=W:3.0,P:3.0|A:-1.0")
+    assert len(rows) == 8
+    assert rows[0] == {"temperature": 0.1, "seed": 1, "bias_AA": "W:3.0,P:3.0"}
+    assert rows[-1] == {"temperature": 0.2, "seed": 2, "bias_AA": "A:-1.0"}
+    assert all(isinstance(row["temperature"], float) for row in rows)
+    assert all(isinstance(row["seed"], int) for row in rows)
+
+
+@pytest.mark.parametrize(
+    "spec, error",
+    [
+        ("temperature", "name=value"),
+        ("temperature=0.1;seed", "name=value"),
+        ("batch_size=1|2", "Cannot sweep over batch_size"),
+        ("seed=one", "invalid literal"),
+        ("temperature=hot", "could not convert"),
+    ],
+)
+def test_malformed_grid_is_rejected(spec, error):
+    with pytest.raises(ValueError, match=error):
+        parse_sweep_grid(spec)
+
+
+def test_csv_rows_are_coerced_and_empty_cells_skipped(tmp_path):
+    path = tmp_path / "sweep.csv"
+    path.write_text("temperature, seed,fixed_residues\n0.3,7,A1 A2\n,8,\n")
+    assert read_sweep_csv(path) == [
+        {"temperature": 0.3, "seed": 7, "fixed_residues": "A1 A2"},
+        {"seed": 8},
+    ]
+
+
+def test_csv_with_unknown_column_is_rejected(tmp_path):
+    path = tmp_path / "sweep.csv"
+    path.write_text("temperature,number_of_batches\n0.1,2\n")
+    with pytest.raises(ValueError, match="Cannot sweep over number_of_batches"):
+        read_sweep_csv(path)
+
+
+def test_grid_and_csv_rows_are_combined(tmp_path):
+    path = tmp_path / "sweep.csv"
+    path.write_text("seed\n5\n")
+    assert load_sweep("temperature=0.1|0.2", path) == [
+        {"temperature": 0.1},
+        {"temperature": 0.2},
+        {"seed": 5},
+    ]
+    assert load_sweep(None, None) is None
+
+
+class StubEngine:
+    checkpoint_path = "stub.pt"
+
+    def reuse_encodings(self):
+        return nullcontext()
+
+    def design(self, pdb_path, options, out_folder, batch_indices, packing=None):
+        sequence = "G" if options.temperature > 0.15 else "A"
+        return DesignResult(
+            Path(pdb_path).stem, options.seed, "M", [1], [sequence], [0.5], [1.0], [0.0]
+        )
+
+
+def test_sweep_rows_go_to_numbered_folders(tmp_path):
+    rows = parse_sweep_grid("temperature=0.1|0.2")
+    results = run_sweep(
+        StubEngine(), None, Path("scaffold.pdb"), DesignOptions(), rows, tmp_path, [0]
+    )
+    assert [result.sequences for result in results] == [["A"], ["G"]]
+    assert sorted(p.name for p in tmp_path.glob("sweep_*")) == [
+        "sweep_0000",
+        "sweep_0001",
+    ]
+    with open(tmp_path / SWEEP_TABLE, newline="") as f:
+        table = list(csv.DictReader(f))
+    assert [(row["sweep_index"], row["temperature"]) for row in table] == [
+        ("0", "0.1"),
+        ("1", "0.2"),
+    ]
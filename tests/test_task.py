@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import pytest
+
+from wf.options import DesignOptions
+
+
+def test_micro_batches_match_per_structure_designs(
+    needs_ligandmpnn, structures, tmp_path, monkeypatch
+):
+    import wf.task
+    from wf.task import run_designs
+
+    pdb_paths = [structures / "1ubi.pdb", structures / "3mht.pdb"]
+    options = DesignOptions(
+        auto_batch_size=1, batch_size=2, number_of_batches=2, seed=5
+    )
+    micro_batches = []
+    design_structures = wf.task.design_structures
+
+    def spy(engine, cache, group, *args):
+        micro_batches.append([pdb_path.name for pdb_path in group])
+        return design_structures(engine, cache, group, *args)
+
+    monkeypatch.setattr(wf.task, "design_structures", spy)
+    run_designs(
+        pdb_paths,
+        options,
+        tmp_path / "together",
+        per_pdb_outputs=True,
+        execution_profile="cpu_small",
+        design_workers=1,
+    )
+    assert micro_batches == [["1ubi.pdb", "3mht.pdb"]]
+
+    for pdb_path in pdb_paths:
+        run_designs(
+            [pdb_path],
+            options,
+            tmp_path / "alone",
+            per_pdb_outputs=True,
+            execution_profile="cpu_small",
+            design_workers=1,
+        )
+    assert len(micro_batches) == 1
+
+    for pdb_path in pdb_paths:
+        fasta = f"{pdb_path.stem}/seqs/{pdb_path.stem}.fa"
+        together = (tmp_path / "together" / fasta).read_text()
+        alone = (tmp_path / "alone" / fasta).read_text()
+        assert together == alone
+        assert len(together.splitlines()) == 2 * (1 + 4)
+
+
+@pytest.mark.parametrize("auto_batch_size, expected", [(1, True), (0, False)])
+def test_only_per_design_seeds_are_micro_batched(auto_batch_size, expected):
+    from wf.execution import can_micro_batch
+
+    options = DesignOptions(auto_batch_size=auto_batch_size)
+    pdb_paths = [Path("a.pdb"), Path("b.pdb")]
+    assert can_micro_batch(pdb_paths, options, None) is expected
+    assert not can_micro_batch(pdb_paths[:1], options, None)
+    assert not can_micro_batch(pdb_paths, options, [{"temperature": 0.2}])
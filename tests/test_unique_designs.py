@@ -0,0 +1,58 @@
+import pytest
+
+from wf.options import DesignOptions
+
+
+@pytest.fixture
+def torch(needs_ligandmpnn):
+    import torch
+
+    return torch
+
+
+def test_first_design_of_each_sequence_is_kept(torch):
+    from wf.engine import UniqueDesigns
+
+    unique = UniqueDesigns(target=3)
+    S = torch.tensor([[1, 2], [1, 2], [3, 4]])
+    assert unique.select(S, torch.zeros(3)) == [0, 2]
+    assert not unique.done
+
+    S = torch.tensor([[3, 4], [5, 6], [7, 8]])
+    assert unique.select(S, torch.zeros(3)) == [1]
+    assert unique.done
+    assert unique.sampled == 6
+
+
+def test_designs_below_min_confidence_are_dropped(torch):
+    from wf.engine import UniqueDesigns
+
+    unique = UniqueDesigns(target=5, min_confidence=0.5)
+    S = torch.tensor([[1], [2], [3]])
+    # Confidence is exp(-loss): 0.9, 0.3, 0.6
+    loss = -torch.log(torch.tensor([0.9, 0.3, 0.6]))
+    assert unique.select(S, loss) == [0, 2]
+    # A dropped sequence can still be kept when it comes back confident
+    assert unique.select(S[1:2], torch.zeros(1)) == [0]
+
+
+def test_sampling_stops_at_the_target(torch, structures, tmp_path, capsys):
+    from wf.engine import get_engine
+
+    engine = get_engine(DesignOptions(), "cpu")
+    options = DesignOptions(temperature=1.0, batch_size=2, number_of_batches=6)
+    everything = engine.design(structures / "1ubi.pdb", options, tmp_path / "all")
+    expected = {}
+    for design_id, sequence in zip(everything.design_ids, everything.sequences):
+        expected.setdefault(sequence, design_id)
+    expected_ids = sorted(expected.values())[:3]
+
+    options.unique_designs = 3
+    capsys.readouterr()
+    result = engine.design(structures / "1ubi.pdb", options, tmp_path / "unique")
+
+    assert result.design_ids == expected_ids
+    assert result.sequences == [everything.sequences[i - 1] for i in expected_ids]
+    # Batches of two are sampled only until three distinct designs are kept
+    sampled = 2 * ((expected_ids[-1] + 1) // 2)
+    assert f"Kept 3 unique designs of {sampled} sampled" in capsys.readouterr().out
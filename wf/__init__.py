@@ -1,8 +1,10 @@
 from typing import Optional
 
+from latch.resources.conditional import create_conditional_section
 from latch.resources.launch_plan import LaunchPlan
+from latch.resources.map_tasks import map_task
 from latch.resources.workflow import workflow
-from latch.types.directory import LatchOutputDir
+from latch.types.directory import LatchDir, LatchOutputDir
 from latch.types.file import LatchFile
 from latch.types.metadata import (
     LatchAuthor,
@@ -14,7 +16,15 @@ from latch.types.metadata import (
     Text,
 )
 
-from wf.task import ligandmpnn_task
+from wf.sharding import (
+    ligandmpnn_shard_task,
+    ligandmpnn_shard_task_cpu_large,
+    ligandmpnn_shard_task_cpu_medium,
+    ligandmpnn_shard_task_cpu_small,
+    merge_shards_task,
+    plan_shards_task,
+    remove_stream_parts_task,
+)
 
 flow = [
     Section(
@@ -22,6 +32,12 @@ flow = [
         Params(
             "input_pdb",
         ),
+        Text(
+            "To design many scaffolds in one run, provide a directory of PDB files instead. The model is loaded once and every structure is streamed through it, with outputs written to one subfolder per PDB."
+        ),
+        Params(
+            "input_pdb_directory",
+        ),
         Text("The input PDB file can contain:"),
         Text(
             "- Protein backbone coordinates: The file should include the 3D coordinates for the main chain atoms (N, Cα, C, O) of each residue in the protein structure."
@@ -42,8 +58,14 @@ flow = [
     Section(
         "Output",
         Params("run_name"),
-        Text("Directory for outputs"),
+        Text(
+            "Directory for outputs. Besides the FASTA files, every design is listed in designs.parquet with its structure, batch, seed, temperature, sequence and scores."
+        ),
         Params("output_directory"),
+        Text(
+            "After designing, every design is compared with the native sequence (overall and at the pocket residues near the ligand, which needs save_stats) and with the other designs of its structure. The metrics go to design_metrics.parquet, amino acid compositions to composition.csv and the best designs by overall confidence to top_designs.csv."
+        ),
+        Params("top_k_designs"),
     ),
     Section(
         "Model Configuration",
@@ -54,6 +76,39 @@ flow = [
             "temperature",
             "number_of_batches",
             "batch_size",
+            "auto_batch_size",
+        ),
+        Spoiler(
+            "Unique Designs",
+            Text(
+                "At low temperature many sampled sequences are duplicates. Set a target number of unique designs to stop sampling once it is reached; number_of_batches then caps how much is sampled. Only the first design of each distinct sequence is kept, optionally only above a confidence threshold."
+            ),
+            Params("unique_designs", "min_confidence"),
+        ),
+        Spoiler(
+            "Large Complexes",
+            Text(
+                "For big assemblies with many chains or dense nucleic acid and ligand context, low-memory mode finds neighbours and computes edge features in blocks instead of over all residue pairs. With automatic batch sizing and only part of the complex designed (fixed residues or chains_to_design), sampling also runs on a cropped context: the designed residues and the neighbours within reach of the model's message passing. Designed sequences and confidences match a full run up to float rounding; saved per-residue probabilities are zero at fixed residues outside the crop."
+            ),
+            Params("low_memory"),
+        ),
+        Spoiler(
+            "Parallel Execution",
+            Text(
+                "The batches (and, for a PDB directory, the structures) are split into shards that run in parallel. Every batch has its own seed derived from the run seed, so the merged output is identical to a single-node run."
+            ),
+            Params("number_of_shards"),
+            Text(
+                "Small proteins design quickly on CPU. CPU profiles detect the available cores and by default run one single-threaded design worker per core."
+            ),
+            Params("execution_profile", "design_workers"),
+        ),
+        Spoiler(
+            "Result Cache",
+            Text(
+                "Designs are cached by the content of the input PDB, the checkpoint and the options that affect sampling, so renaming a run or toggling statistics reuses earlier results. Because every batch seed is part of the key, a cache hit returns exactly the sequences a fresh run would produce."
+            ),
+            Params("use_result_cache", "result_cache_path"),
         ),
         Spoiler(
             "LigandMPNN Options",
@@ -70,6 +125,13 @@ flow = [
             "number_of_packs_per_design",
             "pack_with_ligand_context",
         ),
+        Spoiler(
+            "Packing Throughput",
+            Text(
+                "Packing can run on its own worker processes, fed with sampled sequences while sampling continues. It can also be limited to the most confident designs."
+            ),
+            Params("pack_top_k", "packing_workers"),
+        ),
     ),
     Spoiler(
         "Residue Selection",
@@ -82,6 +144,9 @@ flow = [
     ),
     Spoiler(
         "Amino Acid Biases and Restrictions",
+        Text(
+            "Constraint files are converted once per node into an index keyed by PDB and residue, so a file covering a whole library costs each task only the entries it uses. An index built ahead of time with 'python -m wf.constraints' can be given in place of the JSON file."
+        ),
         Params(
             "bias_AA",
             "bias_AA_jsonl",
@@ -99,11 +164,26 @@ flow = [
             "homo_oligomer",
         ),
     ),
+    Spoiler(
+        "Parameter Sweep",
+        Text(
+            "Run every combination of temperature, seed, biases, omissions or residue selections in one task. A grid such as 'temperature=0.1|0.2;seed=1|2;bias_AA=W:3.0|A:-1.0' expands to all combinations; a CSV lists one combination per row with option names as columns. Each structure is encoded once and only decoding repeats. Designs of combination i, counting from 0, go to a folder numbered with four digits (sweep_0000/, sweep_0001/, ...) and every design is listed in sweep.csv."
+        ),
+        Params("sweep_grid", "sweep_csv"),
+    ),
+    Spoiler(
+        "Score Existing Sequences",
+        Text(
+            "Instead of designing, score sequences from a FASTA, CSV, TSV or Parquet file (a 'sequence' column, optionally 'name' and 'pdb') against the input structures. Each structure is encoded once and only the decoder runs per sequence, so large variant libraries can be ranked. Per-residue, total and mean log-likelihoods are written as Parquet parts under scores/, averaged over number_of_batches random decoding orders."
+        ),
+        Params("sequences_to_score", "single_aa_score"),
+    ),
     Spoiler(
         "Advanced Options",
         Params(
             "save_stats",
             "parse_atoms_with_zero_occupancy",
+            "stream_outputs",
         ),
     ),
 ]
@@ -127,6 +207,11 @@ metadata = LatchMetadata(
             description="Input PDB file",
             batch_table_column=True,
         ),
+        "input_pdb_directory": LatchParameter(
+            display_name="Input PDB Directory",
+            description="Directory of PDB files to design in a single batch run",
+            batch_table_column=True,
+        ),
         "output_directory": LatchParameter(
             display_name="Output Directory",
             description="Directory to write output files",
@@ -138,7 +223,7 @@ metadata = LatchMetadata(
         ),
         "seed": LatchParameter(
             display_name="Seed",
-            description="Random seed (default: 111)",
+            description="Random seed (default: 111). With automatic batch sizing off, every batch is seeded as in LigandMPNN's run.py; with it on, every design is seeded on its own, so the same seed gives different sequences in the two modes",
         ),
         "temperature": LatchParameter(
             display_name="Temperature",
@@ -152,9 +237,45 @@ metadata = LatchMetadata(
             display_name="Batch Size",
             description="Number of sequences per batch",
         ),
+        "auto_batch_size": LatchParameter(
+            display_name="Automatic Batch Size",
+            description="Still produce batch_size x number_of_batches designs, but sample as many per call as fit in GPU or host memory, backing off on out-of-memory errors. Each design is seeded by the seed and its id, so a design is the same whichever designs share its call and on any device, and with a directory of PDBs several structures of similar length share each call. These per-design seeds differ from the per-batch seeds used without automatic batch sizing, so switching this on changes the sequences a seed produces (0 or 1)",
+        ),
+        "low_memory": LatchParameter(
+            display_name="Low Memory",
+            description="Blockwise neighbour search and edge features, and a cropped context around the designed residues, so large complexes fit on small nodes (0 or 1)",
+        ),
+        "unique_designs": LatchParameter(
+            display_name="Unique Designs",
+            description="Stop sampling a structure once this many distinct sequences are found, keeping only those (0 keeps every design)",
+        ),
+        "min_confidence": LatchParameter(
+            display_name="Minimum Confidence",
+            description="With unique designs, only keep designs with at least this overall confidence",
+        ),
+        "number_of_shards": LatchParameter(
+            display_name="Number of Shards",
+            description="Number of parallel tasks to split the design batches across",
+        ),
+        "execution_profile": LatchParameter(
+            display_name="Execution Profile",
+            description="Node type for the design tasks: gpu, cpu_small (2 cores), cpu_medium (32 cores) or cpu_large (96 cores)",
+        ),
+        "design_workers": LatchParameter(
+            display_name="Design Workers",
+            description="Design worker processes per CPU task (0 for one single-threaded worker per core)",
+        ),
+        "use_result_cache": LatchParameter(
+            display_name="Use Result Cache",
+            description="Reuse designs from earlier runs with the same structure and sampling options (0 or 1)",
+        ),
+        "result_cache_path": LatchParameter(
+            display_name="Result Cache Location",
+            description="Latch directory shared between runs to store cached designs (e.g. 'latch:///LigandMPNN/.cache'); without it the cache is node-local",
+        ),
         "checkpoint_ligand_mpnn": LatchParameter(
             display_name="LigandMPNN Checkpoint",
-            description="Path to LigandMPNN checkpoint file",
+            description="Path to LigandMPNN checkpoint file; latch:// and s3:// paths are downloaded once and cached on the node",
         ),
         "ligand_mpnn_use_atom_context": LatchParameter(
             display_name="Use Atom Context",
@@ -194,7 +315,7 @@ metadata = LatchMetadata(
         ),
         "bias_AA_jsonl": LatchParameter(
             display_name="Per-residue AA Bias JSONL",
-            description="JSONL file specifying per-residue amino acid biases",
+            description="JSONL file specifying per-residue amino acid biases, keyed by PDB name",
         ),
         "omit_AA": LatchParameter(
             display_name="Global AA Omission",
@@ -202,7 +323,7 @@ metadata = LatchMetadata(
         ),
         "omit_AA_jsonl": LatchParameter(
             display_name="Per-residue AA Omission JSONL",
-            description="JSONL file specifying per-residue amino acid omissions",
+            description="JSONL file specifying per-residue amino acid omissions, keyed by PDB name",
         ),
         "save_stats": LatchParameter(
             display_name="Save Statistics",
@@ -236,6 +357,38 @@ metadata = LatchMetadata(
             display_name="Parse Atoms with Zero Occupancy",
             description="Parse atoms in the PDB files with zero occupancy (0 or 1)",
         ),
+        "stream_outputs": LatchParameter(
+            display_name="Stream Outputs",
+            description="Upload designs as batches finish and resume a restarted run from its last uploaded batch (0 or 1)",
+        ),
+        "pack_top_k": LatchParameter(
+            display_name="Pack Top K",
+            description="Only pack the K designs per structure with the highest overall confidence (0 packs every design)",
+        ),
+        "packing_workers": LatchParameter(
+            display_name="Packing Workers",
+            description="Worker processes that pack side chains while sequences are still being sampled (0 packs inline)",
+        ),
+        "sweep_grid": LatchParameter(
+            display_name="Sweep Grid",
+            description="Options to sweep as 'name=value|value;name=value|value', e.g. 'temperature=0.1|0.2;seed=1|2'",
+        ),
+        "sweep_csv": LatchParameter(
+            display_name="Sweep CSV",
+            description="CSV with one sweep combination per row and option names (temperature, seed, bias_AA, ...) as columns",
+        ),
+        "sequences_to_score": LatchParameter(
+            display_name="Sequences to Score",
+            description="FASTA, CSV, TSV or Parquet file of sequences to score against the input structures instead of designing new ones",
+        ),
+        "top_k_designs": LatchParameter(
+            display_name="Top K Designs",
+            description="Number of designs listed in top_designs.csv, ranked by overall confidence (0 skips the design metrics)",
+        ),
+        "single_aa_score": LatchParameter(
+            display_name="Single Amino Acid Score",
+            description="Score each position given only the structure rather than autoregressively given the rest of the sequence (0 or 1)",
+        ),
     },
     flow=flow,
 )
@@ -244,19 +397,31 @@ metadata = LatchMetadata(
 @workflow(metadata)
 def ligandmpnn_workflow(
     run_name: str,
-    input_pdb: LatchFile,
+    input_pdb: Optional[LatchFile] = None,
+    input_pdb_directory: Optional[LatchDir] = None,
     output_directory: LatchOutputDir = LatchOutputDir("latch:///LigandMPNN"),
     model_type: str = "ligand_mpnn",
     seed: int = 111,
     temperature: float = 0.1,
     number_of_batches: int = 1,
     batch_size: int = 1,
+    auto_batch_size: int = 0,
+    low_memory: int = 0,
+    unique_designs: int = 0,
+    min_confidence: float = 0.0,
+    number_of_shards: int = 1,
+    execution_profile: str = "gpu",
+    design_workers: int = 0,
+    use_result_cache: int = 1,
+    result_cache_path: Optional[str] = None,
     checkpoint_ligand_mpnn: Optional[str] = None,
     ligand_mpnn_use_atom_context: int = 1,
     ligand_mpnn_use_side_chain_context: int = 0,
     pack_side_chains: int = 0,
     number_of_packs_per_design: int = 0,
     pack_with_ligand_context: int = 1,
+    pack_top_k: int = 0,
+    packing_workers: int = 0,
     fixed_residues: Optional[str] = None,
     redesigned_residues: Optional[str] = None,
     chains_to_design: Optional[str] = None,
@@ -272,6 +437,12 @@ def ligandmpnn_workflow(
     bias_AA_per_residue_jsonl: Optional[LatchFile] = None,
     omit_AA_per_residue_jsonl: Optional[LatchFile] = None,
     parse_atoms_with_zero_occupancy: int = 0,
+    sweep_grid: Optional[str] = None,
+    sweep_csv: Optional[LatchFile] = None,
+    stream_outputs: int = 1,
+    sequences_to_score: Optional[LatchFile] = None,
+    single_aa_score: int = 0,
+    top_k_designs: int = 100,
 ) -> LatchOutputDir:
     """
     LigandMPNN: Deep learning-based protein sequence design method that allows explicit modeling of small molecule, nucleotide, metal, and other atomic contexts.
@@ -375,21 +546,33 @@ def ligandmpnn_workflow(
     bioRxiv 2023.12.22.573103; doi: https://doi.org/10.1101/2023.12.22.573103
 
     """
-    return ligandmpnn_task(
+    shards = plan_shards_task(
         run_name=run_name,
         input_pdb=input_pdb,
+        input_pdb_directory=input_pdb_directory,
         output_directory=output_directory,
+        number_of_shards=number_of_shards,
+        execution_profile=execution_profile,
+        design_workers=design_workers,
+        use_result_cache=use_result_cache,
+        result_cache_path=result_cache_path,
         model_type=model_type,
         seed=seed,
         temperature=temperature,
         number_of_batches=number_of_batches,
         batch_size=batch_size,
+        auto_batch_size=auto_batch_size,
+        low_memory=low_memory,
+        unique_designs=unique_designs,
+        min_confidence=min_confidence,
         checkpoint_ligand_mpnn=checkpoint_ligand_mpnn,
         ligand_mpnn_use_atom_context=ligand_mpnn_use_atom_context,
         ligand_mpnn_use_side_chain_context=ligand_mpnn_use_side_chain_context,
         pack_side_chains=pack_side_chains,
         number_of_packs_per_design=number_of_packs_per_design,
         pack_with_ligand_context=pack_with_ligand_context,
+        pack_top_k=pack_top_k,
+        packing_workers=packing_workers,
         fixed_residues=fixed_residues,
         redesigned_residues=redesigned_residues,
         chains_to_design=chains_to_design,
@@ -405,7 +588,33 @@ def ligandmpnn_workflow(
         bias_AA_per_residue_jsonl=bias_AA_per_residue_jsonl,
         omit_AA_per_residue_jsonl=omit_AA_per_residue_jsonl,
         parse_atoms_with_zero_occupancy=parse_atoms_with_zero_occupancy,
+        sweep_grid=sweep_grid,
+        sweep_csv=sweep_csv,
+        stream_outputs=stream_outputs,
+        sequences_to_score=sequences_to_score,
+        single_aa_score=single_aa_score,
+    )
+
+    shard_outputs = (
+        create_conditional_section("execution_profile")
+        .if_(execution_profile == "cpu_small")
+        .then(map_task(ligandmpnn_shard_task_cpu_small)(shard=shards))
+        .elif_(execution_profile == "cpu_medium")
+        .then(map_task(ligandmpnn_shard_task_cpu_medium)(shard=shards))
+        .elif_(execution_profile == "cpu_large")
+        .then(map_task(ligandmpnn_shard_task_cpu_large)(shard=shards))
+        .else_()
+        .then(map_task(ligandmpnn_shard_task)(shard=shards))
+    )
+
+    merged_output = merge_shards_task(
+        run_name=run_name,
+        shards=shards,
+        shard_outputs=shard_outputs,
+        output_directory=output_directory,
+        top_k_designs=top_k_designs,
     )
+    return remove_stream_parts_task(shards=shards, merged_output=merged_output)
 
 
 LaunchPlan(
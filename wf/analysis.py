@@ -0,0 +1,310 @@
+import argparse
+import csv
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wf.constraints import ALPHABET
+from wf.outputs import DESIGN_TABLE
+from wf.scoring import encode_sequences
+
+METRICS_TABLE = "design_metrics.parquet"
+TOP_DESIGNS = "top_designs.csv"
+COMPOSITION_TABLE = "composition.csv"
+
+RANK_COLUMNS = [
+    "overall_confidence",
+    "ligand_confidence",
+    "seq_rec",
+    "identity_to_native",
+    "pocket_recovery",
+    "mean_distance",
+]
+# Top designs compared at once; a block of the one-hot matrix product is
+# PAIRWISE_CHUNK x (designs ranked above)
+PAIRWISE_CHUNK = 1024
+
+METRICS_SCHEMA = pa.schema(
+    [
+        ("pdb", pa.dictionary(pa.int32(), pa.string())),
+        ("sweep_index", pa.int32()),
+        ("design_id", pa.int32()),
+        ("rank", pa.int32()),
+        ("overall_confidence", pa.float32()),
+        ("ligand_confidence", pa.float32()),
+        ("seq_rec", pa.float32()),
+        ("identity_to_native", pa.float32()),
+        ("pocket_recovery", pa.float32()),
+        ("mean_distance", pa.float32()),
+    ]
+)
+
+
+def read_natives(local_output_dir: Path) -> Dict[str, str]:
+    """Native sequence of every structure, from the first FASTA record."""
+    natives = {}
+    for path in sorted(local_output_dir.rglob("seqs/*.fa")):
+        with open(path) as f:
+            header = f.readline()
+            lines = []
+            for line in f:
+                if line.startswith(">"):
+                    break
+                lines.append(line.strip())
+        natives.setdefault(header[1:].split(",")[0].strip(), "".join(lines))
+    return natives
+
+
+def read_pocket_masks(local_output_dir: Path) -> Dict[str, np.ndarray]:
+    """Designable residues within the ligand cutoff, from save_stats files."""
+    paths = sorted(local_output_dir.rglob("stats/*.pt"))
+    if len(paths) == 0:
+        return {}
+    import torch
+
+    masks = {}
+    for path in paths:
+        if path.stem in masks:
+            continue
+        # Memory-mapped, so the per-design probabilities are never read
+        stats = torch.load(path, map_location="cpu", mmap=True)
+        if "mask_XY" not in stats:
+            continue
+        pocket = stats["mask"] * stats["chain_mask"] * stats["mask_XY"]
+        masks[path.stem] = pocket.numpy().astype(bool)
+    return masks
+
+
+def position_counts(S: np.ndarray) -> np.ndarray:
+    """Designs with each residue type at each position, [L, 21]."""
+    n, L = S.shape
+    offsets = S + len(ALPHABET) * np.arange(L)[None]
+    return np.bincount(offsets.ravel(), minlength=L * len(ALPHABET)).reshape(
+        L, len(ALPHABET)
+    )
+
+
+def mean_distances(S: np.ndarray) -> np.ndarray:
+    """Mean fraction of positions at which each design differs from the others.
+
+    Sums of pairwise identities come from per-position residue counts, so
+    this is linear in the number of designs.
+    """
+    n, L = S.shape
+    if n < 2:
+        return np.full(n, np.nan, dtype=np.float32)
+    counts = position_counts(S)
+    shared = counts[np.arange(L)[None], S].sum(1) - L
+    return (1 - shared / ((n - 1) * L)).astype(np.float32)
+
+
+def max_identity_to_better(S: np.ndarray) -> np.ndarray:
+    """Highest identity of each design to any design before it, in chunks of
+    one-hot matrix products; NaN for the first."""
+    n, L = S.shape
+    one_hot = np.zeros((n, L * len(ALPHABET)), dtype=np.float32)
+    one_hot[np.arange(n)[:, None], S + len(ALPHABET) * np.arange(L)[None]] = 1
+    best = np.full(n, np.nan, dtype=np.float32)
+    for start in range(1, n, PAIRWISE_CHUNK):
+        end = min(n, start + PAIRWISE_CHUNK)
+        shared = one_hot[start:end] @ one_hot[:end].T
+        # Only designs ranked above count
+        shared[np.arange(end - start)[:, None] + start <= np.arange(end)[None]] = -1
+        best[start:end] = shared.max(1) / L
+    return best
+
+
+def analyze_designs(
+    local_output_dir: Path,
+    top_k: int = 100,
+    rank_by: str = "overall_confidence",
+) -> Optional[Dict]:
+    """Score and rank every design in the run's design table.
+
+    Writes per-design metrics, the amino acid composition of each structure
+    (and sweep combination) and the top_k designs. Returns a short summary,
+    or None when the run has no design table.
+    """
+    if rank_by not in RANK_COLUMNS:
+        raise ValueError(
+            f"Cannot rank by {rank_by}, choose from {', '.join(RANK_COLUMNS)}"
+        )
+    local_output_dir = Path(local_output_dir)
+    table_path = local_output_dir / DESIGN_TABLE
+    if not table_path.exists():
+        return None
+    designs = pq.read_table(table_path)
+    n = designs.num_rows
+    if n == 0:
+        return None
+
+    pdbs = np.array(designs.column("pdb").to_pylist(), dtype=object)
+    sweep_indices = designs.column("sweep_index").fill_null(-1).to_numpy()
+    sequences = designs.column("sequence").to_pylist()
+    natives = read_natives(local_output_dir)
+    pockets = read_pocket_masks(local_output_dir)
+
+    identity = np.full(n, np.nan, dtype=np.float32)
+    pocket_recovery = np.full(n, np.nan, dtype=np.float32)
+    mean_distance = np.full(n, np.nan, dtype=np.float32)
+    # Valid rows of the design table and their residue indices, per structure
+    encoded: List[Tuple[np.ndarray, np.ndarray]] = []
+    composition_rows = []
+    names, structure_of = np.unique(pdbs, return_inverse=True)
+    for s, name in enumerate(names):
+        rows = np.flatnonzero(structure_of == s)
+        native = natives.get(name)
+        length = len(sequences[rows[0]].translate(str.maketrans("", "", ":/")))
+        S, valid = encode_sequences([sequences[i] for i in rows], length)
+        rows, S = rows[valid], S[valid]
+        encoded.append((rows, S))
+
+        native_S = None
+        if native is not None:
+            native_S, native_valid = encode_sequences([native], length)
+            native_S = native_S[0] if native_valid[0] else None
+        if native_S is not None:
+            matches = S == native_S[None]
+            identity[rows] = matches.mean(1)
+            pocket = pockets.get(name)
+            if pocket is not None and len(pocket) == length and pocket.any():
+                pocket_recovery[rows] = matches[:, pocket].mean(1)
+            composition_rows.append(
+                _composition_row(name, None, "native", native_S[None])
+            )
+
+        for sweep_index in np.unique(sweep_indices[rows]):
+            group = sweep_indices[rows] == sweep_index
+            mean_distance[rows[group]] = mean_distances(S[group])
+            composition_rows.append(
+                _composition_row(
+                    name,
+                    None if sweep_index < 0 else int(sweep_index),
+                    "designs",
+                    S[group],
+                )
+            )
+
+    columns = {
+        "overall_confidence": designs.column("overall_confidence").to_numpy(),
+        "ligand_confidence": designs.column("ligand_confidence").to_numpy(),
+        "seq_rec": designs.column("seq_rec").to_numpy(),
+        "identity_to_native": identity,
+        "pocket_recovery": pocket_recovery,
+        "mean_distance": mean_distance,
+    }
+    key = np.nan_to_num(columns[rank_by].astype(np.float64), nan=-np.inf)
+    design_ids = designs.column("design_id").to_numpy()
+    # Best first; ties keep structure and design order
+    order = np.lexsort((design_ids, structure_of, -key))
+    rank = np.empty(n, dtype=np.int32)
+    rank[order] = np.arange(1, n + 1)
+
+    pq.write_table(
+        pa.table(
+            {
+                "pdb": pdbs.tolist(),
+                "sweep_index": designs.column("sweep_index"),
+                "design_id": designs.column("design_id"),
+                "rank": rank,
+                **columns,
+            },
+            schema=METRICS_SCHEMA,
+        ),
+        local_output_dir / METRICS_TABLE,
+        compression="zstd",
+    )
+    _write_composition(local_output_dir / COMPOSITION_TABLE, composition_rows)
+
+    top = order[: max(0, top_k)]
+    # Compared only with better designs of the same structure
+    closest = np.full(len(top), np.nan, dtype=np.float32)
+    for s in np.unique(structure_of[top]):
+        rows, S = encoded[s]
+        picked = np.flatnonzero((structure_of[top] == s) & np.isin(top, rows))
+        if len(picked) > 0:
+            closest[picked] = max_identity_to_better(
+                S[np.searchsorted(rows, top[picked])]
+            )
+    with open(local_output_dir / TOP_DESIGNS, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["rank", "pdb", "sweep_index", "design_id", "sequence"]
+            + RANK_COLUMNS
+            + ["max_identity_to_better"]
+        )
+        for i, row in enumerate(top):
+            writer.writerow(
+                [rank[row], pdbs[row], _sweep(sweep_indices[row]), design_ids[row]]
+                + [sequences[row]]
+                + [_format(columns[c][row]) for c in RANK_COLUMNS]
+                + [_format(closest[i])]
+            )
+
+    summary = {
+        "designs": n,
+        "structures": len(names),
+        "ranked_by": rank_by,
+        "mean_identity_to_native": _format(_nanmean(identity)),
+        "mean_pocket_recovery": _format(_nanmean(pocket_recovery)),
+        "mean_distance": _format(_nanmean(mean_distance)),
+    }
+    if len(top) > 0:
+        summary["best"] = f"{pdbs[top[0]]} design {design_ids[top[0]]}"
+    return summary
+
+
+def _nanmean(values: np.ndarray) -> float:
+    return float(np.nanmean(values)) if np.isfinite(values).any() else np.nan
+
+
+def _sweep(sweep_index: int) -> str:
+    return "" if sweep_index < 0 else str(sweep_index)
+
+
+def _format(value: float) -> str:
+    if value is None or np.isnan(value):
+        return ""
+    return np.format_float_positional(value, unique=False, precision=4)
+
+
+def _composition_row(
+    name: str, sweep_index: Optional[int], source: str, S: np.ndarray
+) -> List:
+    counts = np.bincount(S.ravel(), minlength=len(ALPHABET))
+    fractions = counts / max(1, S.size)
+    return [name, "" if sweep_index is None else sweep_index, source, len(S)] + [
+        _format(x) for x in fractions
+    ]
+
+
+def _write_composition(path: Path, rows: List[List]) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["pdb", "sweep_index", "source", "sequences"] + list(ALPHABET))
+        writer.writerows(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compute design metrics and rank the designs of a finished run"
+    )
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--rank-by", default="overall_confidence", choices=RANK_COLUMNS)
+    args = parser.parse_args(argv)
+    summary = analyze_designs(args.output_dir, args.top_k, args.rank_by)
+    if summary is None:
+        print(f"No {DESIGN_TABLE} in {args.output_dir}")
+        return 1
+    for k, v in summary.items():
+        print(f"{k}: {v}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from wf.checkpoints import LIGANDMPNN_DIR
+from wf.options import DesignOptions
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = ROOT / "benchmarks" / "baseline.json"
+DEFAULT_INPUTS_DIR = LIGANDMPNN_DIR / "inputs"
+# Structures committed with the tests, available wherever the repo is
+TEST_INPUTS_DIR = ROOT / "tests" / "data"
+
+# Metrics compared against the baseline and the direction that is better
+TRACKED_METRICS = {
+    "designs_per_second": "higher",
+    "residues_per_second": "higher",
+    "peak_rss_mb": "lower",
+}
+
+
+@dataclass
+class BenchmarkCase:
+    name: str
+    pdb: str
+    options: Dict = field(default_factory=dict)
+
+
+# Structures that ship with LigandMPNN are used as they are. The large and
+# ligand-heavy cases have no bundled example, so unless large.pdb and
+# ligand_heavy.pdb are in the --inputs directory they are built by tiling
+# bundled structures (see TILED_STRUCTURES). The ubiquitin and dna_ligand
+# cases use the test structures, so they run outside the image too and are
+# the ones benchmarks/check.sh compares against the committed baseline.
+CASES = [
+    BenchmarkCase("ubiquitin", "1ubi.pdb", {"ligand_mpnn_use_atom_context": 0}),
+    BenchmarkCase("dna_ligand", "3mht.pdb"),
+    BenchmarkCase("small", "1BC8.pdb", {"ligand_mpnn_use_atom_context": 0}),
+    BenchmarkCase("large", "large.pdb"),
+    BenchmarkCase("multi_chain", "2GFB.pdb"),
+    BenchmarkCase("ligand_heavy", "ligand_heavy.pdb"),
+    BenchmarkCase("ligand_context", "1BC8.pdb"),
+    BenchmarkCase("homo_oligomer", "4GYT.pdb", {"homo_oligomer": 1}),
+]
+
+# name -> (bundled structure, copies): the copies are placed side by side,
+# each with its own chain IDs. Eight copies of the 2GFB dimer make a large
+# multi-chain assembly; four of the 1BC8 protein-DNA complex give dense
+# nucleic acid context.
+TILED_STRUCTURES = {
+    "large.pdb": ("2GFB.pdb", 8),
+    "ligand_heavy.pdb": ("1BC8.pdb", 4),
+}
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+# Space between the bounding boxes of neighbouring copies, in angstroms
+TILE_GAP = 12.0
+
+# Steps of a task's cold start, each timed in a fresh interpreter from
+# process start; later steps include the earlier ones
+COLD_START_STEPS = {
+    "import_workflow": "import wf",
+    "import_engine": "import wf.engine",
+    "load_engine": (
+        "from wf.engine import get_engine; from wf.options import DesignOptions; "
+        "get_engine(DesignOptions(), 'cpu')"
+    ),
+}
+
+SETTINGS = {
+    "b1x4": {"batch_size": 1, "number_of_batches": 4},
+    "b4x1": {"batch_size": 4, "number_of_batches": 1},
+    "b8x2": {"batch_size": 8, "number_of_batches": 2},
+    "b1x1_packed": {
+        "batch_size": 1,
+        "number_of_batches": 1,
+        "pack_side_chains": 1,
+        "number_of_packs_per_design": 1,
+    },
+}
+
+
+def find_structure(pdb: str, inputs_dirs: List[Path]) -> Optional[Path]:
+    for inputs_dir in inputs_dirs:
+        if (inputs_dir / pdb).exists():
+            return inputs_dir / pdb
+    return None
+
+
+def tile_structure(source: Path, copies: int, destination: Path) -> Path:
+    """Write copies of a structure side by side along x, each copy with its
+    own chain IDs."""
+    lines = [
+        line
+        for line in source.read_text().splitlines()
+        if line.startswith(("ATOM  ", "HETATM"))
+    ]
+    chains = sorted({line[21] for line in lines})
+    if copies * len(chains) > len(CHAIN_IDS):
+        raise ValueError(f"Not enough chain IDs for {copies} copies of {source.name}")
+    xs = [float(line[30:38]) for line in lines]
+    spacing = max(xs) - min(xs) + TILE_GAP
+    records = []
+    serial = 0
+    for copy in range(copies):
+        rename = {
+            chain: CHAIN_IDS[copy * len(chains) + i] for i, chain in enumerate(chains)
+        }
+        for line in lines:
+            serial += 1
+            x = float(line[30:38]) + copy * spacing
+            records.append(
+                f"{line[:6]}{serial % 100000:5d}{line[11:21]}{rename[line[21]]}"
+                f"{line[22:30]}{x:8.3f}{line[38:]}"
+            )
+        records.append("TER")
+    records.append("END")
+    destination.write_text("\n".join(records) + "\n")
+    return destination
+
+
+def locate_structure(
+    pdb: str, inputs_dirs: List[Path], build_dir: Path
+) -> Optional[Path]:
+    """A case's structure from the inputs, or tiled from a bundled one."""
+    pdb_path = find_structure(pdb, inputs_dirs)
+    if pdb_path is not None or pdb not in TILED_STRUCTURES:
+        return pdb_path
+    source, copies = TILED_STRUCTURES[pdb]
+    source_path = find_structure(source, inputs_dirs)
+    if source_path is None:
+        return None
+    print(f"Building {pdb} from {copies} copies of {source}")
+    return tile_structure(source_path, copies, build_dir / pdb)
+
+
+def _run_case(pdb_path: Path, options: DesignOptions, design_workers: int) -> Dict:
+    """Run the task's design path once, in a fresh process."""
+    from wf.cache import StructureCache
+    from wf.engine import get_engine
+    from wf.execution import configure_threads, plan_workers
+    from wf.metrics import METRICS
+    from wf.task import run_designs
+
+    workers, threads = plan_workers("cpu", design_workers)
+    configure_threads(threads)
+    # Model loading is reported as its own stage, not as design time
+    engine = get_engine(options, "cpu")
+    METRICS.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        # An empty structure cache, so every run parses and featurizes as a
+        # task on a fresh node does instead of loading earlier runs' entries
+        engine.structure_cache = StructureCache(root=Path(tmp) / "structures")
+        start = time.time()
+        run_designs(
+            [pdb_path],
+            options,
+            Path(tmp) / "outputs",
+            per_pdb_outputs=False,
+            execution_profile="cpu_small",
+            design_workers=design_workers,
+        )
+        wall_seconds = time.time() - start
+    snapshot = METRICS.snapshot()
+    snapshot["wall_seconds"] = wall_seconds
+    snapshot["designs_per_second"] = snapshot["designs"] / wall_seconds
+    snapshot["residues_per_second"] = snapshot["residues"] / wall_seconds
+    return snapshot
+
+
+def run_suite(
+    case_names: Optional[List[str]],
+    setting_names: Optional[List[str]],
+    inputs_dirs: List[Path],
+    repeats: int,
+    design_workers: int,
+) -> Dict[str, Dict]:
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    build_dir = Path(tempfile.mkdtemp(prefix="benchmark_structures_"))
+    for case in CASES:
+        if case_names and case.name not in case_names:
+            continue
+        pdb_path = locate_structure(case.pdb, inputs_dirs, build_dir)
+        if pdb_path is None:
+            print(f"Skipping {case.name}: {case.pdb} not found")
+            continue
+        for setting_name, setting in SETTINGS.items():
+            if setting_names and setting_name not in setting_names:
+                continue
+            key = f"{case.name}/{setting_name}"
+            options = replace(DesignOptions(), **{**case.options, **setting})
+            runs = []
+            for _ in range(repeats):
+                # One process per run, so peak memory belongs to this case
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    runs.append(
+                        pool.submit(_run_case, pdb_path, options, design_workers).result()
+                    )
+            results[key] = {
+                "pdb": case.pdb,
+                "options": {**case.options, **setting},
+                "wall_seconds": statistics.median(r["wall_seconds"] for r in runs),
+                "designs": runs[0]["designs"],
+                "residues": runs[0]["residues"],
+                "designs_per_second": statistics.median(
+                    r["designs_per_second"] for r in runs
+                ),
+                "residues_per_second": statistics.median(
+                    r["residues_per_second"] for r in runs
+                ),
+                "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+                "stages": runs[-1]["stages"],
+            }
+            print(
+                f"{key}: {results[key]['wall_seconds']:.2f}s, "
+                f"{results[key]['designs_per_second']:.2f} designs/s, "
+                f"peak RSS {results[key]['peak_rss_mb']:.0f} MB"
+            )
+    shutil.rmtree(build_dir, ignore_errors=True)
+    return results
+
+
+def measure_cold_start(repeats: int) -> Dict[str, float]:
+    """Median seconds from interpreter start to the end of each step.
+
+    Repeats run with a warm page cache, so the first task on a fresh node
+    (which also pulls the image and fetches checkpoints) takes longer.
+    """
+    results = {}
+    for step, code in COLD_START_STEPS.items():
+        times = []
+        for _ in range(repeats):
+            start = time.time()
+            subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+            times.append(time.time() - start)
+        results[step] = statistics.median(times)
+        print(f"cold start {step}: {results[step]:.2f}s")
+    return results
+
+
+def environment() -> Dict:
+    import torch
+
+    try:
+        ligandmpnn_commit = subprocess.run(
+            ["git", "-C", str(LIGANDMPNN_DIR), "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        ligandmpnn_commit = None
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "ligandmpnn_commit": ligandmpnn_commit,
+        "machine": platform.machine(),
+        "cpus": multiprocessing.cpu_count(),
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Describe every tracked metric that is worse than the baseline by more
+    than tolerance (a fraction), and every case the baseline does not have."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline["cases"]:
+            regressions.append(f"{key}: not in the baseline")
+            continue
+        for metric, better in TRACKED_METRICS.items():
+            expected = baseline["cases"][key][metric]
+            actual = result[metric]
+            if expected <= 0:
+                continue
+            change = (actual - expected) / expected
+            if (better == "higher" and change < -tolerance) or (
+                better == "lower" and change > tolerance
+            ):
+                regressions.append(
+                    f"{key} {metric}: {actual:.2f} vs baseline {expected:.2f} "
+                    f"({change:+.0%})"
+                )
+    return regressions
+
+
+def compare_cold_start(
+    cold_start: Dict[str, float], baseline: Dict, tolerance: float
+) -> List[str]:
+    regressions = []
+    for step, seconds in cold_start.items():
+        expected = baseline.get("cold_start", {}).get(step)
+        if not expected:
+            continue
+        change = (seconds - expected) / expected
+        if change > tolerance:
+            regressions.append(
+                f"cold start {step}: {seconds:.2f}s vs baseline {expected:.2f}s "
+                f"({change:+.0%})"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark the CPU design path on a graded set of structures and "
+            "compare against a stored baseline"
+        )
+    )
+    parser.add_argument("--cases", help="Comma-separated case names")
+    parser.add_argument("--settings", help="Comma-separated setting names")
+    parser.add_argument(
+        "--inputs", type=Path, help="Extra directory to look for structures in"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--design-workers", type=int, default=1)
+    parser.add_argument(
+        "--cold-start",
+        action="store_true",
+        help="Also time imports and model loading in fresh interpreters",
+    )
+    parser.add_argument("--output", type=Path, help="Write results to this file")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative slowdown or memory growth before failing",
+    )
+    args = parser.parse_args(argv)
+
+    inputs_dirs = [DEFAULT_INPUTS_DIR, TEST_INPUTS_DIR]
+    if args.inputs is not None:
+        inputs_dirs.insert(0, args.inputs)
+    results = run_suite(
+        args.cases.split(",") if args.cases else None,
+        args.settings.split(",") if args.settings else None,
+        inputs_dirs,
+        args.repeats,
+        args.design_workers,
+    )
+    report = {"environment": environment(), "cases": results}
+    if args.cold_start:
+        report["cold_start"] = measure_cold_start(args.repeats)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"Wrote baseline to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, record one with --update-baseline")
+        return 1
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["environment"] != report["environment"]:
+        print("Warning: baseline was recorded in a different environment")
+        print(json.dumps(baseline["environment"], indent=2))
+    regressions = compare(results, baseline, args.tolerance)
+    regressions += compare_cold_start(
+        report.get("cold_start", {}), baseline, args.tolerance
+    )
+    if regressions:
+        print("-" * 60)
+        print("Regressions:")
+        for regression in regressions:
+            print(regression)
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
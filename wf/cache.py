@@ -0,0 +1,473 @@
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+from wf.outputs import DesignResult, read_design_result
+
+if TYPE_CHECKING:
+    import torch
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get("LIGANDMPNN_CACHE_DIR", "/root/.cache/ligandmpnn")
+)
+DEFAULT_RESULT_CACHE_GB = float(os.environ.get("LIGANDMPNN_RESULT_CACHE_GB", "20"))
+DEFAULT_STRUCTURE_CACHE_GB = float(
+    os.environ.get("LIGANDMPNN_STRUCTURE_CACHE_GB", "5")
+)
+
+CACHED_SUBDIRS = ["seqs", "backbones", "packed", "stats"]
+
+# Options that only change what gets written or how much memory sampling
+# takes, not what gets sampled. The constraint files are keyed by content
+# below instead of by local path.
+NON_SAMPLING_OPTIONS = {
+    "save_stats",
+    "low_memory",
+    "bias_AA_jsonl",
+    "omit_AA_jsonl",
+    "bias_AA_per_residue_jsonl",
+    "omit_AA_per_residue_jsonl",
+}
+
+# Part of every structure key, so entries written in an older layout are
+# never read and age out of the cache
+STRUCTURE_CACHE_FORMAT = 2
+
+_file_digests: Dict[Tuple[str, int, float], str] = {}
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a file, remembered while its size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = (str(path), stat.st_size, stat.st_mtime)
+    if key not in _file_digests:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _file_digests[key] = h.hexdigest()
+    return _file_digests[key]
+
+
+def checkpoint_digest(path: str) -> str:
+    return file_digest(Path(path))
+
+
+def result_key(
+    pdb_path: Path,
+    options: DesignOptions,
+    checkpoint_path: str,
+    batch_indices: List[int],
+) -> str:
+    """Content address of one structure's designs.
+
+    Covers the structure bytes and name, the checkpoint contents, the batches
+    (each of which has its own derived seed) and every option that changes
+    sampling or packing. The run name and output location are not part of it.
+    """
+    sampling_options = {
+        k: v for k, v in asdict(options).items() if k not in NON_SAMPLING_OPTIONS
+    }
+    if options.model_type != "ligand_mpnn":
+        sampling_options.pop("checkpoint_ligand_mpnn")
+    constraint_files = {
+        k: file_digest(Path(getattr(options, k)))
+        for k in [
+            "bias_AA_jsonl",
+            "omit_AA_jsonl",
+            "bias_AA_per_residue_jsonl",
+            "omit_AA_per_residue_jsonl",
+        ]
+        if getattr(options, k)
+    }
+    payload = {
+        "pdb_name": Path(pdb_path).stem,
+        "pdb": file_digest(Path(pdb_path)),
+        "checkpoint": checkpoint_digest(checkpoint_path),
+        "batch_indices": list(batch_indices),
+        "options": sampling_options,
+        "constraint_files": constraint_files,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def structure_key(pdb_path: Path, parse_settings: Dict) -> str:
+    payload = {
+        "pdb": file_digest(Path(pdb_path)),
+        "settings": parse_settings,
+        "format": STRUCTURE_CACHE_FORMAT,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _directory_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class DirectoryCache:
+    """Directory-per-entry store under root, evicted LRU by total size.
+
+    The total is scanned from disk once and then kept up to date as entries
+    are added, so the whole cache is only walked again when it has grown
+    past max_bytes. Entries that other processes add are picked up by that
+    walk.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _commit(self, staged: Path, key: str) -> None:
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(staged, entry)
+        except OSError:
+            # Another worker stored the same entry first
+            shutil.rmtree(staged, ignore_errors=True)
+            return
+        if self._total_bytes is None:
+            self._total_bytes = sum(
+                _directory_size(e) for e in self.root.glob("??/*")
+            )
+        else:
+            self._total_bytes += _directory_size(entry)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for entry in self.root.glob("??/*"):
+            size = _directory_size(entry)
+            entries.append((entry.stat().st_mtime, size, entry))
+            total += size
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        self._total_bytes = total
+
+
+class ResultCache(DirectoryCache):
+    """Content-addressed store of design outputs with LRU size eviction.
+
+    Entries live under a node-local directory. If remote_path is set (a
+    latch:// directory) entries are also mirrored there as tarballs, so that
+    repeated sweeps on fresh nodes still hit.
+    """
+
+    def __init__(
+        self,
+        root: Path = DEFAULT_CACHE_DIR / "results",
+        max_bytes: int = int(DEFAULT_RESULT_CACHE_GB * 1024**3),
+        remote_path: Optional[str] = None,
+    ):
+        super().__init__(root, max_bytes)
+        self.remote_path = remote_path.rstrip("/") if remote_path else None
+
+    def _fetch_remote(self, key: str) -> bool:
+        if self.remote_path is None:
+            return False
+        from wf.staging import download_if_exists
+
+        with tempfile.TemporaryDirectory(dir=self.root) as tmp:
+            archive = Path(tmp) / f"{key}.tar"
+            if not download_if_exists(f"{self.remote_path}/{key}.tar", archive):
+                return False
+            try:
+                with tarfile.open(archive) as tar:
+                    # Refuses members that would land outside the entry
+                    tar.extractall(Path(tmp) / key, filter="data")
+            except tarfile.TarError as e:
+                print(f"Ignoring cache entry {key}: {e}")
+                return False
+            # Fetched entries count as just used, not as old as the archive
+            os.utime(Path(tmp) / key)
+            self._commit(Path(tmp) / key, key)
+        return True
+
+    def _push_remote(self, key: str) -> None:
+        if self.remote_path is None:
+            return
+        from latch.ldata.path import LPath
+
+        with tempfile.TemporaryDirectory(dir=self.root) as tmp:
+            archive = Path(tmp) / f"{key}.tar"
+            with tarfile.open(archive, "w") as tar:
+                tar.add(self._entry(key), arcname=".")
+            try:
+                LPath(f"{self.remote_path}/{key}.tar").upload_from(archive)
+            except Exception as e:
+                print(f"Could not upload cache entry {key}: {e}")
+
+    def get(self, key: str, out_folder: Path, need_stats: bool = False) -> bool:
+        entry = self._entry(key)
+        if not entry.exists() and not self._fetch_remote(key):
+            return False
+        if need_stats and not (entry / "stats").exists():
+            return False
+        for sub in CACHED_SUBDIRS:
+            if sub == "stats" and not need_stats:
+                continue
+            if (entry / sub).exists():
+                shutil.copytree(entry / sub, out_folder / sub, dirs_exist_ok=True)
+        os.utime(entry)
+        return True
+
+    def put(self, key: str, out_folder: Path) -> None:
+        staged = Path(tempfile.mkdtemp(dir=self.root))
+        for sub in CACHED_SUBDIRS:
+            if (out_folder / sub).exists():
+                shutil.copytree(out_folder / sub, staged / sub)
+        # A newer entry with stats replaces one without
+        entry = self._entry(key)
+        if entry.exists() and (staged / "stats").exists():
+            shutil.rmtree(entry, ignore_errors=True)
+        self._commit(staged, key)
+        self._push_remote(key)
+
+
+class StructureCache(DirectoryCache):
+    """Parsed coordinates and neighbour/ligand-context features per structure.
+
+    Every tensor is stored as its own uncompressed .npy file so entries can be
+    memory-mapped, with the parsed ProDy atom group and the indices of its
+    backbone and ligand selections, needed for writing PDBs, saved alongside.
+    The most recent entries are also kept in memory, which is what makes
+    repeated designs on one scaffold within a task free.
+    """
+
+    def __init__(
+        self,
+        root: Path = DEFAULT_CACHE_DIR / "structures",
+        max_bytes: int = int(DEFAULT_STRUCTURE_CACHE_GB * 1024**3),
+        max_in_memory: int = 8,
+    ):
+        super().__init__(root, max_bytes)
+        self.max_in_memory = max_in_memory
+        self._memory: "OrderedDict[Tuple[str, str], object]" = OrderedDict()
+
+    def _remember(self, key: str, device: "torch.device", parsed) -> None:
+        self._memory[(key, str(device))] = parsed
+        self._memory.move_to_end((key, str(device)))
+        while len(self._memory) > self.max_in_memory:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, device: "torch.device"):
+        import torch
+        from prody import loadAtoms
+        from prody.atomic import Selection
+
+        from wf.engine import ParsedStructure
+
+        if (key, str(device)) in self._memory:
+            self._memory.move_to_end((key, str(device)))
+            return self._memory[(key, str(device))]
+
+        entry = self._entry(key)
+        if not (entry / "meta.json").exists():
+            return None
+        meta = json.loads((entry / "meta.json").read_text())
+        groups = {}
+        for group in ["protein", "features"]:
+            values = {}
+            for k, kind in meta[group].items():
+                if isinstance(kind, dict):
+                    values[k] = kind["value"]
+                    continue
+                array = np.load(entry / f"{group}.{k}.npy", mmap_mode="r")
+                if kind == "array":
+                    values[k] = np.array(array)
+                elif kind == "tensor_list":
+                    values[k] = [torch.tensor(a, device=device) for a in array]
+                else:
+                    values[k] = torch.tensor(array, device=device)
+            groups[group] = values
+
+        # Selections of one atom group, as parse_PDB returns them, so that
+        # writing outputs can set fields on them and join them
+        atoms = loadAtoms(str(entry / "atoms.ag.npz"))
+        selections = {
+            name: Selection(
+                atoms, np.load(entry / f"{name}.indices.npy"), selstr, unique=True
+            )
+            for name, selstr in meta["selections"].items()
+        }
+        parsed = ParsedStructure(
+            protein_dict=groups["protein"],
+            feature_dict=groups["features"],
+            backbone=selections["backbone"],
+            other_atoms=selections.get("other_atoms"),
+            icodes=meta["icodes"],
+        )
+        os.utime(entry)
+        self._remember(key, device, parsed)
+        return parsed
+
+    def put(self, key: str, parsed) -> None:
+        import torch
+        from prody import saveAtoms
+
+        self._remember(key, parsed.protein_dict["X"].device, parsed)
+        if self._entry(key).exists():
+            return
+
+        staged = Path(tempfile.mkdtemp(dir=self.root))
+        meta = {
+            "protein": {},
+            "features": {},
+            "icodes": list(parsed.icodes),
+            "selections": {},
+        }
+        for group, values in [
+            ("protein", parsed.protein_dict),
+            ("features", parsed.feature_dict),
+        ]:
+            for k, v in values.items():
+                path = staged / f"{group}.{k}.npy"
+                if isinstance(v, torch.Tensor):
+                    np.save(path, v.cpu().numpy())
+                    meta[group][k] = "tensor"
+                elif isinstance(v, np.ndarray):
+                    np.save(path, v)
+                    meta[group][k] = "array"
+                elif (
+                    isinstance(v, list)
+                    and len(v) > 0
+                    and all(isinstance(t, torch.Tensor) for t in v)
+                ):
+                    np.save(path, torch.stack(v).cpu().numpy())
+                    meta[group][k] = "tensor_list"
+                else:
+                    meta[group][k] = {"value": v}
+        saveAtoms(parsed.backbone.getAtomGroup(), str(staged / "atoms"))
+        for name, selection in [
+            ("backbone", parsed.backbone),
+            ("other_atoms", parsed.other_atoms),
+        ]:
+            if selection:
+                np.save(staged / f"{name}.indices.npy", selection.getIndices())
+                meta["selections"][name] = selection.getSelstr()
+        (staged / "meta.json").write_text(json.dumps(meta))
+        self._commit(staged, key)
+
+
+def cached_design(
+    engine,
+    cache: Optional[ResultCache],
+    pdb_path: Path,
+    options: DesignOptions,
+    out_folder: Path,
+    batch_indices: List[int],
+    packing=None,
+) -> DesignResult:
+    """Design one structure, going through the result cache if there is one.
+
+    With a packing pool the entry is stored once packing has finished.
+    """
+    result = _cached_design(
+        engine, cache, pdb_path, options, out_folder, batch_indices, packing
+    )
+    separator = options.fasta_seq_separation
+    METRICS.count(
+        designs=len(result.design_ids),
+        residues=sum(len(seq.replace(separator, "")) for seq in result.sequences),
+    )
+    return result
+
+
+def cached_designs(
+    engine,
+    cache: Optional[ResultCache],
+    requests: List[Tuple[Path, DesignOptions, Path, List[int]]],
+) -> List[DesignResult]:
+    """Design (pdb_path, options, out_folder, batch_indices) requests with
+    engine.design_many, going through the result cache for each."""
+    results: Dict[int, DesignResult] = {}
+    keys: Dict[int, str] = {}
+    for i, (pdb_path, options, out_folder, batch_indices) in enumerate(requests):
+        if cache is None:
+            continue
+        key = result_key(pdb_path, options, engine.checkpoint_path, batch_indices)
+        start = time.time()
+        if cache.get(key, out_folder, need_stats=bool(options.save_stats)):
+            METRICS.add_time("result_cache_hits", time.time() - start)
+            print(f"Result cache hit for {pdb_path.name} ({time.time() - start:.2f}s)")
+            results[i] = read_design_result(
+                out_folder / "seqs" / f"{Path(pdb_path).stem}.fa"
+            )
+        else:
+            keys[i] = key
+
+    misses = [i for i in range(len(requests)) if i not in results]
+    if misses:
+        designed = engine.design_many([requests[i] for i in misses])
+        for i, result in zip(misses, designed):
+            results[i] = result
+            if cache is not None:
+                with METRICS.stage("result_cache_store"):
+                    cache.put(keys[i], requests[i][2])
+
+    for i, (_, options, _, _) in enumerate(requests):
+        separator = options.fasta_seq_separation
+        METRICS.count(
+            designs=len(results[i].design_ids),
+            residues=sum(
+                len(seq.replace(separator, "")) for seq in results[i].sequences
+            ),
+        )
+    return [results[i] for i in range(len(requests))]
+
+
+def _cached_design(
+    engine,
+    cache: Optional[ResultCache],
+    pdb_path: Path,
+    options: DesignOptions,
+    out_folder: Path,
+    batch_indices: List[int],
+    packing=None,
+) -> DesignResult:
+    if cache is None:
+        return engine.design(pdb_path, options, out_folder, batch_indices, packing)
+
+    key = result_key(pdb_path, options, engine.checkpoint_path, batch_indices)
+    start = time.time()
+    if cache.get(key, out_folder, need_stats=bool(options.save_stats)):
+        METRICS.add_time("result_cache_hits", time.time() - start)
+        print(f"Result cache hit for {pdb_path.name} ({time.time() - start:.2f}s)")
+        return read_design_result(out_folder / "seqs" / f"{Path(pdb_path).stem}.fa")
+
+    def store():
+        with METRICS.stage("result_cache_store"):
+            cache.put(key, out_folder)
+
+    result = engine.design(
+        pdb_path, options, out_folder, batch_indices, packing, on_packed=store
+    )
+    if packing is None or not options.pack_side_chains:
+        store()
+    return result
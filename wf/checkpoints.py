@@ -0,0 +1,56 @@
+import os
+import urllib.request
+from pathlib import Path
+from typing import Optional
+
+from wf.cache import DEFAULT_CACHE_DIR
+from wf.metrics import METRICS
+
+LIGANDMPNN_DIR = Path("/tmp/docker-build/work/LigandMPNN")
+# Checkpoints are not baked into the image. Each one is fetched the first time
+# a run needs it and kept in a node-local directory shared by later tasks;
+# params already in the LigandMPNN checkout (get_model_params.sh) are used as is.
+BUNDLED_PARAMS_DIR = LIGANDMPNN_DIR / "model_params"
+MODEL_PARAMS_DIR = DEFAULT_CACHE_DIR / "model_params"
+MODEL_PARAMS_URL = os.environ.get(
+    "LIGANDMPNN_MODEL_PARAMS_URL", "https://files.ipd.uw.edu/pub/ligandmpnn"
+)
+
+CHECKPOINTS = {
+    "protein_mpnn": "proteinmpnn_v_48_020.pt",
+    "ligand_mpnn": "ligandmpnn_v_32_010_25.pt",
+    "soluble_mpnn": "solublempnn_v_48_020.pt",
+    "per_residue_label_membrane_mpnn": "per_residue_label_membrane_mpnn_v_48_020.pt",
+    "global_label_membrane_mpnn": "global_label_membrane_mpnn_v_48_020.pt",
+}
+SIDE_CHAIN_CHECKPOINT = "ligandmpnn_sc_v_32_002_16.pt"
+
+
+def model_params_path(name: str) -> Path:
+    """Local path of a released checkpoint, downloading it if needed."""
+    bundled = BUNDLED_PARAMS_DIR / name
+    if bundled.exists():
+        return bundled
+    path = MODEL_PARAMS_DIR / name
+    if path.exists():
+        return path
+
+    print(f"Downloading {name}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{name}.{os.getpid()}.tmp")
+    with METRICS.stage("checkpoint_download"):
+        try:
+            urllib.request.urlretrieve(f"{MODEL_PARAMS_URL}/{name}", tmp)
+            # Atomic, so tasks sharing the node never load a partial file
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+    return path
+
+
+def resolve_checkpoint(model_type: str, checkpoint_ligand_mpnn: Optional[str]) -> str:
+    if model_type not in CHECKPOINTS:
+        raise ValueError(f"Unknown model type: {model_type}")
+    if model_type == "ligand_mpnn" and checkpoint_ligand_mpnn:
+        return checkpoint_ligand_mpnn
+    return str(model_params_path(CHECKPOINTS[model_type]))
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from wf.cache import DEFAULT_CACHE_DIR, file_digest
+from wf.options import load_json_records
+
+# LigandMPNN's residue type order (data_utils.alphabet)
+ALPHABET = "ACDEFGHIKLMNPQRSTVWYX"
+
+MAGIC = b"LMPNNCONSTRAINTS1\n"
+ALIGNMENT = 64
+
+# One record per constrained residue. Values are NaN for amino acids the
+# file says nothing about, so files applied in turn only overwrite what
+# they set; omitted amino acids are stored as 1.
+RECORD = np.dtype([("residue", "S16"), ("values", "<f4", (len(ALPHABET),))])
+
+# (kind, per PDB) of every constraint file option
+CONSTRAINT_OPTIONS = {
+    "bias_AA_jsonl": ("bias", True),
+    "omit_AA_jsonl": ("omit", True),
+    "bias_AA_per_residue_jsonl": ("bias", False),
+    "omit_AA_per_residue_jsonl": ("omit", False),
+}
+
+_indexes: Dict[str, "ConstraintIndex"] = {}
+
+
+def _record(residue: str, value, kind: str) -> Tuple[bytes, np.ndarray]:
+    values = np.full(len(ALPHABET), np.nan, dtype=np.float32)
+    if kind == "omit":
+        for amino_acid in value:
+            if amino_acid in ALPHABET:
+                values[ALPHABET.index(amino_acid)] = 1.0
+    else:
+        for amino_acid, bias in value.items():
+            if amino_acid in ALPHABET:
+                values[ALPHABET.index(amino_acid)] = bias
+    return residue.encode("utf-8"), values
+
+
+def build_constraint_index(
+    source: Path, destination: Path, kind: str, per_pdb: bool
+) -> None:
+    """Convert a bias or omit JSON(L) file into an index file.
+
+    Per-PDB files ({pdb: {residue: ...}}) get one contiguous range of records
+    per PDB; per-residue files are stored as a single entry.
+    """
+    if kind not in ("bias", "omit"):
+        raise ValueError(f"Unknown constraint kind {kind}")
+    records = load_json_records(str(source))
+    entries = records if per_pdb else {"": records}
+
+    rows: List[Tuple[bytes, np.ndarray]] = []
+    ranges = {}
+    for key, residues in entries.items():
+        start = len(rows)
+        for residue, value in residues.items():
+            if len(residue.encode("utf-8")) > RECORD["residue"].itemsize:
+                raise ValueError(f"Residue name too long: {residue}")
+            rows.append(_record(residue, value, kind))
+        ranges[key] = [start, len(rows)]
+    table = np.array(rows, dtype=RECORD)
+
+    header = json.dumps(
+        {"kind": kind, "per_pdb": per_pdb, "count": len(rows), "entries": ranges}
+    ).encode("utf-8")
+    offset = len(MAGIC) + 8 + len(header)
+    padding = -offset % ALIGNMENT
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp = destination.with_name(f"{destination.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(b"\0" * padding)
+        f.write(table.tobytes())
+    tmp.rename(destination)
+
+
+def is_constraint_index(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class ConstraintIndex:
+    """Memory-mapped constraint index; only the looked-up records are read."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a constraint index")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length))
+        offset = len(MAGIC) + 8 + header_length
+        offset += -offset % ALIGNMENT
+        self.kind = header["kind"]
+        self.per_pdb = header["per_pdb"]
+        self.entries: Dict[str, List[int]] = header["entries"]
+        self.records = (
+            np.memmap(path, dtype=RECORD, mode="r", offset=offset, shape=(header["count"],))
+            if header["count"] > 0
+            else np.zeros(0, dtype=RECORD)
+        )
+        self._stems: Dict[str, str] = {}
+        for key in self.entries:
+            self._stems.setdefault(Path(key).stem, key)
+
+    def _entry(self, pdb_path: Path) -> Optional[List[int]]:
+        # Same matching as records_for_pdb
+        if not self.per_pdb:
+            return self.entries[""]
+        for key in [str(pdb_path), pdb_path.name, pdb_path.stem]:
+            if key in self.entries:
+                return self.entries[key]
+        key = self._stems.get(pdb_path.stem)
+        return self.entries[key] if key is not None else None
+
+    def dense(self, pdb_path: Path, residues: Dict[str, int]) -> np.ndarray:
+        """[L, 21] values for a structure whose residue names map to rows;
+        NaN where nothing is set."""
+        out = np.full((len(residues), len(ALPHABET)), np.nan, dtype=np.float32)
+        entry = self._entry(Path(pdb_path))
+        if entry is None:
+            return out
+        records = self.records[entry[0] : entry[1]]
+        rows = np.array(
+            [residues.get(name.decode("utf-8"), -1) for name in records["residue"]],
+            dtype=np.int64,
+        )
+        found = rows >= 0
+        out[rows[found]] = records["values"][found]
+        return out
+
+
+def index_constraint_file(path: str, kind: str, per_pdb: bool) -> Path:
+    """Path of the index of a constraint file, indexing it first if needed.
+
+    Indexes of JSON(L) files are kept in the node-local cache by content, so
+    every file is only parsed once per node.
+    """
+    if is_constraint_index(Path(path)):
+        return Path(path)
+    index_path = (
+        DEFAULT_CACHE_DIR
+        / "constraints"
+        / f"{file_digest(Path(path))}_{kind}_{int(per_pdb)}.idx"
+    )
+    if not index_path.exists():
+        build_constraint_index(Path(path), index_path, kind, per_pdb)
+    return index_path
+
+
+def constraint_index(path: str, kind: str, per_pdb: bool) -> ConstraintIndex:
+    if path not in _indexes:
+        _indexes[path] = ConstraintIndex(index_constraint_file(path, kind, per_pdb))
+    index = _indexes[path]
+    if index.kind != kind or index.per_pdb != per_pdb:
+        raise ValueError(
+            f"{path} holds {'per-PDB' if index.per_pdb else 'per-residue'} "
+            f"{index.kind} constraints, expected "
+            f"{'per-PDB' if per_pdb else 'per-residue'} {kind} constraints"
+        )
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Index a bias or omit JSON(L) file so design tasks only read the "
+            "entries of the structures they design"
+        )
+    )
+    parser.add_argument("source", type=Path)
+    parser.add_argument("destination", type=Path)
+    parser.add_argument("--kind", choices=["bias", "omit"], required=True)
+    parser.add_argument(
+        "--per-pdb",
+        action="store_true",
+        help="The file is keyed by PDB (bias_AA_jsonl / omit_AA_jsonl)",
+    )
+    args = parser.parse_args(argv)
+    build_constraint_index(args.source, args.destination, args.kind, args.per_pdb)
+    index = ConstraintIndex(args.destination)
+    print(f"Indexed {len(index.records)} residues of {len(index.entries)} entries")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1653 @@
+import copy
+import random
+import sys
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from wf.checkpoints import (
+    LIGANDMPNN_DIR,
+    SIDE_CHAIN_CHECKPOINT,
+    model_params_path,
+    resolve_checkpoint,
+)
+
+sys.path.insert(0, str(LIGANDMPNN_DIR))
+
+import data_utils  # noqa: E402
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+from data_utils import (  # noqa: E402
+    alphabet,
+    featurize,
+    get_score,
+    get_seq_rec,
+    parse_PDB,
+    restype_1to3,
+    restype_int_to_str,
+    restype_str_to_int,
+    write_full_PDB,
+)
+from model_utils import ProteinMPNN, cat_neighbors_nodes  # noqa: E402
+from prody import writePDB  # noqa: E402
+from sc_utils import Packer, pack_side_chains  # noqa: E402
+
+from wf.cache import StructureCache, structure_key  # noqa: E402
+from wf.constraints import constraint_index  # noqa: E402
+from wf.memory import is_out_of_memory, plan_batch_size, release_memory  # noqa: E402
+from wf.metrics import METRICS  # noqa: E402
+from wf.options import DesignOptions  # noqa: E402
+from wf.outputs import DesignResult  # noqa: E402
+
+
+def batch_seed(seed: int, batch_index: int) -> int:
+    """Deterministic seed for one batch of a design run.
+
+    Every batch is seeded independently so that any subset of batches, e.g.
+    one shard of a fanned-out run, reproduces the same sequences as a run of
+    all batches on a single node.
+    """
+    return int(np.random.SeedSequence([seed, batch_index]).generate_state(1)[0])
+
+
+def design_seed(seed: int, design_id: int) -> int:
+    """Seed of a single design, used when designs are batched automatically."""
+    return int(np.random.SeedSequence([seed, 0, design_id]).generate_state(1)[0])
+
+
+def _draw(probs: torch.Tensor, uniforms: torch.Tensor) -> torch.Tensor:
+    """One class per row of probs, drawn by inverse CDF from uniforms[row]."""
+    cdf = torch.cumsum(probs, dim=-1)
+    cdf = cdf / cdf[:, -1:]
+    index = torch.searchsorted(
+        cdf, uniforms[:, None].to(cdf.dtype).contiguous(), right=True
+    )[:, 0]
+    return index.clamp(max=probs.shape[-1] - 1)
+
+
+# Residues whose neighbours are searched at once in low-memory mode; a block
+# holds LOW_MEMORY_ROWS x L distances instead of L x L
+LOW_MEMORY_ROWS = 1024
+# A context crop is only used when it leaves out at least this share of the
+# structure
+MIN_CROP_SAVING = 0.2
+
+
+def _blockwise_dist(features):
+    """features._dist computed for LOW_MEMORY_ROWS residues at a time.
+
+    Each residue's k nearest neighbours only depend on its own row of the
+    distance matrix, so the blocks give the same neighbours and distances.
+    """
+
+    def _dist(X, mask, eps=1e-6):
+        L = X.shape[1]
+        top_k = min(features.top_k, L)
+        D_neighbors, E_idx = [], []
+        for start in range(0, L, LOW_MEMORY_ROWS):
+            rows = slice(start, start + LOW_MEMORY_ROWS)
+            mask_2D = mask[:, rows, None] * mask[:, None, :]
+            dX = X[:, None, :, :] - X[:, rows, None, :]
+            D = mask_2D * torch.sqrt(torch.sum(dX**2, 3) + eps)
+            D_max, _ = torch.max(D, -1, keepdim=True)
+            D_adjust = D + (1.0 - mask_2D) * D_max
+            D_block, E_block = torch.topk(D_adjust, top_k, dim=-1, largest=False)
+            D_neighbors.append(D_block)
+            E_idx.append(E_block)
+        return torch.cat(D_neighbors, 1), torch.cat(E_idx, 1)
+
+    return _dist
+
+
+def _neighbour_rbf(features):
+    """features._get_rbf from the distances to each residue's neighbours only,
+    rather than gathering them from all L x L atom pair distances."""
+
+    def _get_rbf(A, B, E_idx):
+        B_neighbors = torch.gather(
+            B, 1, E_idx.reshape(E_idx.shape[0], -1, 1).expand(-1, -1, B.shape[-1])
+        ).view(*E_idx.shape, B.shape[-1])
+        dX = A[:, :, None, :] - B_neighbors
+        D_A_B = torch.sqrt(torch.sum(dX**2, -1) + 1e-6)
+        return features._rbf(D_A_B)
+
+    return _get_rbf
+
+
+def _blockwise_ligand_neighbours(get_nearest_neighbours):
+    """data_utils.get_nearest_neighbours for LOW_MEMORY_ROWS residues at a
+    time; each residue's nearest context atoms are found independently."""
+
+    def nearest(CB, mask, *args, **kwargs):
+        blocks = [
+            get_nearest_neighbours(
+                CB[start : start + LOW_MEMORY_ROWS],
+                mask[start : start + LOW_MEMORY_ROWS],
+                *args,
+                **kwargs,
+            )
+            for start in range(0, CB.shape[0], LOW_MEMORY_ROWS)
+        ]
+        return tuple(torch.cat(parts, 0) for parts in zip(*blocks))
+
+    return nearest
+
+
+@contextmanager
+def _blockwise_ligand_context():
+    """Find the context atoms of each residue in blocks while featurizing,
+    instead of over every residue and atom pair at once."""
+    get_nearest_neighbours = getattr(data_utils, "get_nearest_neighbours", None)
+    if get_nearest_neighbours is not None:
+        data_utils.get_nearest_neighbours = _blockwise_ligand_neighbours(
+            get_nearest_neighbours
+        )
+    try:
+        yield
+    finally:
+        if get_nearest_neighbours is not None:
+            data_utils.get_nearest_neighbours = get_nearest_neighbours
+
+
+@contextmanager
+def _low_memory_features(model):
+    """Swap the all-pairs steps of the model's featurization for blockwise ones.
+
+    The encoder's neighbour search and the RBF edge features otherwise build
+    distance matrices over every residue (or atom) pair. The replacements
+    compute the same values with memory linear in the number of residues.
+    """
+    features = model.features
+    patched = ["_dist"]
+    features._dist = _blockwise_dist(features)
+    if hasattr(features, "_get_rbf"):
+        features._get_rbf = _neighbour_rbf(features)
+        patched.append("_get_rbf")
+    try:
+        yield
+    finally:
+        for name in patched:
+            delattr(features, name)
+
+
+@dataclass
+class ParsedStructure:
+    """Parser and featurizer output for one structure and parse settings."""
+
+    protein_dict: Dict
+    feature_dict: Dict
+    backbone: object
+    other_atoms: object
+    icodes: List[str]
+
+
+@dataclass
+class PreparedStructure:
+    """A parsed and featurized input structure, ready for sampling."""
+
+    name: str
+    pdb_path: Path
+    protein_dict: Dict
+    backbone: object
+    other_atoms: object
+    icodes: List[str]
+    encoded_residues: List[str]
+    feature_dict: Dict
+
+
+@dataclass
+class SampledDesigns:
+    S: torch.Tensor
+    log_probs: torch.Tensor
+    sampling_probs: torch.Tensor
+    decoding_order: torch.Tensor
+    loss: torch.Tensor
+    loss_per_residue: torch.Tensor
+    loss_XY: torch.Tensor
+    batch_size: int
+    batch_indices: List[int] = field(default_factory=list)
+    S_list: List[torch.Tensor] = field(default_factory=list)
+    design_ids: List[int] = field(default_factory=list)
+
+
+@dataclass
+class ContextCrop:
+    """The residues of a structure that can affect its designed positions.
+
+    Sampling on the kept residues alone gives the designed positions the
+    same neighbours, features and decoding order as in the full structure.
+    """
+
+    keep: torch.Tensor
+    # mask * chain_mask and native sequence of the full structure, [1, L]
+    designable: torch.Tensor
+    native: torch.Tensor
+
+    def features(self, feature_dict: Dict) -> Dict:
+        """The per-residue features of the kept residues."""
+        L = self.native.shape[1]
+        return {
+            k: v[:, self.keep]
+            if isinstance(v, torch.Tensor) and v.dim() >= 2 and v.shape[:2] == (1, L)
+            else v
+            for k, v in feature_dict.items()
+        }
+
+    def noise(
+        self, randn: torch.Tensor, uniforms: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Crop per-design noise drawn for the full structure.
+
+        Returns the noise of the kept residues and the full decoding order.
+        Uniforms are indexed by decoding step, so each kept residue gets the
+        one of its step in the full order.
+        """
+        key = (self.designable + 0.0001) * torch.abs(randn)
+        order = torch.argsort(key)
+        positions = torch.arange(order.shape[1], device=order.device)
+        step = torch.empty_like(order)
+        step.scatter_(1, order, positions.expand_as(order))
+        cropped_order = torch.argsort(key[:, self.keep])
+        steps = torch.gather(step[:, self.keep], 1, cropped_order)
+        return randn[:, self.keep], torch.gather(uniforms, 1, steps), order
+
+    def expand(self, output_dict: Dict, order: torch.Tensor) -> Dict:
+        """Sampling outputs for the full structure; residues outside the crop
+        keep their native amino acid and get zero probabilities."""
+        N, L = order.shape
+        # Parsed sequences are int32, sampled ones int64
+        S = self.native.expand(N, L).to(output_dict["S"].dtype).clone()
+        S[:, self.keep] = output_dict["S"]
+        outputs = {"S": S, "decoding_order": order}
+        for k in ["log_probs", "sampling_probs"]:
+            value = output_dict[k]
+            outputs[k] = value.new_zeros((N, L) + tuple(value.shape[2:]))
+            outputs[k][:, self.keep] = value
+        return outputs
+
+
+class UniqueDesigns:
+    """Keeps the first design of every distinct sequence until a target count.
+
+    Designs below min_confidence (overall confidence) are dropped as well.
+    """
+
+    def __init__(self, target: int, min_confidence: float = 0.0):
+        self.target = target
+        self.min_confidence = min_confidence
+        self.seen = set()
+        self.sampled = 0
+
+    @property
+    def done(self) -> bool:
+        return len(self.seen) >= self.target
+
+    def select(self, S: torch.Tensor, loss: torch.Tensor) -> List[int]:
+        """Rows of this chunk to keep, in order."""
+        rows = []
+        confidence = torch.exp(-loss).cpu().numpy()
+        for row, seq in enumerate(S.cpu().numpy()):
+            self.sampled += 1
+            if self.done or confidence[row] < self.min_confidence:
+                continue
+            key = seq.tobytes()
+            if key not in self.seen:
+                self.seen.add(key)
+                rows.append(row)
+        return rows
+
+
+# How much longer than the shortest structure of a shared sampling call the
+# longest may be; the difference is padding the device computes for nothing
+MAX_PADDING = 0.25
+
+
+def _stack_padded(feature_dicts: List[Dict], L_max: int) -> Dict:
+    """Stack per-residue feature tensors of several structures along the
+    batch dimension, zero padded to L_max residues (and so masked out)."""
+    stacked = dict(feature_dicts[0])
+    L = feature_dicts[0]["mask"].shape[1]
+    for k, v in feature_dicts[0].items():
+        if not (isinstance(v, torch.Tensor) and v.dim() >= 2 and v.shape[:2] == (1, L)):
+            continue
+        padded = []
+        for feature_dict in feature_dicts:
+            value = feature_dict[k]
+            row = value.new_zeros((1, L_max) + tuple(value.shape[2:]))
+            row[:, : value.shape[1]] = value
+            padded.append(row)
+        stacked[k] = torch.cat(padded)
+    return stacked
+
+
+def _split_call(
+    items: List[Tuple[PreparedStructure, DesignOptions, List[int]]],
+    call: List[Tuple[int, int]],
+    output_dict: Dict,
+) -> Iterator[Tuple[int, Tuple[List[int], Dict]]]:
+    """Cut a shared sampling call back into per-structure outputs, without
+    the padding. Rows of one structure are contiguous within a call."""
+    first = 0
+    while first < len(call):
+        i = call[first][0]
+        last = first
+        while last < len(call) and call[last][0] == i:
+            last += 1
+        L = items[i][0].feature_dict["mask"].shape[1]
+        # Pad positions are decoded first; dropping them keeps the order
+        order = output_dict["decoding_order"][first:last]
+        outputs = {
+            k: output_dict[k][first:last, :L]
+            for k in ["S", "log_probs", "sampling_probs"]
+        }
+        outputs["decoding_order"] = order[order < L].view(last - first, L)
+        yield i, ([design_id for _, design_id in call[first:last]], outputs)
+        first = last
+
+
+class LigandMPNNEngine:
+    """Keeps a LigandMPNN model resident and designs structures in-process.
+
+    This mirrors the main loop of LigandMPNN's run.py, split into prepare,
+    sample, pack and write steps so that callers can reuse each of them.
+    """
+
+    def __init__(
+        self,
+        model_type: str = "ligand_mpnn",
+        checkpoint_path: Optional[str] = None,
+        ligand_mpnn_use_side_chain_context: int = 0,
+        device: Optional[torch.device] = None,
+        structure_cache: Optional[StructureCache] = None,
+        load_model: bool = True,
+    ):
+        if device is None:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = device
+        self.structure_cache = structure_cache
+        self.model_type = model_type
+        self.checkpoint_path = checkpoint_path or resolve_checkpoint(model_type, None)
+
+        # Memory-mapped, so the weights are only read when the model is built
+        checkpoint = torch.load(self.checkpoint_path, map_location="cpu", mmap=True)
+        if model_type == "ligand_mpnn":
+            self.atom_context_num = checkpoint["atom_context_num"]
+            self.ligand_mpnn_use_side_chain_context = ligand_mpnn_use_side_chain_context
+        else:
+            self.atom_context_num = 1
+            self.ligand_mpnn_use_side_chain_context = 0
+        self.k_neighbors = checkpoint["num_edges"]
+        del checkpoint
+
+        self._model = None
+        if load_model:
+            self._model = self._load_model()
+        self._packer = None
+
+    @property
+    def model(self) -> ProteinMPNN:
+        """The design model; built on first use by engines created without it."""
+        if self._model is None:
+            with METRICS.stage("model_load"):
+                self._model = self._load_model()
+        return self._model
+
+    def _load_model(self) -> ProteinMPNN:
+        checkpoint = torch.load(
+            self.checkpoint_path, map_location=self.device, mmap=True
+        )
+        model = ProteinMPNN(
+            node_features=128,
+            edge_features=128,
+            hidden_dim=128,
+            num_encoder_layers=3,
+            num_decoder_layers=3,
+            k_neighbors=self.k_neighbors,
+            device=self.device,
+            atom_context_num=self.atom_context_num,
+            model_type=self.model_type,
+            ligand_mpnn_use_side_chain_context=self.ligand_mpnn_use_side_chain_context,
+        )
+        model.load_state_dict(checkpoint["model_state_dict"])
+        model.to(self.device)
+        model.eval()
+        return model
+
+    @property
+    def packer(self) -> Packer:
+        if self._packer is None:
+            with METRICS.stage("packer_load"):
+                self._packer = self._load_packer()
+        return self._packer
+
+    def _load_packer(self) -> Packer:
+        packer = Packer(
+            node_features=128,
+            edge_features=128,
+            num_positional_embeddings=16,
+            num_chain_embeddings=16,
+            num_rbf=16,
+            hidden_dim=128,
+            num_encoder_layers=3,
+            num_decoder_layers=3,
+            atom_context_num=16,
+            lower_bound=0.0,
+            upper_bound=20.0,
+            top_k=32,
+            dropout=0.0,
+            augment_eps=0.0,
+            atom37_order=False,
+            device=self.device,
+            num_mix=3,
+        )
+        checkpoint_sc = torch.load(
+            model_params_path(SIDE_CHAIN_CHECKPOINT), map_location=self.device
+        )
+        packer.load_state_dict(checkpoint_sc["model_state_dict"])
+        packer.to(self.device)
+        packer.eval()
+        return packer
+
+    def parse_settings(self, options: DesignOptions) -> Dict:
+        """Options that determine the parsed and featurized structure."""
+        return {
+            "model_type": self.model_type,
+            "atom_context_num": self.atom_context_num,
+            "parse_these_chains_only": options.parse_these_chains_only or "",
+            "parse_atoms_with_zero_occupancy": int(
+                options.parse_atoms_with_zero_occupancy
+            ),
+            "parse_all_atoms": int(
+                bool(
+                    options.ligand_mpnn_use_side_chain_context
+                    or (options.pack_side_chains and not options.repack_everything)
+                )
+            ),
+            "ligand_mpnn_use_atom_context": int(options.ligand_mpnn_use_atom_context),
+            "ligand_mpnn_cutoff_for_score": float(options.ligand_mpnn_cutoff_for_score),
+        }
+
+    def parse(self, pdb_path: Path, options: DesignOptions) -> ParsedStructure:
+        """Parse and featurize a structure, independent of residue selection."""
+        pdb_path = Path(pdb_path)
+        settings = self.parse_settings(options)
+        key = None
+        if self.structure_cache is not None:
+            key = structure_key(pdb_path, settings)
+            parsed = self.structure_cache.get(key, self.device)
+            if parsed is not None:
+                return parsed
+
+        if options.parse_these_chains_only:
+            parse_these_chains_only_list = options.parse_these_chains_only.split(",")
+        else:
+            parse_these_chains_only_list = []
+        protein_dict, backbone, other_atoms, icodes, _ = parse_PDB(
+            str(pdb_path),
+            device=self.device,
+            chains=parse_these_chains_only_list,
+            parse_all_atoms=bool(settings["parse_all_atoms"]),
+            parse_atoms_with_zero_occupancy=options.parse_atoms_with_zero_occupancy,
+        )
+        if other_atoms:
+            other_atoms.setBetas(other_atoms.getBetas() * 0.0)
+        if self.model_type in (
+            "per_residue_label_membrane_mpnn",
+            "global_label_membrane_mpnn",
+        ):
+            protein_dict["membrane_per_residue_labels"] = torch.zeros_like(
+                protein_dict["R_idx"]
+            )
+
+        # featurize copies the chain mask through; it is filled in per design
+        # by prepare, so the cached features stay selection independent
+        protein_dict["chain_mask"] = torch.ones_like(protein_dict["R_idx"])
+        low_memory = (
+            _blockwise_ligand_context() if options.low_memory else nullcontext()
+        )
+        with torch.no_grad(), low_memory:
+            feature_dict = featurize(
+                protein_dict,
+                cutoff_for_score=options.ligand_mpnn_cutoff_for_score,
+                use_atom_context=options.ligand_mpnn_use_atom_context,
+                number_of_ligand_atoms=self.atom_context_num,
+                model_type=self.model_type,
+            )
+        del protein_dict["chain_mask"]
+        del feature_dict["chain_mask"]
+
+        parsed = ParsedStructure(
+            protein_dict=protein_dict,
+            feature_dict=feature_dict,
+            backbone=backbone,
+            other_atoms=other_atoms,
+            icodes=list(icodes),
+        )
+        if self.structure_cache is not None:
+            self.structure_cache.put(key, parsed)
+        return parsed
+
+    @contextmanager
+    def reuse_encodings(self):
+        """Run the encoder once per structure for everything sampled inside.
+
+        Temperature, biases, omissions, seeds and residue selections only act
+        on the decoder, so within this block the encoder output is memoized on
+        the (cached) structure tensors. Side-chain context is the exception:
+        there the chain mask decides which side chains the encoder sees, so it
+        becomes part of the key.
+        """
+        original_encode = self.model.encode
+        encodings = {}
+
+        def encode(feature_dict):
+            key = [id(feature_dict["X"])]
+            if self.ligand_mpnn_use_side_chain_context:
+                key.append(feature_dict["chain_mask"].cpu().numpy().tobytes())
+            key = tuple(key)
+            if key not in encodings:
+                encodings[key] = (feature_dict["X"], original_encode(feature_dict))
+            return encodings[key][1]
+
+        self.model.encode = encode
+        try:
+            yield
+        finally:
+            del self.model.encode
+
+    def memory_mode(self, options: DesignOptions):
+        """Blockwise model featurization inside this block when options ask
+        for it."""
+        if options.low_memory:
+            return _low_memory_features(self.model)
+        return nullcontext()
+
+    def context_crop(self, prepared: PreparedStructure) -> Optional[ContextCrop]:
+        """The residues within reach of the designed ones, or None when that
+        is nearly the whole structure.
+
+        Information moves one neighbour edge per encoder or decoder layer, so
+        residues more edges than that away from every designed residue cannot
+        change its output. One more hop keeps the neighbour lists of all the
+        residues that can the same as in the full structure.
+        """
+        feature_dict = prepared.feature_dict
+        L = feature_dict["mask"].shape[1]
+        if L <= self.k_neighbors:
+            return None
+        designable = feature_dict["mask"] * feature_dict["chain_mask"]
+        reached = designable[0] > 0
+        if not reached.any():
+            return None
+        with torch.no_grad():
+            _, E_idx = _blockwise_dist(self.model.features)(
+                feature_dict["X"][:, :, 1, :], feature_dict["mask"]
+            )
+        hops = len(self.model.encoder_layers) + len(self.model.decoder_layers) + 1
+        for _ in range(hops):
+            reached[E_idx[0][reached].flatten()] = True
+        keep = torch.nonzero(reached)[:, 0]
+        if len(keep) > (1 - MIN_CROP_SAVING) * L:
+            return None
+        return ContextCrop(keep=keep, designable=designable, native=feature_dict["S"])
+
+    def prepare(self, pdb_path: Path, options: DesignOptions) -> PreparedStructure:
+        device = self.device
+        pdb_path = Path(pdb_path)
+        parsed = self.parse(pdb_path, options)
+        protein_dict = dict(parsed.protein_dict)
+        feature_dict = dict(parsed.feature_dict)
+        icodes = parsed.icodes
+
+        R_idx_list = list(protein_dict["R_idx"].cpu().numpy())
+        chain_letters_list = list(protein_dict["chain_letters"])
+        encoded_residues = [
+            str(chain_letters_list[i]) + str(R_idx_item) + icodes[i]
+            for i, R_idx_item in enumerate(R_idx_list)
+        ]
+        encoded_residue_dict = dict(zip(encoded_residues, range(len(encoded_residues))))
+
+        fixed_residues = (options.fixed_residues or "").split()
+        redesigned_residues = (options.redesigned_residues or "").split()
+        fixed_positions = torch.tensor(
+            [int(item not in fixed_residues) for item in encoded_residues],
+            device=device,
+        )
+        redesigned_positions = torch.tensor(
+            [int(item not in redesigned_residues) for item in encoded_residues],
+            device=device,
+        )
+
+        if options.chains_to_design:
+            chains_to_design_list = options.chains_to_design.split(",")
+        else:
+            chains_to_design_list = protein_dict["chain_letters"]
+        chain_mask = torch.tensor(
+            np.array(
+                [
+                    item in chains_to_design_list
+                    for item in protein_dict["chain_letters"]
+                ],
+                dtype=np.int32,
+            ),
+            device=device,
+        )
+        if redesigned_residues:
+            protein_dict["chain_mask"] = chain_mask * (1 - redesigned_positions)
+        elif fixed_residues:
+            protein_dict["chain_mask"] = chain_mask * fixed_positions
+        else:
+            protein_dict["chain_mask"] = chain_mask
+
+        if options.symmetry_residues:
+            remapped_symmetry_residues = [
+                [encoded_residue_dict[t] for t in x.split(",")]
+                for x in options.symmetry_residues.split("|")
+            ]
+        else:
+            remapped_symmetry_residues = [[]]
+        if options.symmetry_weights:
+            symmetry_weights = [
+                [float(item) for item in x.split(",")]
+                for x in options.symmetry_weights.split("|")
+            ]
+        else:
+            symmetry_weights = [[]]
+
+        if options.homo_oligomer:
+            chain_letters_set = list(set(chain_letters_list))
+            reference_chain = chain_letters_set[0]
+            lc = len(reference_chain)
+            residue_indices = [
+                item[lc:] for item in encoded_residues if item[:lc] == reference_chain
+            ]
+            remapped_symmetry_residues = []
+            symmetry_weights = []
+            for res in residue_indices:
+                remapped_symmetry_residues.append(
+                    [encoded_residue_dict[chain + res] for chain in chain_letters_set]
+                )
+                symmetry_weights.append(
+                    [1 / len(chain_letters_set) for _ in chain_letters_set]
+                )
+
+        feature_dict["chain_mask"] = protein_dict["chain_mask"][None,]
+        feature_dict["symmetry_residues"] = remapped_symmetry_residues
+        feature_dict["symmetry_weights"] = symmetry_weights
+
+        return PreparedStructure(
+            name=pdb_path.stem,
+            pdb_path=pdb_path,
+            protein_dict=protein_dict,
+            backbone=parsed.backbone,
+            other_atoms=parsed.other_atoms,
+            icodes=icodes,
+            encoded_residues=encoded_residues,
+            feature_dict=feature_dict,
+        )
+
+    def build_bias(self, prepared: PreparedStructure, options: DesignOptions):
+        device = self.device
+        encoded_residues = prepared.encoded_residues
+        encoded_residue_dict = dict(zip(encoded_residues, range(len(encoded_residues))))
+        L = len(encoded_residues)
+
+        bias_AA = torch.zeros([21], device=device, dtype=torch.float32)
+        if options.bias_AA:
+            for item in options.bias_AA.split(","):
+                AA, value = item.split(":")
+                bias_AA[restype_str_to_int[AA]] = float(value)
+
+        omit_AA = torch.tensor(
+            np.array([AA in (options.omit_AA or "") for AA in alphabet]).astype(
+                np.float32
+            ),
+            device=device,
+        )
+
+        bias_AA_per_residue = self._residue_constraints(
+            prepared.pdb_path,
+            encoded_residue_dict,
+            "bias",
+            options.bias_AA_per_residue_jsonl,
+            options.bias_AA_jsonl,
+        )
+        omit_AA_per_residue = self._residue_constraints(
+            prepared.pdb_path,
+            encoded_residue_dict,
+            "omit",
+            options.omit_AA_per_residue_jsonl,
+            options.omit_AA_jsonl,
+        )
+
+        return (
+            (-1e8 * omit_AA[None, None, :] + bias_AA).repeat([1, L, 1])
+            + bias_AA_per_residue[None]
+            - 1e8 * omit_AA_per_residue[None]
+        )
+
+    def _residue_constraints(
+        self,
+        pdb_path: Path,
+        residues: Dict[str, int],
+        kind: str,
+        per_residue_path: Optional[str],
+        per_pdb_path: Optional[str],
+    ) -> torch.Tensor:
+        """Dense [L, 21] per-residue constraints; the per-PDB file wins."""
+        values = torch.zeros([len(residues), 21], device=self.device, dtype=torch.float32)
+        for path, per_pdb in [(per_residue_path, False), (per_pdb_path, True)]:
+            if not path:
+                continue
+            dense = torch.from_numpy(
+                constraint_index(path, kind, per_pdb).dense(pdb_path, residues)
+            ).to(self.device)
+            values = torch.where(torch.isnan(dense), values, dense)
+        return values
+
+    def sample(
+        self,
+        prepared: PreparedStructure,
+        options: DesignOptions,
+        batch_indices: Optional[List[int]] = None,
+    ) -> SampledDesigns:
+        if batch_indices is None:
+            batch_indices = list(range(options.number_of_batches))
+
+        feature_dict = prepared.feature_dict
+        feature_dict["temperature"] = options.temperature
+        feature_dict["bias"] = self.build_bias(prepared, options)
+        if options.auto_batch_size:
+            chunks = self._sample_auto(prepared, options, batch_indices)
+        else:
+            chunks = self._sample_batches(prepared, options, batch_indices)
+        with self.memory_mode(options):
+            return self._collect(prepared, options, batch_indices, chunks)
+
+    def _collect(
+        self,
+        prepared: PreparedStructure,
+        options: DesignOptions,
+        batch_indices: List[int],
+        chunks: Iterator[Tuple[List[int], Dict]],
+    ) -> SampledDesigns:
+        """Score the sampling calls of one structure and join them up."""
+        feature_dict = prepared.feature_dict
+        if self.model_type == "ligand_mpnn":
+            combined_mask = (
+                feature_dict["mask"] * feature_dict["mask_XY"] * feature_dict["chain_mask"]
+            )
+        else:
+            combined_mask = feature_dict["mask"] * feature_dict["chain_mask"]
+
+        outputs = {
+            k: []
+            for k in [
+                "S",
+                "log_probs",
+                "sampling_probs",
+                "decoding_order",
+                "loss",
+                "loss_per_residue",
+                "loss_XY",
+            ]
+        }
+        design_ids = []
+        unique = None
+        if options.unique_designs > 0:
+            unique = UniqueDesigns(options.unique_designs, options.min_confidence)
+        with torch.no_grad():
+            for chunk_ids, output_dict in chunks:
+                loss, loss_per_residue = get_score(
+                    output_dict["S"],
+                    output_dict["log_probs"],
+                    feature_dict["mask"] * feature_dict["chain_mask"],
+                )
+                loss_XY, _ = get_score(
+                    output_dict["S"], output_dict["log_probs"], combined_mask
+                )
+                chunk = {
+                    "S": output_dict["S"],
+                    "log_probs": output_dict["log_probs"],
+                    "sampling_probs": output_dict["sampling_probs"],
+                    "decoding_order": output_dict["decoding_order"],
+                    "loss": loss,
+                    "loss_per_residue": loss_per_residue,
+                    "loss_XY": loss_XY,
+                }
+                if unique is not None:
+                    rows = unique.select(output_dict["S"], loss)
+                    chunk = {k: v[rows] for k, v in chunk.items()}
+                    chunk_ids = [chunk_ids[row] for row in rows]
+                for k, v in chunk.items():
+                    outputs[k].append(v)
+                design_ids.extend(chunk_ids)
+                if unique is not None and unique.done:
+                    break
+
+        if unique is not None:
+            print(
+                f"Kept {len(design_ids)} unique designs of {unique.sampled} sampled"
+                + (" (target reached)" if unique.done else "")
+            )
+        return SampledDesigns(
+            **{k: torch.cat(v, 0) for k, v in outputs.items()},
+            batch_size=options.batch_size,
+            batch_indices=list(batch_indices),
+            S_list=[S for S in outputs["S"] if S.shape[0] > 0],
+            design_ids=design_ids,
+        )
+
+    def _sample_batches(
+        self,
+        prepared: PreparedStructure,
+        options: DesignOptions,
+        batch_indices: List[int],
+    ) -> Iterator[Tuple[List[int], Dict]]:
+        """Sample the batches as given, each seeded by its batch index.
+
+        Yields the design ids of each sampling call with its outputs.
+        """
+        feature_dict = prepared.feature_dict
+        feature_dict["batch_size"] = options.batch_size
+        for batch_index in batch_indices:
+            seed = batch_seed(options.seed, batch_index)
+            torch.manual_seed(seed)
+            random.seed(seed)
+            np.random.seed(seed)
+            feature_dict["randn"] = torch.randn(
+                [feature_dict["batch_size"], feature_dict["mask"].shape[1]],
+                device=self.device,
+            )
+            design_ids = [
+                batch_index * options.batch_size + i + 1
+                for i in range(options.batch_size)
+            ]
+            yield design_ids, self.model.sample(feature_dict)
+
+    def _sample_auto(
+        self,
+        prepared: PreparedStructure,
+        options: DesignOptions,
+        batch_indices: List[int],
+    ) -> Iterator[Tuple[List[int], Dict]]:
+        """Sample the requested designs in memory-sized chunks.
+
+        Every design draws its decoding order and amino acids from its own
+        generator, seeded by the run seed and its design id, so the sequences
+        do not depend on how designs are grouped into sampling calls. When a
+        call runs out of memory the chunk is halved and retried.
+
+        In low-memory mode the model only sees the context crop of the
+        structure, if it has one; the noise is still drawn for the full
+        structure and the outputs are expanded back to it.
+        """
+        feature_dict = prepared.feature_dict
+        L = feature_dict["mask"].shape[1]
+        design_ids = [
+            batch_index * options.batch_size + i + 1
+            for batch_index in batch_indices
+            for i in range(options.batch_size)
+        ]
+        symmetric = not (
+            len(feature_dict["symmetry_residues"]) == 1
+            and len(feature_dict["symmetry_residues"][0]) == 0
+        )
+        crop = None
+        if options.low_memory and not symmetric:
+            crop = self.context_crop(prepared)
+        if crop is not None:
+            print(
+                f"Sampling on the {len(crop.keep)} of {L} residues within reach "
+                "of the designed ones"
+            )
+            feature_dict = crop.features(feature_dict)
+        max_chunk = len(design_ids)
+        if options.unique_designs > 0:
+            # Small enough calls that sampling can stop soon after the target
+            max_chunk = min(max_chunk, max(options.batch_size, options.unique_designs))
+        chunk_size = plan_batch_size(
+            self.device,
+            num_residues=feature_dict["mask"].shape[1],
+            num_ligand_atoms=len(prepared.protein_dict.get("Y", [])),
+            k_neighbors=self.k_neighbors,
+            max_batch_size=max_chunk,
+            pack_side_chains=bool(options.pack_side_chains),
+            sc_num_samples=options.sc_num_samples,
+        )
+        print(f"Sampling up to {chunk_size} designs per call")
+
+        start = 0
+        while start < len(design_ids):
+            chunk = design_ids[start : start + chunk_size]
+            if symmetric:
+                # Symmetric decoding shares one decoding order per call, taken
+                # from the batch, so a call must not span two batches
+                batch = (chunk[0] - 1) // options.batch_size
+                chunk = [d for d in chunk if (d - 1) // options.batch_size == batch]
+            randn, uniforms = self._design_noise(options, chunk, L, symmetric)
+            if crop is not None:
+                randn, uniforms, order = crop.noise(randn, uniforms)
+            try:
+                output_dict = self._decode(
+                    self.model.encode(feature_dict), feature_dict, randn, uniforms
+                )
+            except Exception as e:
+                if not is_out_of_memory(e) or len(chunk) == 1:
+                    raise
+                release_memory(self.device)
+                chunk_size = max(1, len(chunk) // 2)
+                print(f"Out of memory, retrying with {chunk_size} designs per call")
+                continue
+            if crop is not None:
+                output_dict = crop.expand(output_dict, order)
+            yield chunk, output_dict
+            start += len(chunk)
+
+    def _design_noise(
+        self, options: DesignOptions, design_ids: List[int], L: int, symmetric: bool
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        randn, uniforms = [], []
+        for design_id in design_ids:
+            generator = torch.Generator().manual_seed(
+                design_seed(options.seed, design_id)
+            )
+            randn.append(torch.randn(L, generator=generator))
+            uniforms.append(torch.rand(L, generator=generator))
+        if symmetric:
+            generator = torch.Generator().manual_seed(
+                batch_seed(options.seed, (design_ids[0] - 1) // options.batch_size)
+            )
+            randn = [torch.randn(L, generator=generator)] * len(design_ids)
+        return (
+            torch.stack(randn).to(self.device),
+            torch.stack(uniforms).to(self.device),
+        )
+
+    def can_sample_together(
+        self, prepared: PreparedStructure, options: DesignOptions
+    ) -> bool:
+        """Whether a structure can share sampling calls with other structures.
+
+        Only designs seeded one by one (auto batch sizing) come out the same
+        next to other structures. Symmetric decoding shares one decoding order
+        per call and early exit needs a structure's designs in order, so
+        those are sampled alone, as are structures in low-memory mode.
+        """
+        feature_dict = prepared.feature_dict
+        symmetric = not (
+            len(feature_dict["symmetry_residues"]) == 1
+            and len(feature_dict["symmetry_residues"][0]) == 0
+        )
+        if symmetric or options.unique_designs or options.low_memory:
+            return False
+        return bool(options.auto_batch_size)
+
+    def length_buckets(self, lengths: List[int]) -> List[List[int]]:
+        """Group the indices of structures that are close enough in length to
+        be padded to the longest of their group.
+
+        A structure with at most k_neighbors residues would get padding among
+        its neighbours, so it is only grouped with ones of the same length.
+        """
+        buckets: List[List[int]] = []
+        for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+            if buckets:
+                shortest = lengths[buckets[-1][0]]
+                if lengths[i] == shortest or (
+                    shortest > self.k_neighbors
+                    and lengths[i] <= shortest * (1 + MAX_PADDING)
+                ):
+                    buckets[-1].append(i)
+                    continue
+            buckets.append([i])
+        return buckets
+
+    def sample_together(
+        self, items: List[Tuple[PreparedStructure, DesignOptions, List[int]]]
+    ) -> List[SampledDesigns]:
+        """Sample (structure, options, batch indices) items in shared calls.
+
+        Every call holds designs of several structures, padded to the longest
+        one and masked, and encodes each structure once. As in _sample_auto
+        each design draws its noise from its own seed, and pad positions are
+        decoded first with their steps skipped in the uniforms, so every
+        structure gets the designs it would get alone, up to float rounding.
+        """
+        rows = []
+        for i, (prepared, options, batch_indices) in enumerate(items):
+            prepared.feature_dict["bias"] = self.build_bias(prepared, options)
+            rows.extend(
+                (i, batch_index * options.batch_size + k + 1)
+                for batch_index in batch_indices
+                for k in range(options.batch_size)
+            )
+        L_max = max(prepared.feature_dict["mask"].shape[1] for prepared, _, _ in items)
+        chunk_size = plan_batch_size(
+            self.device,
+            num_residues=L_max,
+            num_ligand_atoms=max(
+                len(prepared.protein_dict.get("Y", [])) for prepared, _, _ in items
+            ),
+            k_neighbors=self.k_neighbors,
+            max_batch_size=len(rows),
+            pack_side_chains=any(options.pack_side_chains for _, options, _ in items),
+            sc_num_samples=max(options.sc_num_samples for _, options, _ in items),
+        )
+        print(
+            f"Sampling {len(items)} structures together, "
+            f"up to {chunk_size} designs per call"
+        )
+
+        chunks: List[List[Tuple[List[int], Dict]]] = [[] for _ in items]
+        start = 0
+        with torch.no_grad():
+            while start < len(rows):
+                call = rows[start : start + chunk_size]
+                try:
+                    output_dict = self._sample_padded(items, call, L_max)
+                except Exception as e:
+                    if not is_out_of_memory(e) or len(call) == 1:
+                        raise
+                    release_memory(self.device)
+                    chunk_size = max(1, len(call) // 2)
+                    print(f"Out of memory, retrying with {chunk_size} designs per call")
+                    continue
+                for i, chunk in _split_call(items, call, output_dict):
+                    chunks[i].append(chunk)
+                start += len(call)
+        return [
+            self._collect(prepared, options, batch_indices, iter(chunks[i]))
+            for i, (prepared, options, batch_indices) in enumerate(items)
+        ]
+
+    def _sample_padded(
+        self,
+        items: List[Tuple[PreparedStructure, DesignOptions, List[int]]],
+        call: List[Tuple[int, int]],
+        L_max: int,
+    ) -> Dict:
+        """One sampling call over (item index, design id) rows."""
+        members = sorted({i for i, _ in call})
+        features = _stack_padded([items[i][0].feature_dict for i in members], L_max)
+        h_V, h_E, E_idx = self.model.encode(features)
+        rows = torch.tensor(
+            [members.index(i) for i, _ in call], device=self.device, dtype=torch.long
+        )
+
+        randn, uniforms, temperatures = [], [], []
+        for i, design_id in call:
+            prepared, options, _ = items[i]
+            L = prepared.feature_dict["mask"].shape[1]
+            r, u = self._design_noise(options, [design_id], L, symmetric=False)
+            randn.append(torch.nn.functional.pad(r, (0, L_max - L)))
+            uniforms.append(torch.nn.functional.pad(u, (L_max - L, 0)))
+            temperatures.append(options.temperature)
+        feature_dict = {
+            **{k: features[k][rows] for k in ["S", "mask", "chain_mask", "bias"]},
+            # Divides the [rows, 21] logits, so each row keeps its own
+            "temperature": torch.tensor(temperatures, device=self.device)[:, None],
+            "symmetry_residues": [[]],
+            "symmetry_weights": [[]],
+        }
+        return self._decode(
+            (h_V[rows], h_E[rows], E_idx[rows]),
+            feature_dict,
+            torch.cat(randn),
+            torch.cat(uniforms),
+        )
+
+    def _decode(
+        self,
+        encoding: Tuple[torch.Tensor, torch.Tensor, torch.Tensor],
+        feature_dict: Dict,
+        randn: torch.Tensor,
+        uniforms: torch.Tensor,
+    ) -> Dict:
+        """Decode one design per row of randn, as ProteinMPNN.sample does.
+
+        The amino acid of design i at decoding step t is drawn by inverse CDF
+        from uniforms[i, t] rather than by torch.multinomial, whose draws
+        depend on the other rows of the call, so a design comes out the same
+        whichever designs it is sampled with. The encoding and the per-residue
+        features have one row per design, or a single row shared by all.
+        """
+        N, L = randn.shape
+        device = randn.device
+
+        def per_design(x: torch.Tensor) -> torch.Tensor:
+            return x.expand(N, *x.shape[1:]) if x.shape[0] == 1 else x
+
+        h_V, h_E, E_idx = (per_design(x) for x in encoding)
+        S_true = per_design(feature_dict["S"])
+        mask = per_design(feature_dict["mask"])
+        chain_mask = mask * per_design(feature_dict["chain_mask"])
+        bias = per_design(feature_dict["bias"])
+        temperature = feature_dict["temperature"]
+        symmetry_residues = feature_dict["symmetry_residues"]
+        designs = torch.arange(N, device=device)
+
+        decoding_order = torch.argsort((chain_mask + 0.0001) * torch.abs(randn))
+        weights = torch.ones(L, device=device, dtype=torch.float32)
+        if len(symmetry_residues) == 1 and len(symmetry_residues[0]) == 0:
+            steps = [[decoding_order[:, t]] for t in range(L)]
+        else:
+            # Symmetric residues are decoded together, in the first design's
+            # order, from their weighted logits
+            for group, group_weights in zip(
+                symmetry_residues, feature_dict["symmetry_weights"]
+            ):
+                for t, weight in zip(group, group_weights):
+                    weights[t] = weight
+            groups: List[List[int]] = []
+            decoded = set()
+            for t in decoding_order[0].tolist():
+                if t not in decoded:
+                    group = next((g for g in symmetry_residues if t in g), [t])
+                    groups.append(list(group))
+                    decoded.update(group)
+            decoding_order = torch.tensor(
+                [t for group in groups for t in group], device=device
+            )[None].repeat(N, 1)
+            steps = [
+                [torch.full((N,), t, device=device) for t in group] for group in groups
+            ]
+
+        permutation = torch.nn.functional.one_hot(decoding_order, num_classes=L).float()
+        order_mask_backward = torch.einsum(
+            "ij, biq, bjp->bqp",
+            (1 - torch.triu(torch.ones(L, L, device=device))),
+            permutation,
+            permutation,
+        )
+        mask_attend = torch.gather(order_mask_backward, 2, E_idx).unsqueeze(-1)
+        mask_1D = mask.reshape([N, L, 1, 1])
+        mask_bw = mask_1D * mask_attend
+        mask_fw = mask_1D * (1.0 - mask_attend)
+
+        all_probs = torch.zeros((N, L, 20), device=device, dtype=torch.float32)
+        all_log_probs = torch.zeros((N, L, 21), device=device, dtype=torch.float32)
+        h_S = torch.zeros(h_V.shape, device=device, dtype=h_V.dtype)
+        S = 20 * torch.ones((N, L), dtype=torch.int64, device=device)
+        h_V_stack = [h_V] + [
+            torch.zeros(h_V.shape, device=device, dtype=h_V.dtype)
+            for _ in range(len(self.model.decoder_layers))
+        ]
+        h_EX_encoder = cat_neighbors_nodes(torch.zeros_like(h_S), h_E, E_idx)
+        h_EXV_encoder_fw = mask_fw * cat_neighbors_nodes(h_V, h_EX_encoder, E_idx)
+
+        def at(x: torch.Tensor, t: torch.Tensor) -> torch.Tensor:
+            """x[i, t[i]] of every design i, keeping the position dimension."""
+            index = t.reshape(N, 1, *[1] * (x.dim() - 2))
+            return torch.gather(x, 1, index.expand(N, 1, *x.shape[2:]))
+
+        for step, positions in enumerate(steps):
+            total_logits = 0.0
+            for t in positions:
+                mask_t = mask[designs, t]
+                bias_t = bias[designs, t]
+                E_idx_t = at(E_idx, t)
+                h_ES_t = cat_neighbors_nodes(h_S, at(h_E, t), E_idx_t)
+                h_EXV_encoder_t = at(h_EXV_encoder_fw, t)
+                mask_bw_t = at(mask_bw, t)
+                for l, layer in enumerate(self.model.decoder_layers):
+                    h_ESV_decoder_t = cat_neighbors_nodes(h_V_stack[l], h_ES_t, E_idx_t)
+                    h_ESV_t = mask_bw_t * h_ESV_decoder_t + h_EXV_encoder_t
+                    h_V_stack[l + 1][designs, t] = layer(
+                        at(h_V_stack[l], t), h_ESV_t, mask_V=mask_t[:, None]
+                    )[:, 0]
+                logits = self.model.W_out(h_V_stack[-1][designs, t])
+                log_probs = torch.nn.functional.log_softmax(logits, dim=-1)
+                all_log_probs[designs, t] = (
+                    chain_mask[designs, t][:, None] * log_probs
+                ).float()
+                total_logits = total_logits + weights[t][:, None] * logits
+
+            probs = torch.nn.functional.softmax(
+                (total_logits + bias_t) / temperature, dim=-1
+            )
+            # Hard omit of X
+            probs_sample = probs[:, :20] / torch.sum(probs[:, :20], dim=-1, keepdim=True)
+            S_t = _draw(probs_sample, uniforms[:, step])
+            for t in positions:
+                chain_mask_t = chain_mask[designs, t]
+                all_probs[designs, t] = (chain_mask_t[:, None] * probs_sample).float()
+                S_t = (
+                    S_t * chain_mask_t + S_true[designs, t] * (1.0 - chain_mask_t)
+                ).long()
+                h_S[designs, t] = self.model.W_s(S_t)
+                S[designs, t] = S_t
+
+        return {
+            "S": S,
+            "sampling_probs": all_probs,
+            "log_probs": all_log_probs,
+            "decoding_order": decoding_order,
+        }
+
+    def score_log_probs(
+        self,
+        prepared: PreparedStructure,
+        S: torch.Tensor,
+        options: DesignOptions,
+        batch_index: int,
+        encoding: Tuple[torch.Tensor, torch.Tensor, torch.Tensor],
+        use_sequence: bool = True,
+    ) -> torch.Tensor:
+        """Log-probabilities [N, L, 21] of the model for the sequences in S.
+
+        Every row is decoded in the same random order, seeded by the run seed
+        and batch_index as in score.py. encoding is the encoder output for the
+        structure (model.encode of its features), computed once by the caller
+        and shared by all sequences, which only the decoder sees.
+        """
+        N, L = S.shape
+        feature_dict = prepared.feature_dict
+        generator = torch.Generator().manual_seed(batch_seed(options.seed, batch_index))
+        randn = torch.randn(L, generator=generator).to(self.device)
+        h_V, h_E, E_idx = encoding
+        scoring_input = {
+            **feature_dict,
+            "S": S,
+            "mask": feature_dict["mask"].repeat(N, 1),
+            "chain_mask": feature_dict["chain_mask"].repeat(N, 1),
+            "randn": randn[None].repeat(N, 1),
+            "batch_size": 1,
+        }
+        self.model.encode = lambda _: (
+            h_V.expand(N, *h_V.shape[1:]),
+            h_E.expand(N, *h_E.shape[1:]),
+            E_idx.expand(N, *E_idx.shape[1:]),
+        )
+        try:
+            with torch.no_grad():
+                return self.model.score(scoring_input, use_sequence=use_sequence)[
+                    "log_probs"
+                ]
+        finally:
+            del self.model.encode
+
+    def pack(
+        self,
+        prepared: PreparedStructure,
+        S_list: List[torch.Tensor],
+        options: DesignOptions,
+    ) -> List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """Pack side chains of the sequences in S_list, chunk by chunk.
+
+        Returns (X, X_m, b_factors) per pack round, with one row per sequence.
+        """
+        with torch.no_grad():
+            feature_dict_ = featurize(
+                prepared.protein_dict,
+                cutoff_for_score=8.0,
+                use_atom_context=options.pack_with_ligand_context,
+                number_of_ligand_atoms=16,
+                model_type="ligand_mpnn",
+            )
+            sc_feature_dict = copy.deepcopy(feature_dict_)
+
+            packs = []
+            for _ in range(options.packs_per_design):
+                X_list, X_m_list, b_factor_list = [], [], []
+                for S in S_list:
+                    sc_dict = self._pack_chunk(sc_feature_dict, S, options)
+                    X_list.append(sc_dict["X"])
+                    X_m_list.append(sc_dict["X_m"])
+                    b_factor_list.append(sc_dict["b_factors"])
+                packs.append(
+                    (
+                        torch.cat(X_list, 0),
+                        torch.cat(X_m_list, 0),
+                        torch.cat(b_factor_list, 0),
+                    )
+                )
+        return packs
+
+    def _pack_chunk(
+        self, sc_feature_dict: Dict, S: torch.Tensor, options: DesignOptions
+    ) -> Dict:
+        B = S.shape[0]
+        chunk_dict = {}
+        for k, v in sc_feature_dict.items():
+            if k != "S" and isinstance(v, torch.Tensor) and 2 <= v.dim() <= 5:
+                chunk_dict[k] = v.repeat(B, *([1] * (v.dim() - 1)))
+            else:
+                chunk_dict[k] = v
+        chunk_dict["S"] = S
+        try:
+            return pack_side_chains(
+                chunk_dict,
+                self.packer,
+                options.sc_num_denoising_steps,
+                options.sc_num_samples,
+                options.repack_everything,
+            )
+        except Exception as e:
+            if not options.auto_batch_size or not is_out_of_memory(e) or B == 1:
+                raise
+        del chunk_dict
+        release_memory(self.device)
+        print(f"Out of memory while packing {B} designs, splitting")
+        halves = [
+            self._pack_chunk(sc_feature_dict, S[: B // 2], options),
+            self._pack_chunk(sc_feature_dict, S[B // 2 :], options),
+        ]
+        return {
+            k: torch.cat([half[k] for half in halves], 0)
+            for k in ["X", "X_m", "b_factors"]
+        }
+
+    def _join_chains(self, prepared: PreparedStructure, seq: str, sep: str) -> str:
+        seq_np = np.array(list(seq))
+        return sep.join(
+            "".join(seq_np[mask.cpu().numpy()]) for mask in prepared.protein_dict["mask_c"]
+        )
+
+    def write_outputs(
+        self,
+        prepared: PreparedStructure,
+        sampled: SampledDesigns,
+        options: DesignOptions,
+        out_folder: Path,
+    ) -> DesignResult:
+        out_folder = Path(out_folder)
+        for sub in ["seqs", "backbones", "packed"]:
+            (out_folder / sub).mkdir(parents=True, exist_ok=True)
+        if options.save_stats:
+            (out_folder / "stats").mkdir(parents=True, exist_ok=True)
+
+        name = prepared.name
+        feature_dict = prepared.feature_dict
+        backbone = prepared.backbone
+        other_atoms = prepared.other_atoms
+
+        rec_mask = feature_dict["mask"][:1] * feature_dict["chain_mask"][:1]
+        rec_stack = get_seq_rec(feature_dict["S"][:1], sampled.S, rec_mask)
+        if self.model_type == "ligand_mpnn":
+            combined_mask = (
+                feature_dict["mask"] * feature_dict["mask_XY"] * feature_dict["chain_mask"]
+            )
+        else:
+            combined_mask = feature_dict["mask"] * feature_dict["chain_mask"]
+
+        native_seq = self._join_chains(
+            prepared,
+            "".join(
+                [restype_int_to_str[AA] for AA in feature_dict["S"][0].cpu().numpy()]
+            ),
+            options.fasta_seq_separation,
+        )
+
+        if options.save_stats:
+            torch.save(
+                {
+                    "generated_sequences": sampled.S.cpu(),
+                    "sampling_probs": sampled.sampling_probs.cpu(),
+                    "log_probs": sampled.log_probs.cpu(),
+                    "decoding_order": sampled.decoding_order.cpu(),
+                    "native_sequence": feature_dict["S"][0].cpu(),
+                    "mask": feature_dict["mask"][0].cpu(),
+                    "chain_mask": feature_dict["chain_mask"][0].cpu(),
+                    **(
+                        # Residues within the ligand cutoff, for pocket metrics
+                        {"mask_XY": feature_dict["mask_XY"][0].cpu()}
+                        if "mask_XY" in feature_dict
+                        else {}
+                    ),
+                    "seed": options.seed,
+                    "batch_indices": sampled.batch_indices,
+                    "temperature": options.temperature,
+                },
+                out_folder / "stats" / f"{name}.pt",
+            )
+
+        seed = options.seed
+        result = DesignResult(
+            name=name,
+            seed=seed,
+            native_sequence=native_seq,
+            design_ids=sampled.design_ids,
+            sequences=[],
+            overall_confidence=[],
+            ligand_confidence=[],
+            seq_rec=[],
+        )
+        records = [
+            ">{}, T={}, seed={}, num_res={}, num_ligand_res={}, use_ligand_context={}, ligand_cutoff_distance={}, batch_size={}, number_of_batches={}, model_path={}\n{}".format(
+                name,
+                options.temperature,
+                seed,
+                torch.sum(rec_mask).cpu().numpy(),
+                torch.sum(combined_mask[:1]).cpu().numpy(),
+                bool(options.ligand_mpnn_use_atom_context),
+                float(options.ligand_mpnn_cutoff_for_score),
+                options.batch_size,
+                options.number_of_batches,
+                self.checkpoint_path,
+                native_seq,
+            )
+        ]
+        for ix, ix_suffix in enumerate(sampled.design_ids):
+            seq_rec = float(rec_stack[ix].cpu().numpy())
+            overall = float(np.exp(-sampled.loss[ix].cpu().numpy()))
+            ligand = float(np.exp(-sampled.loss_XY[ix].cpu().numpy()))
+            seq = "".join(
+                [restype_int_to_str[AA] for AA in sampled.S[ix].cpu().numpy()]
+            )
+
+            seq_prody = np.array([restype_1to3[AA] for AA in list(seq)])[None,].repeat(
+                4, 1
+            )
+            bfactor_prody = (
+                sampled.loss_per_residue[ix].cpu().numpy()[None,].repeat(4, 1)
+            )
+            backbone.setResnames(seq_prody)
+            backbone.setBetas(
+                np.exp(-bfactor_prody) * (bfactor_prody > 0.01).astype(np.float32)
+            )
+            backbone_path = out_folder / "backbones" / f"{name}_{ix_suffix}.pdb"
+            if other_atoms:
+                writePDB(str(backbone_path), backbone + other_atoms)
+            else:
+                writePDB(str(backbone_path), backbone)
+
+            joined_seq = self._join_chains(prepared, seq, options.fasta_seq_separation)
+            records.append(
+                ">{}, id={}, T={}, seed={}, overall_confidence={}, ligand_confidence={}, seq_rec={}\n{}".format(
+                    name,
+                    ix_suffix,
+                    options.temperature,
+                    seed,
+                    np.format_float_positional(overall, unique=False, precision=4),
+                    np.format_float_positional(ligand, unique=False, precision=4),
+                    np.format_float_positional(seq_rec, unique=False, precision=4),
+                    joined_seq,
+                )
+            )
+            result.sequences.append(joined_seq)
+            result.overall_confidence.append(overall)
+            result.ligand_confidence.append(ligand)
+            result.seq_rec.append(seq_rec)
+
+        with open(out_folder / "seqs" / f"{name}.fa", "w") as f:
+            f.write("\n".join(records))
+
+        return result
+
+    def write_packed(
+        self,
+        prepared: PreparedStructure,
+        S: torch.Tensor,
+        design_ids: List[int],
+        packs: List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]],
+        out_folder: Path,
+    ) -> None:
+        """Write packed PDBs; row i of S and of every pack is design_ids[i]."""
+        (Path(out_folder) / "packed").mkdir(parents=True, exist_ok=True)
+        for ix, ix_suffix in enumerate(design_ids):
+            for c_pack, (X_stack, X_m_stack, b_factor_stack) in enumerate(packs):
+                write_full_PDB(
+                    str(
+                        Path(out_folder)
+                        / "packed"
+                        / f"{prepared.name}_packed_{ix_suffix}_{c_pack + 1}.pdb"
+                    ),
+                    X_stack[ix].cpu().numpy(),
+                    X_m_stack[ix].cpu().numpy(),
+                    b_factor_stack[ix].cpu().numpy(),
+                    prepared.feature_dict["R_idx_original"][0].cpu().numpy(),
+                    prepared.protein_dict["chain_letters"],
+                    S[ix].cpu().numpy(),
+                    other_atoms=prepared.other_atoms,
+                    icodes=prepared.icodes,
+                    force_hetatm=0,
+                )
+
+    def design(
+        self,
+        structure: Path,
+        options: DesignOptions,
+        out_folder: Path,
+        batch_indices: Optional[List[int]] = None,
+        packing=None,
+        on_packed: Optional[Callable[[], None]] = None,
+    ) -> DesignResult:
+        """Design one structure.
+
+        If a packing pool is given, side chains are packed there while the
+        caller moves on, and on_packed runs once the packed PDBs are written.
+        """
+        with METRICS.stage("parsing"):
+            prepared = self.prepare(structure, options)
+        with METRICS.stage("sampling"):
+            sampled = self.sample(prepared, options, batch_indices)
+        return self._finish(prepared, sampled, options, out_folder, packing, on_packed)
+
+    def _finish(
+        self,
+        prepared: PreparedStructure,
+        sampled: SampledDesigns,
+        options: DesignOptions,
+        out_folder: Path,
+        packing=None,
+        on_packed: Optional[Callable[[], None]] = None,
+    ) -> DesignResult:
+        """Write the sampled designs, then pack them here or on the pool."""
+        with METRICS.stage("writing"):
+            result = self.write_outputs(prepared, sampled, options, out_folder)
+        if not options.pack_side_chains:
+            return result
+
+        rows = select_for_packing(result, options.pack_top_k)
+        if not rows:
+            return result
+        S = sampled.S[rows]
+        design_ids = [result.design_ids[i] for i in rows]
+        chunk_size = max(chunk.shape[0] for chunk in sampled.S_list)
+        if packing is not None:
+            packing.submit(
+                prepared.pdb_path,
+                options,
+                design_ids,
+                S,
+                out_folder,
+                chunk_size,
+                on_packed,
+            )
+            return result
+        with METRICS.stage("packing"):
+            packs = self.pack(prepared, list(torch.split(S, chunk_size)), options)
+        with METRICS.stage("writing"):
+            self.write_packed(prepared, S, design_ids, packs, out_folder)
+        return result
+
+    def design_many(
+        self, requests: List[Tuple[Path, DesignOptions, Path, List[int]]]
+    ) -> List[DesignResult]:
+        """Design (structure, options, out_folder, batch_indices) requests.
+
+        Structures that can be sampled together are grouped by feature layout
+        and length and share sampling calls; the rest are sampled one at a
+        time. Side chains are packed inline.
+        """
+        with METRICS.stage("parsing"):
+            prepared = [
+                self.prepare(pdb_path, options) for pdb_path, options, _, _ in requests
+            ]
+        groups: Dict[Tuple, List[int]] = {}
+        for i, (_, options, _, _) in enumerate(requests):
+            if self.can_sample_together(prepared[i], options):
+                layout = tuple(
+                    sorted(
+                        k
+                        for k, v in prepared[i].feature_dict.items()
+                        if isinstance(v, torch.Tensor)
+                    )
+                )
+                groups.setdefault(layout, []).append(i)
+
+        sampled: Dict[int, SampledDesigns] = {}
+        with METRICS.stage("sampling"):
+            for members in groups.values():
+                lengths = [prepared[i].feature_dict["mask"].shape[1] for i in members]
+                for bucket in self.length_buckets(lengths):
+                    if len(bucket) == 1:
+                        continue
+                    indices = [members[j] for j in bucket]
+                    items = [
+                        (prepared[i], requests[i][1], requests[i][3]) for i in indices
+                    ]
+                    sampled.update(zip(indices, self.sample_together(items)))
+            for i, (_, options, _, batch_indices) in enumerate(requests):
+                if i not in sampled:
+                    sampled[i] = self.sample(prepared[i], options, batch_indices)
+        return [
+            self._finish(prepared[i], sampled[i], options, out_folder)
+            for i, (_, options, out_folder, _) in enumerate(requests)
+        ]
+
+
+def select_for_packing(result: DesignResult, top_k: int) -> List[int]:
+    """Rows of the designs to pack: all, or the top_k by overall confidence."""
+    rows = list(range(len(result.design_ids)))
+    if top_k <= 0 or top_k >= len(rows):
+        return rows
+    ranked = sorted(rows, key=lambda i: -result.overall_confidence[i])
+    return sorted(ranked[:top_k])
+
+
+_ENGINES: Dict[Tuple, LigandMPNNEngine] = {}
+
+
+def get_engine(
+    options: DesignOptions, device: Optional[str] = None, load_model: bool = True
+) -> LigandMPNNEngine:
+    """Return a resident engine for the model selected by options.
+
+    Without load_model the design model is only built once something uses
+    it, so processes that only pack side chains hold just the packer.
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    checkpoint_path = resolve_checkpoint(
+        options.model_type, options.checkpoint_ligand_mpnn
+    )
+    side_chain_context = (
+        options.ligand_mpnn_use_side_chain_context
+        if options.model_type == "ligand_mpnn"
+        else 0
+    )
+    key = (options.model_type, checkpoint_path, side_chain_context, device)
+    if key not in _ENGINES:
+        with METRICS.stage("model_load"):
+            _ENGINES[key] = LigandMPNNEngine(
+                model_type=options.model_type,
+                checkpoint_path=checkpoint_path,
+                ligand_mpnn_use_side_chain_context=side_chain_context,
+                device=torch.device(device),
+                structure_cache=StructureCache(),
+                load_model=load_model,
+            )
+    return _ENGINES[key]
@@ -0,0 +1,299 @@
+import importlib
+import multiprocessing
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, TypeVar
+
+from wf.cache import ResultCache, cached_design, cached_designs
+from wf.memory import set_memory_share
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+from wf.outputs import DESIGN_TABLE, write_design_table
+from wf.staging import wait_for_inputs
+from wf.sweep import run_sweep
+
+T = TypeVar("T")
+
+EXECUTION_PROFILES = ["gpu", "cpu_small", "cpu_medium", "cpu_large"]
+# Structures prepared at once when several are sampled together
+MICRO_BATCH_STRUCTURES = int(os.environ.get("LIGANDMPNN_MICRO_BATCH_STRUCTURES", "64"))
+
+
+def available_cpus() -> int:
+    """Number of cores this container may use, honouring cgroup CPU quotas."""
+    cpus = len(os.sched_getaffinity(0))
+    quota_files = [
+        (Path("/sys/fs/cgroup/cpu.max"), None),
+        (
+            Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"),
+            Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+        ),
+    ]
+    for quota_file, period_file in quota_files:
+        try:
+            if period_file is None:
+                quota, period = quota_file.read_text().split()
+            else:
+                quota = quota_file.read_text().strip()
+                period = period_file.read_text().strip()
+            if quota not in ("max", "-1"):
+                cpus = min(cpus, max(1, int(quota) // int(period)))
+                break
+        except (OSError, ValueError):
+            continue
+    return cpus
+
+
+def preload_engine() -> None:
+    """Import torch, ProDy and LigandMPNN on a background thread.
+
+    Nothing heavy is imported at module level, so the workflow registers and
+    small tasks start quickly; design tasks call this first so these imports
+    overlap input staging. A later import of wf.engine waits for this one.
+    """
+
+    def load() -> None:
+        with METRICS.stage("import"):
+            importlib.import_module("wf.engine")
+
+    threading.Thread(target=load, daemon=True).start()
+
+
+def detect_device(execution_profile: str = "gpu") -> str:
+    if execution_profile.startswith("cpu"):
+        return "cpu"
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    print("No GPU detected, running on CPU")
+    return "cpu"
+
+
+def report_device(device: str) -> None:
+    if device == "cuda":
+        import torch
+
+        subprocess.run(["nvidia-smi"], check=False)
+        print(f"Using GPU: {torch.cuda.get_device_name(0)}")
+    else:
+        print(f"Using CPU: {available_cpus()} cores available")
+
+
+def configure_threads(intra_op_threads: int, inter_op_threads: int = 1) -> None:
+    import torch
+
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # Can only be set once per process, before any inter-op work starts
+        pass
+
+
+def plan_workers(device: str, design_workers: int) -> Tuple[int, int]:
+    """Return (number of design workers, torch threads per worker).
+
+    On CPU the default (design_workers=0) is one single-threaded worker per
+    core, which suits short proteins far better than one process using all
+    cores for small matrix ops. On GPU a single worker owns the device.
+    """
+    cpus = available_cpus()
+    if device != "cpu":
+        return 1, cpus
+    workers = design_workers if design_workers > 0 else cpus
+    workers = max(1, min(workers, cpus))
+    return workers, max(1, cpus // workers)
+
+
+def split_work(
+    pdbs: List[T],
+    batch_indices: List[int],
+    number_of_parts: int,
+    split_batches: bool = True,
+) -> List[Tuple[List[T], List[int]]]:
+    """Split structures and batches into at most number_of_parts pieces.
+
+    With at least as many structures as parts, structures are dealt out and
+    every part runs all batches. Otherwise each structure's batches are split
+    into contiguous ranges, unless split_batches is off (e.g. when designs of
+    a structure are deduplicated against each other).
+    """
+    number_of_parts = max(1, number_of_parts)
+    if not split_batches:
+        number_of_parts = min(number_of_parts, max(1, len(pdbs)))
+    if len(pdbs) >= number_of_parts:
+        groups = [pdbs[i::number_of_parts] for i in range(number_of_parts)]
+        return [(group, list(batch_indices)) for group in groups if group]
+
+    splits_per_pdb = max(1, min(len(batch_indices), number_of_parts // len(pdbs)))
+    parts = []
+    for pdb in pdbs:
+        for k in range(splits_per_pdb):
+            start = k * len(batch_indices) // splits_per_pdb
+            end = (k + 1) * len(batch_indices) // splits_per_pdb
+            parts.append(([pdb], list(batch_indices[start:end])))
+    return parts
+
+
+def design_structure(
+    engine,
+    cache: Optional[ResultCache],
+    pdb_path: Path,
+    options: DesignOptions,
+    out_folder: Path,
+    batch_indices: List[int],
+    sweep: Optional[List[Dict]] = None,
+    packing=None,
+) -> None:
+    wait_for_inputs([pdb_path])
+    if sweep:
+        run_sweep(
+            engine,
+            cache,
+            pdb_path,
+            options,
+            sweep,
+            out_folder,
+            batch_indices,
+            packing,
+        )
+    else:
+        result = cached_design(
+            engine, cache, pdb_path, options, out_folder, batch_indices, packing
+        )
+        write_design_table(
+            out_folder / DESIGN_TABLE, result, options.batch_size, options.temperature
+        )
+
+
+def can_micro_batch(
+    pdb_paths: List[Path], options: DesignOptions, sweep: Optional[List[Dict]]
+) -> bool:
+    """Whether different structures may share sampling calls; only designs
+    seeded one by one (auto batch sizing) come out the same that way."""
+    return (
+        len(pdb_paths) > 1
+        and bool(options.auto_batch_size)
+        and not options.unique_designs
+        and not sweep
+    )
+
+
+def design_structures(
+    engine,
+    cache: Optional[ResultCache],
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    out_folders: List[Path],
+    batch_indices: List[int],
+) -> None:
+    """Design several structures, sampling them together where possible."""
+    wait_for_inputs(pdb_paths)
+    results = cached_designs(
+        engine,
+        cache,
+        [
+            (pdb_path, options, out_folder, batch_indices)
+            for pdb_path, out_folder in zip(pdb_paths, out_folders)
+        ],
+    )
+    for out_folder, result in zip(out_folders, results):
+        write_design_table(
+            out_folder / DESIGN_TABLE, result, options.batch_size, options.temperature
+        )
+
+
+def _init_worker(threads: int, workers: int) -> None:
+    configure_threads(threads, 1)
+    set_memory_share(workers)
+
+
+def _design_worker(
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    device: str,
+    out_dir: Path,
+    batch_indices: List[int],
+    cache: Optional[ResultCache],
+    sweep: Optional[List[Dict]],
+) -> Tuple[Path, Dict]:
+    from wf.engine import get_engine
+
+    # Pool processes are reused, so only report this work item's metrics
+    METRICS.reset()
+    engine = get_engine(options, device)
+    if can_micro_batch(pdb_paths, options, sweep):
+        for start in range(0, len(pdb_paths), MICRO_BATCH_STRUCTURES):
+            group = pdb_paths[start : start + MICRO_BATCH_STRUCTURES]
+            design_structures(
+                engine,
+                cache,
+                group,
+                options,
+                [out_dir / pdb_path.stem for pdb_path in group],
+                batch_indices,
+            )
+        return out_dir, METRICS.snapshot()
+    for pdb_path in pdb_paths:
+        design_structure(
+            engine,
+            cache,
+            pdb_path,
+            options,
+            out_dir / pdb_path.stem,
+            batch_indices,
+            sweep,
+        )
+    return out_dir, METRICS.snapshot()
+
+
+def run_worker_pool(
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    device: str,
+    work_dir: Path,
+    batch_indices: List[int],
+    workers: int,
+    threads: int,
+    cache: Optional[ResultCache] = None,
+    sweep: Optional[List[Dict]] = None,
+) -> List[Path]:
+    """Design on several CPU worker processes, one output dir per work item.
+
+    Returned directories are ordered by work item, so merging them keeps
+    batches in order. Worker metrics are added to this process's.
+    """
+    parts = split_work(
+        pdb_paths, batch_indices, workers, split_batches=not options.unique_designs
+    )
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(parts)),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(threads, min(workers, len(parts))),
+    ) as pool:
+        futures = [
+            pool.submit(
+                _design_worker,
+                part_pdbs,
+                options,
+                device,
+                work_dir / f"part_{i}",
+                part_batches,
+                cache,
+                sweep,
+            )
+            for i, (part_pdbs, part_batches) in enumerate(parts)
+        ]
+        out_dirs = []
+        for future in futures:
+            out_dir, snapshot = future.result()
+            METRICS.absorb(snapshot)
+            out_dirs.append(out_dir)
+        return out_dirs
+
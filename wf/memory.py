@@ -0,0 +1,117 @@
+import gc
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+# Fraction of free memory auto batch sizing plans to use, and a multiplier
+# on the estimates below for allocator overhead and fragmentation
+MEMORY_FRACTION = 0.7
+ESTIMATE_OVERHEAD = 1.5
+
+_memory_share = 1
+
+
+def set_memory_share(processes: int) -> None:
+    """Split host memory between this many design processes."""
+    global _memory_share
+    _memory_share = max(1, processes)
+
+
+def _host_available_bytes() -> int:
+    available = None
+    for line in Path("/proc/meminfo").read_text().splitlines():
+        if line.startswith("MemAvailable:"):
+            available = int(line.split()[1]) * 1024
+    limits = [
+        (Path("/sys/fs/cgroup/memory.max"), Path("/sys/fs/cgroup/memory.current")),
+        (
+            Path("/sys/fs/cgroup/memory/memory.limit_in_bytes"),
+            Path("/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+        ),
+    ]
+    for limit_file, usage_file in limits:
+        try:
+            limit = limit_file.read_text().strip()
+            if limit == "max":
+                continue
+            cgroup_available = int(limit) - int(usage_file.read_text().strip())
+            if available is None or cgroup_available < available:
+                available = cgroup_available
+            break
+        except (OSError, ValueError):
+            continue
+    if available is None:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    return available
+
+
+def available_memory_bytes(device: "torch.device") -> int:
+    if device.type == "cuda":
+        import torch
+
+        free, _ = torch.cuda.mem_get_info(device)
+        # Memory cached by the allocator is free for our purposes
+        return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(
+            device
+        )
+    return _host_available_bytes() // _memory_share
+
+
+def estimate_design_bytes(
+    num_residues: int,
+    num_ligand_atoms: int,
+    k_neighbors: int,
+    pack_side_chains: bool = False,
+    sc_num_samples: int = 16,
+) -> Tuple[int, int]:
+    """Rough (fixed, per design) bytes of one sampling call.
+
+    The decoder keeps the L x L decoding order masks and the encoder's edge
+    features repeated per design; packing keeps its own per-design neighbour
+    features. Ligand atoms only add to the single encoder pass.
+    """
+    L = num_residues
+    fixed = 4 * L * (k_neighbors * 128 * 6 + max(num_ligand_atoms, 1) * 8)
+    decode = 12 * L * L + 4 * L * k_neighbors * 1152 + 4 * L * 128 * 8
+    per_design = decode
+    if pack_side_chains:
+        pack = 4 * L * 32 * 128 * 8 + 4 * L * 37 * 3 * sc_num_samples
+        per_design = max(decode, pack)
+    return int(fixed * ESTIMATE_OVERHEAD), int(per_design * ESTIMATE_OVERHEAD)
+
+
+def plan_batch_size(
+    device: "torch.device",
+    num_residues: int,
+    num_ligand_atoms: int,
+    k_neighbors: int,
+    max_batch_size: int,
+    pack_side_chains: bool = False,
+    sc_num_samples: int = 16,
+) -> int:
+    """Largest number of designs per sampling call that should fit in memory."""
+    fixed, per_design = estimate_design_bytes(
+        num_residues, num_ligand_atoms, k_neighbors, pack_side_chains, sc_num_samples
+    )
+    budget = available_memory_bytes(device) * MEMORY_FRACTION - fixed
+    return max(1, min(max_batch_size, int(budget // max(per_design, 1))))
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    if isinstance(error, MemoryError):
+        return True
+    if isinstance(error, RuntimeError):
+        text = str(error)
+        return "out of memory" in text or "can't allocate memory" in text
+    return False
+
+
+def release_memory(device: Optional["torch.device"] = None) -> None:
+    gc.collect()
+    if device is not None and device.type == "cuda":
+        import torch
+
+        torch.cuda.empty_cache()
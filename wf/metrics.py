@@ -0,0 +1,141 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+from latch.functions.messages import message
+
+METRICS_FILE = "metrics.json"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def peak_gpu_mb() -> float:
+    # Without torch loaded nothing can have used the GPU
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return 0.0
+    return torch.cuda.max_memory_allocated() / 1024**2
+
+
+class StageMetrics:
+    """Wall time per stage plus design throughput and peak memory.
+
+    Stage times from worker processes are added to the parent's, so on a
+    worker pool they are summed over workers and can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.structures = 0
+        self.designs = 0
+        self.residues = 0
+        self.worker_peak_rss_mb = 0.0
+        self.worker_peak_gpu_mb = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += seconds
+        stage["calls"] += calls
+
+    def count(self, designs: int, residues: int, structures: int = 1) -> None:
+        self.structures += structures
+        self.designs += designs
+        self.residues += residues
+
+    def absorb(self, snapshot: Dict) -> None:
+        """Add the metrics of a worker process."""
+        for name, stage in snapshot["stages"].items():
+            self.add_time(name, stage["seconds"], stage["calls"])
+        self.structures += snapshot["structures"]
+        self.designs += snapshot["designs"]
+        self.residues += snapshot["residues"]
+        self.worker_peak_rss_mb = max(self.worker_peak_rss_mb, snapshot["peak_rss_mb"])
+        self.worker_peak_gpu_mb = max(self.worker_peak_gpu_mb, snapshot["peak_gpu_mb"])
+
+    def snapshot(self) -> Dict:
+        wall_seconds = time.time() - self.started
+        return {
+            "wall_seconds": wall_seconds,
+            "stages": self.stages,
+            "structures": self.structures,
+            "designs": self.designs,
+            "residues": self.residues,
+            "designs_per_second": self.designs / max(wall_seconds, 1e-9),
+            "residues_per_second": self.residues / max(wall_seconds, 1e-9),
+            "peak_rss_mb": max(peak_rss_mb(), self.worker_peak_rss_mb),
+            "peak_gpu_mb": max(peak_gpu_mb(), self.worker_peak_gpu_mb),
+        }
+
+    def write(self, path: Path, **extra) -> Dict:
+        snapshot = {**self.snapshot(), **extra}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(snapshot, indent=2))
+        return snapshot
+
+
+METRICS = StageMetrics()
+
+
+def combine_snapshots(snapshots: List[Dict]) -> Dict:
+    """Totals over tasks that ran in parallel, e.g. the shards of a run."""
+    stages: Dict[str, Dict[str, float]] = {}
+    for snapshot in snapshots:
+        for name, stage in snapshot["stages"].items():
+            total = stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += stage["seconds"]
+            total["calls"] += stage["calls"]
+    wall_seconds = max([s["wall_seconds"] for s in snapshots] or [0.0])
+    designs = sum(s["designs"] for s in snapshots)
+    residues = sum(s["residues"] for s in snapshots)
+    return {
+        "wall_seconds": wall_seconds,
+        "stages": stages,
+        "structures": sum(s["structures"] for s in snapshots),
+        "designs": designs,
+        "residues": residues,
+        "designs_per_second": designs / max(wall_seconds, 1e-9),
+        "residues_per_second": residues / max(wall_seconds, 1e-9),
+        "peak_rss_mb": max([s["peak_rss_mb"] for s in snapshots] or [0.0]),
+        "peak_gpu_mb": max([s["peak_gpu_mb"] for s in snapshots] or [0.0]),
+        "tasks": snapshots,
+    }
+
+
+def report_metrics(title: str, snapshot: Dict) -> None:
+    """Print the metrics and summarise them in the execution's messages."""
+    stages = sorted(
+        snapshot["stages"].items(), key=lambda x: x[1]["seconds"], reverse=True
+    )
+    lines = [
+        f"{snapshot['designs']} designs of {snapshot['structures']} structures "
+        f"in {snapshot['wall_seconds']:.1f}s",
+        f"{snapshot['designs_per_second']:.2f} designs/s, "
+        f"{snapshot['residues_per_second']:.0f} residues/s",
+        f"Peak RSS {snapshot['peak_rss_mb']:.0f} MB, "
+        f"peak GPU memory {snapshot['peak_gpu_mb']:.0f} MB",
+    ] + [f"{name}: {stage['seconds']:.1f}s ({stage['calls']}x)" for name, stage in stages]
+
+    print("-" * 60)
+    print(title)
+    for line in lines:
+        print(line)
+    message("info", {"title": title, "body": "\n".join(lines)})
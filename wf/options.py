@@ -0,0 +1,80 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from dataclasses_json import dataclass_json
+
+
+@dataclass_json
+@dataclass
+class DesignOptions:
+    model_type: str = "ligand_mpnn"
+    seed: int = 111
+    temperature: float = 0.1
+    number_of_batches: int = 1
+    batch_size: int = 1
+    auto_batch_size: int = 0
+    low_memory: int = 0
+    unique_designs: int = 0
+    min_confidence: float = 0.0
+    checkpoint_ligand_mpnn: Optional[str] = None
+    ligand_mpnn_use_atom_context: int = 1
+    ligand_mpnn_use_side_chain_context: int = 0
+    ligand_mpnn_cutoff_for_score: float = 8.0
+    pack_side_chains: int = 0
+    number_of_packs_per_design: int = 0
+    pack_with_ligand_context: int = 1
+    pack_top_k: int = 0
+    sc_num_denoising_steps: int = 3
+    sc_num_samples: int = 16
+    repack_everything: int = 0
+    fixed_residues: Optional[str] = None
+    redesigned_residues: Optional[str] = None
+    chains_to_design: Optional[str] = None
+    bias_AA: Optional[str] = None
+    bias_AA_jsonl: Optional[str] = None
+    omit_AA: Optional[str] = None
+    omit_AA_jsonl: Optional[str] = None
+    save_stats: int = 0
+    parse_these_chains_only: Optional[str] = None
+    symmetry_residues: Optional[str] = None
+    symmetry_weights: Optional[str] = None
+    homo_oligomer: int = 0
+    bias_AA_per_residue_jsonl: Optional[str] = None
+    omit_AA_per_residue_jsonl: Optional[str] = None
+    parse_atoms_with_zero_occupancy: int = 0
+    fasta_seq_separation: str = ":"
+
+    @property
+    def packs_per_design(self) -> int:
+        # run.py samples 4 packs per design unless told otherwise
+        if self.number_of_packs_per_design > 0:
+            return self.number_of_packs_per_design
+        return 4
+
+
+def load_json_records(path: str) -> Dict:
+    """Load a JSON object, or JSON lines of objects merged into one dict."""
+    text = Path(path).read_text().strip()
+    if len(text) == 0:
+        return {}
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        records = {}
+        for line in text.splitlines():
+            if line.strip():
+                records.update(json.loads(line))
+        return records
+
+
+def records_for_pdb(records: Dict, pdb_path: Path) -> Dict:
+    """Pick the entry of a per-PDB constraint file that belongs to pdb_path."""
+    for key in [str(pdb_path), pdb_path.name, pdb_path.stem]:
+        if key in records:
+            return records[key]
+    for key, value in records.items():
+        if Path(key).stem == pdb_path.stem:
+            return value
+    return {}
@@ -0,0 +1,228 @@
+import csv
+import re
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FASTA_ID = re.compile(r", id=(\d+),")
+FASTA_FIELD = re.compile(r"(\w+)=([^,]*)")
+
+DESIGN_TABLE = "designs.parquet"
+# Structure names and sequences are dictionary encoded; at low temperature
+# many designs repeat, and filtering on pdb becomes an integer comparison.
+DESIGN_SCHEMA = pa.schema(
+    [
+        ("pdb", pa.dictionary(pa.int32(), pa.string())),
+        ("sweep_index", pa.int32()),
+        ("batch_index", pa.int32()),
+        ("design_id", pa.int32()),
+        ("seed", pa.int64()),
+        ("temperature", pa.float32()),
+        ("sequence", pa.dictionary(pa.int32(), pa.string())),
+        ("overall_confidence", pa.float32()),
+        ("ligand_confidence", pa.float32()),
+        ("seq_rec", pa.float32()),
+    ]
+)
+
+
+@dataclass
+class DesignResult:
+    name: str
+    seed: int
+    native_sequence: str
+    design_ids: List[int]
+    sequences: List[str]
+    overall_confidence: List[float]
+    ligand_confidence: List[float]
+    seq_rec: List[float]
+
+
+def read_fasta_records(path: Path) -> List[str]:
+    records = []
+    for chunk in path.read_text().split(">"):
+        if chunk.strip():
+            records.append(">" + chunk.rstrip("\n"))
+    return records
+
+
+def read_design_result(path: Path) -> DesignResult:
+    """Rebuild a DesignResult from a LigandMPNN FASTA file."""
+    records = read_fasta_records(Path(path))
+    header, native_sequence = records[0].split("\n", 1)
+    fields = dict(FASTA_FIELD.findall(header))
+    result = DesignResult(
+        name=header[1:].split(",")[0],
+        seed=int(fields["seed"]),
+        native_sequence=native_sequence.strip(),
+        design_ids=[],
+        sequences=[],
+        overall_confidence=[],
+        ligand_confidence=[],
+        seq_rec=[],
+    )
+    for record in records[1:]:
+        header, sequence = record.split("\n", 1)
+        fields = dict(FASTA_FIELD.findall(header))
+        result.design_ids.append(int(fields["id"]))
+        result.sequences.append(sequence.strip())
+        result.overall_confidence.append(float(fields["overall_confidence"]))
+        result.ligand_confidence.append(float(fields["ligand_confidence"]))
+        result.seq_rec.append(float(fields["seq_rec"]))
+    return result
+
+
+def write_design_table(
+    path: Path,
+    result: DesignResult,
+    batch_size: int,
+    temperature: float,
+    sweep_index: Optional[int] = None,
+) -> None:
+    """Write designs as a Parquet table with one row group per batch."""
+    batches: Dict[int, List[int]] = {}
+    for j, design_id in enumerate(result.design_ids):
+        batches.setdefault((design_id - 1) // batch_size, []).append(j)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with pq.ParquetWriter(path, DESIGN_SCHEMA, compression="zstd") as writer:
+        for batch_index, rows in sorted(batches.items()):
+            n = len(rows)
+            writer.write_table(
+                pa.table(
+                    {
+                        "pdb": [result.name] * n,
+                        "sweep_index": [sweep_index] * n,
+                        "batch_index": [batch_index] * n,
+                        "design_id": [result.design_ids[j] for j in rows],
+                        "seed": [result.seed] * n,
+                        "temperature": [temperature] * n,
+                        "sequence": [result.sequences[j] for j in rows],
+                        "overall_confidence": [
+                            result.overall_confidence[j] for j in rows
+                        ],
+                        "ligand_confidence": [result.ligand_confidence[j] for j in rows],
+                        "seq_rec": [result.seq_rec[j] for j in rows],
+                    },
+                    schema=DESIGN_SCHEMA,
+                )
+            )
+
+
+def merge_design_tables(sources: List[Path], destination: Path) -> None:
+    """Concatenate design tables row group by row group, in source order."""
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    staged = destination.with_suffix(".parquet.tmp")
+    with pq.ParquetWriter(staged, DESIGN_SCHEMA, compression="zstd") as writer:
+        for source in sources:
+            parquet_file = pq.ParquetFile(source)
+            for i in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(i))
+    staged.replace(destination)
+
+
+def collect_design_tables(local_output_dir: Path) -> None:
+    """Combine every per-structure design table into one at the run root."""
+    root_table = local_output_dir / DESIGN_TABLE
+    sources = sorted(local_output_dir.rglob(DESIGN_TABLE))
+    if len(sources) == 0 or sources == [root_table]:
+        return
+    merge_design_tables(sources, root_table)
+    for source in sources:
+        if source != root_table:
+            source.unlink()
+
+
+def merge_fasta(sources: List[Path], destination: Path) -> None:
+    header = None
+    designs: Dict[int, str] = {}
+    for source in sources:
+        records = read_fasta_records(source)
+        if header is None:
+            header = records[0]
+        for record in records[1:]:
+            designs[int(FASTA_ID.search(record).group(1))] = record
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    with open(destination, "w") as f:
+        f.write("\n".join([header] + [designs[k] for k in sorted(designs)]))
+
+
+def merge_stats(sources: List[Path], destination: Path) -> None:
+    import torch
+
+    merged = None
+    for source in sources:
+        stats = torch.load(source)
+        if merged is None:
+            merged = stats
+            continue
+        for k in ["generated_sequences", "sampling_probs", "log_probs", "decoding_order"]:
+            merged[k] = torch.cat([merged[k], stats[k]], 0)
+        merged["batch_indices"] = merged["batch_indices"] + stats["batch_indices"]
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(merged, destination)
+
+
+def merge_tables(sources: List[Path], destination: Path) -> None:
+    """Concatenate CSV tables with the same columns, ordered by their ids."""
+    columns = None
+    rows = []
+    for source in sources:
+        with open(source, newline="") as f:
+            reader = csv.DictReader(f)
+            if columns is None:
+                columns = reader.fieldnames
+            rows.extend(reader)
+    id_columns = [c for c in ["sweep_index", "design_id"] if c in columns]
+    rows.sort(key=lambda row: tuple(int(row[c]) for c in id_columns))
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    with open(destination, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def merge_design_dirs(
+    source_dirs: List[Path], local_output_dir: Path, per_pdb_outputs: bool
+) -> None:
+    """Merge partial design outputs laid out as <source>/<pdb name>/<subdir>.
+
+    The sources must be ordered so that earlier ones hold earlier batches.
+    """
+    fasta_sources: Dict[Path, List[Path]] = {}
+    stats_sources: Dict[Path, List[Path]] = {}
+    table_sources: Dict[Path, List[Path]] = {}
+    design_table_sources: Dict[Path, List[Path]] = {}
+    for source_dir in source_dirs:
+        for pdb_dir in sorted(p for p in source_dir.iterdir() if p.is_dir()):
+            out_folder = local_output_dir
+            if per_pdb_outputs:
+                out_folder = local_output_dir / pdb_dir.name
+            for f in pdb_dir.rglob("*"):
+                if not f.is_file():
+                    continue
+                destination = out_folder / f.relative_to(pdb_dir)
+                if f.parent.name == "seqs" and f.suffix == ".fa":
+                    fasta_sources.setdefault(destination, []).append(f)
+                elif f.parent.name == "stats" and f.suffix == ".pt":
+                    stats_sources.setdefault(destination, []).append(f)
+                elif f.name == DESIGN_TABLE:
+                    design_table_sources.setdefault(destination, []).append(f)
+                elif f.suffix == ".csv":
+                    table_sources.setdefault(destination, []).append(f)
+                else:
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy(f, destination)
+
+    for destination, sources in fasta_sources.items():
+        merge_fasta(sources, destination)
+    for destination, sources in stats_sources.items():
+        merge_stats(sources, destination)
+    for destination, sources in table_sources.items():
+        merge_tables(sources, destination)
+    for destination, sources in design_table_sources.items():
+        merge_design_tables(sources, destination)
@@ -0,0 +1,121 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+import numpy as np
+
+from wf.execution import available_cpus, configure_threads
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+
+if TYPE_CHECKING:
+    import torch
+
+
+def _init_pack_worker(threads: int) -> None:
+    configure_threads(threads, 1)
+
+
+def _pack_job(
+    pdb_path: Path,
+    options: DesignOptions,
+    design_ids: List[int],
+    S: np.ndarray,
+    out_folder: Path,
+    device: str,
+) -> Dict:
+    import torch
+
+    from wf.engine import get_engine
+
+    # Pool processes are reused, so only report this job's metrics
+    METRICS.reset()
+    # Workers only pack, so they never build the design model
+    engine = get_engine(options, device, load_model=False)
+    with METRICS.stage("parsing"):
+        prepared = engine.prepare(pdb_path, options)
+    S = torch.tensor(S, device=engine.device)
+    with METRICS.stage("packing"):
+        packs = engine.pack(prepared, [S], options)
+    with METRICS.stage("writing"):
+        engine.write_packed(prepared, S, design_ids, packs, out_folder)
+    return METRICS.snapshot()
+
+
+class PackingPool:
+    """Side-chain packing on worker processes, fed while sampling continues.
+
+    Each submitted chunk of sequences is packed and written by one worker,
+    which parses the structure again (from the structure cache) and keeps only
+    its own packer resident. Follow-up callbacks run in submission order on a
+    single thread once the jobs they depend on are done.
+    """
+
+    def __init__(self, workers: int, device: str):
+        threads = max(1, available_cpus() // workers) if device == "cpu" else 1
+        self.device = device
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pack_worker,
+            initargs=(threads,),
+        )
+        self._followups = ThreadPoolExecutor(max_workers=1)
+        self._jobs: List[Future] = []
+        self._pending_followups: List[Future] = []
+
+    def submit(
+        self,
+        pdb_path: Path,
+        options: DesignOptions,
+        design_ids: List[int],
+        S: "torch.Tensor",
+        out_folder: Path,
+        chunk_size: int,
+        on_packed: Optional[Callable[[], None]] = None,
+    ) -> None:
+        S = S.cpu().numpy()
+        jobs = [
+            self._pool.submit(
+                _pack_job,
+                pdb_path,
+                options,
+                design_ids[start : start + chunk_size],
+                S[start : start + chunk_size],
+                out_folder,
+                self.device,
+            )
+            for start in range(0, len(design_ids), chunk_size)
+        ]
+        for job in jobs:
+            job.add_done_callback(self._absorb)
+        self._jobs.extend(jobs)
+        if on_packed is not None:
+            self.after(jobs, on_packed)
+
+    def _absorb(self, job: Future) -> None:
+        if job.exception() is None:
+            METRICS.absorb(job.result())
+
+    def after(self, jobs: List[Future], callback: Callable[[], None]) -> None:
+        def run():
+            wait(jobs)
+            for job in jobs:
+                job.result()
+            callback()
+
+        self._pending_followups.append(self._followups.submit(run))
+
+    def after_pending(self, callback: Callable[[], None]) -> None:
+        """Run callback once everything submitted so far is packed."""
+        self.after(list(self._jobs), callback)
+
+    def close(self) -> None:
+        """Wait for every job and follow-up, raising the first failure."""
+        try:
+            for future in self._jobs + self._pending_followups:
+                future.result()
+        finally:
+            self._pool.shutdown()
+            self._followups.shutdown()
@@ -0,0 +1,231 @@
+from dataclasses import replace
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from wf.checkpoints import CHECKPOINTS
+from wf.constraints import ALPHABET
+from wf.options import DesignOptions
+
+# Options that are 0 or 1
+FLAG_OPTIONS = [
+    "auto_batch_size",
+    "low_memory",
+    "ligand_mpnn_use_atom_context",
+    "ligand_mpnn_use_side_chain_context",
+    "pack_side_chains",
+    "pack_with_ligand_context",
+    "repack_everything",
+    "save_stats",
+    "homo_oligomer",
+    "parse_atoms_with_zero_occupancy",
+]
+# Options that name residues or chains of the input structures
+STRUCTURE_OPTIONS = [
+    "fixed_residues",
+    "redesigned_residues",
+    "chains_to_design",
+    "parse_these_chains_only",
+    "symmetry_residues",
+    "homo_oligomer",
+]
+# Residues parse_PDB treats as protein besides ATOM records
+PROTEIN_HETATMS = {"MSE"}
+
+
+def parse_symmetry(
+    symmetry_residues: Optional[str], symmetry_weights: Optional[str]
+) -> Tuple[List[List[str]], List[List[float]]]:
+    """Split 'A1,A2|A3,A4' style residue groups and their weights."""
+    residues = [g.split(",") for g in (symmetry_residues or "").split("|") if g]
+    weights = [
+        [float(w) for w in g.split(",")]
+        for g in (symmetry_weights or "").split("|")
+        if g
+    ]
+    return residues, weights
+
+
+def validate_options(options: DesignOptions) -> List[str]:
+    """Problems with the options that show without looking at a structure."""
+    problems = []
+    if options.model_type not in CHECKPOINTS:
+        problems.append(
+            f"model_type {options.model_type!r} is not one of {', '.join(CHECKPOINTS)}"
+        )
+    for name in FLAG_OPTIONS:
+        if getattr(options, name) not in (0, 1):
+            problems.append(f"{name} must be 0 or 1, got {getattr(options, name)!r}")
+    for name in ["number_of_batches", "batch_size"]:
+        if getattr(options, name) < 1:
+            problems.append(f"{name} must be at least 1")
+    for name in ["unique_designs", "number_of_packs_per_design", "pack_top_k"]:
+        if getattr(options, name) < 0:
+            problems.append(f"{name} must not be negative")
+    if options.temperature <= 0:
+        problems.append("temperature must be positive")
+    if not 0 <= options.min_confidence <= 1:
+        problems.append("min_confidence must be between 0 and 1")
+
+    for item in (options.bias_AA or "").split(","):
+        if not item.strip():
+            continue
+        amino_acid, _, value = item.partition(":")
+        try:
+            float(value)
+        except ValueError:
+            problems.append(f"bias_AA entry {item!r} is not like 'W:3.0'")
+            continue
+        if amino_acid.strip() not in ALPHABET:
+            problems.append(f"bias_AA has unknown amino acid {amino_acid!r}")
+    unknown = sorted(set(options.omit_AA or "") - set(ALPHABET) - set(", "))
+    if unknown:
+        problems.append(f"omit_AA has unknown amino acids {''.join(unknown)}")
+
+    try:
+        residues, weights = parse_symmetry(
+            options.symmetry_residues, options.symmetry_weights
+        )
+    except ValueError:
+        problems.append(f"symmetry_weights {options.symmetry_weights!r} are not numbers")
+    else:
+        if residues and not options.homo_oligomer:
+            if len(weights) != len(residues):
+                problems.append(
+                    f"symmetry_residues has {len(residues)} groups but "
+                    f"symmetry_weights has {len(weights)}"
+                )
+            for i, (group, group_weights) in enumerate(zip(residues, weights)):
+                if len(group) != len(group_weights):
+                    problems.append(
+                        f"Symmetry group {i + 1} has {len(group)} residues but "
+                        f"{len(group_weights)} weights"
+                    )
+        elif weights and not residues:
+            problems.append("symmetry_weights is set without symmetry_residues")
+    return problems
+
+
+@lru_cache(maxsize=None)
+def read_residue_ids(
+    pdb_path: Path, parse_atoms_with_zero_occupancy: bool = False
+) -> Tuple[Tuple[str, str], ...]:
+    """(chain, residue id) of every protein residue, named as in
+    fixed_residues (chain, number and insertion code, e.g. 'A12' or 'A12B').
+
+    A residue counts when it has a CA atom, as in parse_PDB; only the
+    coordinate records are read.
+    """
+    residues: Dict[Tuple[str, str], None] = {}
+    with open(pdb_path) as f:
+        for line in f:
+            record = line[:6]
+            if record == "ENDMDL":
+                break
+            if record != "ATOM  " and not (
+                record == "HETATM" and line[17:20] in PROTEIN_HETATMS
+            ):
+                continue
+            if line[12:16].strip() != "CA":
+                continue
+            occupancy = line[54:60].strip()
+            if (
+                not parse_atoms_with_zero_occupancy
+                and occupancy
+                and float(occupancy) == 0
+            ):
+                continue
+            chain = line[21]
+            residue = f"{chain}{int(line[22:26])}{line[26].strip()}"
+            residues.setdefault((chain, residue), None)
+    return tuple(residues)
+
+
+def check_structure(pdb_path: Path, options: DesignOptions) -> List[str]:
+    """Problems with the residues and chains the options name in one structure."""
+    pdb_path = Path(pdb_path)
+    parse_chains = [c for c in (options.parse_these_chains_only or "").split(",") if c]
+    try:
+        all_residues = read_residue_ids(
+            pdb_path, bool(options.parse_atoms_with_zero_occupancy)
+        )
+    except (OSError, ValueError) as e:
+        return [f"{pdb_path.name}: cannot be read ({e})"]
+    residues = [
+        (chain, residue)
+        for chain, residue in all_residues
+        if not parse_chains or chain in parse_chains
+    ]
+    if len(residues) == 0:
+        return [f"{pdb_path.name}: no protein residues in the parsed chains"]
+
+    chains = sorted({chain for chain, _ in residues})
+    residue_ids = {residue for _, residue in residues}
+    problems = []
+
+    def missing(name: str, wanted: List[str], present) -> None:
+        absent = [w for w in wanted if w not in present]
+        if absent:
+            shown = " ".join(absent[:10]) + (" ..." if len(absent) > 10 else "")
+            problems.append(f"{pdb_path.name}: {name} not in the structure: {shown}")
+
+    missing(
+        "parse_these_chains_only chains",
+        parse_chains,
+        {chain for chain, _ in all_residues},
+    )
+    missing(
+        "chains_to_design chains",
+        [c for c in (options.chains_to_design or "").split(",") if c],
+        chains,
+    )
+    missing("fixed_residues", (options.fixed_residues or "").split(), residue_ids)
+    missing(
+        "redesigned_residues", (options.redesigned_residues or "").split(), residue_ids
+    )
+    if options.homo_oligomer:
+        numbering = {}
+        for chain, residue in residues:
+            numbering.setdefault(chain, set()).add(residue[len(chain) :])
+        if len({frozenset(n) for n in numbering.values()}) > 1:
+            problems.append(
+                f"{pdb_path.name}: homo_oligomer needs every chain to have the "
+                f"same residue numbering (chains {', '.join(chains)})"
+            )
+    elif options.symmetry_residues:
+        groups, _ = parse_symmetry(options.symmetry_residues, None)
+        missing(
+            "symmetry_residues",
+            [residue for group in groups for residue in group],
+            residue_ids,
+        )
+    return problems
+
+
+def needs_structures(options: DesignOptions, sweep: Optional[List[Dict]] = None) -> bool:
+    rows = [{}] + list(sweep or [])
+    return any(
+        getattr(replace(options, **row), name) for row in rows for name in STRUCTURE_OPTIONS
+    )
+
+
+def preflight(
+    options: DesignOptions,
+    pdb_paths: List[Path] = (),
+    sweep: Optional[List[Dict]] = None,
+) -> List[str]:
+    """Every problem found with the options, each sweep combination applied,
+    and with the structures they refer to."""
+    problems = validate_options(options)
+    for pdb_path in pdb_paths:
+        problems.extend(check_structure(pdb_path, options))
+    for i, row in enumerate(sweep or []):
+        variant = replace(options, **row)
+        row_problems = validate_options(variant)
+        for pdb_path in pdb_paths:
+            row_problems.extend(check_structure(pdb_path, variant))
+        # Only what the row itself gets wrong
+        problems.extend(
+            f"Sweep row {i}: {p}" for p in row_problems if p not in problems
+        )
+    return problems
@@ -0,0 +1,283 @@
+import csv
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wf.cache import file_digest
+from wf.constraints import ALPHABET
+from wf.memory import is_out_of_memory, plan_batch_size, release_memory
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+
+SCORES_SUBDIR = "scores"
+# Sequences read, scored and written out as one Parquet part at a time
+SCORE_PART_ROWS = int(os.environ.get("LIGANDMPNN_SCORE_PART_ROWS", "65536"))
+MAX_SEQUENCES_PER_CALL = 4096
+
+SCORE_SCHEMA = pa.schema(
+    [
+        ("pdb", pa.dictionary(pa.int32(), pa.string())),
+        ("name", pa.string()),
+        ("sequence", pa.string()),
+        # Summed and averaged over the designable positions (chain mask)
+        ("total_log_likelihood", pa.float32()),
+        ("mean_log_likelihood", pa.float32()),
+        ("per_residue_log_likelihood", pa.list_(pa.float32())),
+    ]
+)
+
+# Residue letter -> LigandMPNN index; anything else is -1 and invalidates the
+# sequence. Chain separators and whitespace are dropped before lookup.
+_LOOKUP = np.full(256, -1, dtype=np.int64)
+for _i, _aa in enumerate(ALPHABET):
+    _LOOKUP[ord(_aa)] = _i
+    _LOOKUP[ord(_aa.lower())] = _i
+_STRIP = str.maketrans("", "", ":/ \t\r\n")
+
+# (pdb, name, sequence); pdb is None when the sequence applies to every input
+SequenceRow = Tuple[Optional[str], str, str]
+
+
+def _fasta_rows(path: Path) -> Iterator[SequenceRow]:
+    name, lines = None, []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                if name is not None:
+                    yield None, name, "".join(lines)
+                name, lines = line[1:].strip().split(",")[0], []
+            else:
+                lines.append(line.strip())
+    if name is not None:
+        yield None, name, "".join(lines)
+
+
+def _column(columns: List[str], *names: str) -> Optional[str]:
+    for name in names:
+        if name in columns:
+            return name
+    return None
+
+
+def _table_rows(path: Path, delimiter: str) -> Iterator[SequenceRow]:
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        columns = reader.fieldnames or []
+        sequence = _column(columns, "sequence", "seq")
+        if sequence is None:
+            raise ValueError(f"{path.name} has no 'sequence' column")
+        name = _column(columns, "name", "id")
+        pdb = _column(columns, "pdb")
+        for i, row in enumerate(reader):
+            yield (
+                (row[pdb] or None) if pdb else None,
+                row[name] if name else str(i),
+                row[sequence],
+            )
+
+
+def _parquet_rows(path: Path, batch_size: int) -> Iterator[SequenceRow]:
+    parquet_file = pq.ParquetFile(path)
+    columns = parquet_file.schema_arrow.names
+    sequence = _column(columns, "sequence", "seq")
+    if sequence is None:
+        raise ValueError(f"{path.name} has no 'sequence' column")
+    name = _column(columns, "name", "id")
+    pdb = _column(columns, "pdb")
+    i = 0
+    for batch in parquet_file.iter_batches(
+        batch_size=batch_size, columns=[c for c in [pdb, name, sequence] if c]
+    ):
+        data = batch.to_pydict()
+        n = batch.num_rows
+        pdbs = data[pdb] if pdb else [None] * n
+        names = [str(x) for x in data[name]] if name else map(str, range(i, i + n))
+        yield from zip(pdbs, names, data[sequence])
+        i += n
+
+
+def read_sequences(
+    path: Path, part_rows: int = SCORE_PART_ROWS
+) -> Iterator[List[SequenceRow]]:
+    """Read sequences to score in parts of part_rows, without loading the file.
+
+    FASTA records are named by their header up to the first comma. CSV, TSV
+    and Parquet tables need a sequence column and may have name and pdb
+    columns; a pdb restricts a row to the input structure of that name.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        rows = _parquet_rows(path, part_rows)
+    elif suffix in (".csv", ".tsv"):
+        rows = _table_rows(path, "\t" if suffix == ".tsv" else ",")
+    else:
+        rows = _fasta_rows(path)
+    part = []
+    for row in rows:
+        part.append(row)
+        if len(part) == part_rows:
+            yield part
+            part = []
+    if part:
+        yield part
+
+
+def encode_sequences(sequences: List[str], length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Residue indices [n, length] of the sequences, and which ones are valid.
+
+    A sequence is invalid if, without chain separators, it does not have one
+    letter per residue of the structure or uses a letter outside the alphabet.
+    """
+    stripped = [s.translate(_STRIP) for s in sequences]
+    valid = np.array([len(s) == length for s in stripped], dtype=bool)
+    S = np.zeros((len(sequences), length), dtype=np.int64)
+    if valid.any():
+        text = "".join(s for s, ok in zip(stripped, valid) if ok)
+        codes = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8)
+        S[valid] = _LOOKUP[codes].reshape(-1, length)
+        valid[valid] = (S[valid] >= 0).all(1)
+        S[~valid] = 0
+    return S, valid
+
+
+def _matches(pdb: Optional[str], pdb_path: Path) -> bool:
+    return pdb is None or pdb in (pdb_path.name, pdb_path.stem) or (
+        Path(pdb).stem == pdb_path.stem
+    )
+
+
+def score_parts(
+    engine,
+    pdb_path: Path,
+    options: DesignOptions,
+    sequences_path: Path,
+    single_aa_score: bool = False,
+    batch_indices: Optional[List[int]] = None,
+    skip: Callable[[int], bool] = lambda part_index: False,
+) -> Iterator[Tuple[int, pa.Table]]:
+    """Score the sequences of sequences_path against one structure.
+
+    Yields (part index, table) for every part of the sequence file; parts for
+    which skip returns True are read but not scored. The structure is encoded
+    once and the encoding is shared by every sequence; only the decoder runs
+    per sequence. As in score.py, log-likelihoods are averaged over one random
+    decoding order per batch index. With single_aa_score each position is
+    scored given the structure alone, so the log-probabilities are computed
+    once and every sequence is a lookup.
+    """
+    import torch
+
+    if batch_indices is None:
+        batch_indices = list(range(options.number_of_batches))
+    pdb_path = Path(pdb_path)
+    with METRICS.stage("prepare"):
+        prepared = engine.prepare(pdb_path, options)
+    METRICS.count(designs=0, residues=0)
+    feature_dict = prepared.feature_dict
+    L = feature_dict["mask"].shape[1]
+    designable = (feature_dict["mask"] * feature_dict["chain_mask"])[0]
+    designable = designable.float().cpu().numpy()
+    num_designable = max(float(designable.sum()), 1.0)
+    with METRICS.stage("encode"), torch.no_grad(), engine.memory_mode(options):
+        encoding = engine.model.encode(feature_dict)
+
+    def log_probs(S: torch.Tensor, use_sequence: bool) -> torch.Tensor:
+        """Log-probabilities [N, L, 21] averaged over the decoding orders."""
+        total = 0
+        for batch_index in batch_indices:
+            total = total + engine.score_log_probs(
+                prepared, S, options, batch_index, encoding, use_sequence
+            )
+        return total / len(batch_indices)
+
+    single_aa = None
+    if single_aa_score:
+        with METRICS.stage("scoring"):
+            single_aa = log_probs(feature_dict["S"], use_sequence=False)[0]
+
+    call_size = plan_batch_size(
+        engine.device,
+        num_residues=L,
+        num_ligand_atoms=len(prepared.protein_dict.get("Y", [])),
+        k_neighbors=engine.k_neighbors,
+        max_batch_size=MAX_SEQUENCES_PER_CALL,
+    )
+    skipped = 0
+    for part_index, part in enumerate(read_sequences(sequences_path)):
+        if skip(part_index):
+            continue
+        part = [row for row in part if _matches(row[0], pdb_path)]
+        S, valid = encode_sequences([row[2] for row in part], L)
+        skipped += int((~valid).sum())
+        part = [row for row, ok in zip(part, valid) if ok]
+        S = S[valid]
+
+        per_residue = np.empty(S.shape, dtype=np.float32)
+        with METRICS.stage("scoring"):
+            start = 0
+            while start < len(S):
+                rows = torch.from_numpy(S[start : start + call_size]).to(engine.device)
+                try:
+                    with torch.no_grad():
+                        lp = (
+                            single_aa[None].expand(len(rows), -1, -1)
+                            if single_aa is not None
+                            else log_probs(rows, use_sequence=True)
+                        )
+                        ll = torch.gather(lp, 2, rows[:, :, None])[:, :, 0]
+                except Exception as e:
+                    if not is_out_of_memory(e) or len(rows) == 1:
+                        raise
+                    release_memory(engine.device)
+                    call_size = max(1, len(rows) // 2)
+                    print(f"Out of memory, retrying with {call_size} sequences per call")
+                    continue
+                per_residue[start : start + len(rows)] = ll.float().cpu().numpy()
+                start += len(rows)
+        # The structure itself was counted once it was prepared
+        METRICS.count(len(S), len(S) * L, structures=0)
+
+        total = per_residue @ designable
+        yield part_index, pa.table(
+            {
+                "pdb": [prepared.name] * len(part),
+                "name": [row[1] for row in part],
+                "sequence": [row[2] for row in part],
+                "total_log_likelihood": total,
+                "mean_log_likelihood": total / num_designable,
+                "per_residue_log_likelihood": pa.ListArray.from_arrays(
+                    np.arange(0, per_residue.size + 1, L, dtype=np.int32),
+                    pa.array(per_residue.ravel()),
+                ),
+            },
+            schema=SCORE_SCHEMA,
+        )
+    if skipped:
+        print(
+            f"Skipped {skipped} sequences that do not fit {pdb_path.name} "
+            f"({L} residues)"
+        )
+
+
+def score_part_path(out_folder: Path, pdb_name: str, part_index: int) -> Path:
+    # Named by structure too, since without per-PDB outputs every structure
+    # writes to the same folder
+    return out_folder / SCORES_SUBDIR / f"{pdb_name}.part-{part_index:05d}.parquet"
+
+
+def write_score_part(path: Path, table: pa.Table) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, path, compression="zstd")
+
+
+def scoring_key(sequences_path: Path, single_aa_score: bool) -> Dict:
+    """What besides the structures and options decides a scoring run's output."""
+    return {
+        "sequences": file_digest(Path(sequences_path)),
+        "single_aa_score": bool(single_aa_score),
+    }
@@ -0,0 +1,336 @@
+import argparse
+import json
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass, field, fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from wf.cache import ResultCache, cached_design, cached_designs
+from wf.execution import configure_threads, detect_device, plan_workers
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+from wf.preflight import check_structure, validate_options
+from wf.staging import stage_checkpoint
+
+DEFAULT_PORT = 8765
+OPTION_NAMES = {f.name for f in fields(DesignOptions)}
+# Fixed when the server starts, since they select the resident model
+MODEL_OPTIONS = {
+    "model_type",
+    "checkpoint_ligand_mpnn",
+    "ligand_mpnn_use_side_chain_context",
+}
+
+
+class RequestError(ValueError):
+    """A design request that cannot be run; reported with status 400."""
+
+
+@dataclass
+class DesignRequest:
+    pdb_path: Path
+    options: DesignOptions
+    out_folder: Path
+    future: Future = field(default_factory=Future)
+    received: float = field(default_factory=time.time)
+
+
+class DesignServer:
+    """Keeps one engine loaded and runs design requests against it.
+
+    Requests are queued and taken up by a single device thread, up to
+    max_batch at a time; after the first request of a batch it waits
+    batch_window seconds for more. Requests with auto batch sizing (the
+    server default) are sampled together, padded to a shared length, so
+    small scaffolds queued at once fill the device. At most max_pending
+    requests are queued or running, beyond that new ones are refused.
+
+    Each request works in its own folder under output_dir, which is removed
+    once its response has been built.
+    """
+
+    def __init__(
+        self,
+        options: DesignOptions,
+        device: str,
+        output_dir: Path,
+        max_batch: int = 8,
+        batch_window: float = 0.01,
+        max_pending: int = 64,
+        cache: Optional[ResultCache] = None,
+    ):
+        from wf.engine import get_engine
+
+        self.options = options
+        self.device = device
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window
+        self.cache = cache
+        self.engine = get_engine(options, device)
+        self._queue: "queue.Queue[DesignRequest]" = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._served = 0
+        self._worker = threading.Thread(target=self._serve, daemon=True)
+        self._worker.start()
+
+    def parse_request(self, body: Dict) -> DesignRequest:
+        """Build a request from a JSON body with the structure as "pdb_path"
+        (a local file) or "pdb" (file contents, named by "name"), and any
+        task options under "options"."""
+        if not isinstance(body, dict):
+            raise RequestError("Expected a JSON object")
+        requested = body.get("options", {})
+        if not isinstance(requested, dict):
+            raise RequestError("options must be a JSON object")
+        unknown = set(requested) - OPTION_NAMES
+        if unknown:
+            raise RequestError(f"Unknown options: {', '.join(sorted(unknown))}")
+        for k in MODEL_OPTIONS & set(requested):
+            if requested[k] != getattr(self.options, k):
+                raise RequestError(
+                    f"{k} is {getattr(self.options, k)!r} on this server"
+                )
+        try:
+            options = replace(self.options, **requested)
+            problems = validate_options(options)
+        except Exception as e:
+            raise RequestError(f"Invalid options: {e}") from e
+        if problems:
+            raise RequestError("\n".join(problems))
+
+        if "pdb_path" in body:
+            if not isinstance(body["pdb_path"], str):
+                raise RequestError("pdb_path must be a string")
+            pdb_path = Path(body["pdb_path"])
+            if not pdb_path.is_file():
+                raise RequestError(f"No such file: {pdb_path}")
+        elif "pdb" in body:
+            if not isinstance(body["pdb"], str):
+                raise RequestError("pdb must be the structure file's text")
+            pdb_path = None
+        else:
+            raise RequestError("Give the structure as pdb_path or pdb")
+
+        out_folder = Path(tempfile.mkdtemp(dir=self.output_dir))
+        try:
+            if pdb_path is None:
+                name = Path(str(body.get("name", "input"))).stem
+                pdb_path = out_folder / "inputs" / f"{name}.pdb"
+                pdb_path.parent.mkdir()
+                pdb_path.write_text(body["pdb"])
+            problems = check_structure(pdb_path, options)
+        except Exception as e:
+            shutil.rmtree(out_folder, ignore_errors=True)
+            raise RequestError(f"Cannot read the structure: {e}") from e
+        if problems:
+            shutil.rmtree(out_folder, ignore_errors=True)
+            raise RequestError("\n".join(problems))
+        return DesignRequest(pdb_path=pdb_path, options=options, out_folder=out_folder)
+
+    def submit(self, request: DesignRequest) -> Optional[Future]:
+        """Queue a request, or return None when the server is at capacity."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        request.future.add_done_callback(lambda _: self._slots.release())
+        self._queue.put(request)
+        return request.future
+
+    def _next_batch(self) -> List[DesignRequest]:
+        batch = [self._queue.get()]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.time())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self) -> None:
+        while True:
+            self._run_batch(self._next_batch())
+
+    def _run_batch(self, batch: List[DesignRequest]) -> None:
+        """Design a batch with different structures sharing sampling calls;
+        if that fails, each request runs alone so only bad ones fail."""
+        if len(batch) > 1:
+            try:
+                results = cached_designs(
+                    self.engine,
+                    self.cache,
+                    [
+                        (
+                            request.pdb_path,
+                            request.options,
+                            request.out_folder,
+                            list(range(request.options.number_of_batches)),
+                        )
+                        for request in batch
+                    ],
+                )
+            except Exception as e:
+                print(f"Designing {len(batch)} requests together failed: {e}")
+            else:
+                for request, result in zip(batch, results):
+                    self._resolve(request, result)
+                return
+        for request in batch:
+            try:
+                result = cached_design(
+                    self.engine,
+                    self.cache,
+                    request.pdb_path,
+                    request.options,
+                    request.out_folder,
+                    list(range(request.options.number_of_batches)),
+                )
+            except Exception as e:
+                request.future.set_exception(e)
+                continue
+            self._resolve(request, result)
+
+    def _resolve(self, request: DesignRequest, result) -> None:
+        self._served += 1
+        request.future.set_result(
+            {**asdict(result), "seconds": time.time() - request.received}
+        )
+
+    def status(self) -> Dict:
+        return {
+            "model_type": self.options.model_type,
+            "checkpoint": self.engine.checkpoint_path,
+            "device": self.device,
+            "queued": self._queue.qsize(),
+            "served": self._served,
+            "metrics": METRICS.snapshot(),
+        }
+
+
+class DesignHandler(BaseHTTPRequestHandler):
+    server_version = "LigandMPNN"
+    design_server: DesignServer
+
+    def _reply(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._reply(200, self.design_server.status())
+
+    def do_POST(self) -> None:
+        if self.path != "/design":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = self.design_server.parse_request(
+                json.loads(self.rfile.read(length))
+            )
+        except (RequestError, json.JSONDecodeError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        try:
+            future = self.design_server.submit(request)
+            if future is None:
+                self._reply(503, {"error": "Too many pending requests"})
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                self._reply(500, {"error": f"{e}"})
+                return
+            self._reply(200, result)
+        finally:
+            shutil.rmtree(request.out_folder, ignore_errors=True)
+
+
+def serve(
+    design_server: DesignServer, host: str = "127.0.0.1", port: int = DEFAULT_PORT
+) -> None:
+    handler = type("Handler", (DesignHandler,), {"design_server": design_server})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving {design_server.options.model_type} on http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Keep a LigandMPNN model loaded and serve design requests over HTTP: "
+            "POST /design with {'pdb_path' or 'pdb', 'options'}, GET /health"
+        )
+    )
+    parser.add_argument("--model-type", default="ligand_mpnn")
+    parser.add_argument("--checkpoint-ligand-mpnn")
+    parser.add_argument(
+        "--ligand-mpnn-use-side-chain-context", type=int, default=0, choices=[0, 1]
+    )
+    parser.add_argument(
+        "--execution-profile",
+        default="gpu",
+        help="gpu, or a cpu_* profile to run on CPU",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--output-dir", type=Path, default=Path("/root/outputs/server")
+    )
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        default=10,
+        help="How long to wait for more requests once one has arrived",
+    )
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument(
+        "--use-result-cache",
+        type=int,
+        default=1,
+        choices=[0, 1],
+    )
+    args = parser.parse_args(argv)
+
+    device = detect_device(args.execution_profile)
+    _, threads = plan_workers(device, 1)
+    configure_threads(threads)
+    # Per-design seeds, so concurrent requests can share sampling calls
+    options = DesignOptions(
+        auto_batch_size=1,
+        model_type=args.model_type,
+        checkpoint_ligand_mpnn=stage_checkpoint(args.checkpoint_ligand_mpnn),
+        ligand_mpnn_use_side_chain_context=args.ligand_mpnn_use_side_chain_context,
+    )
+    design_server = DesignServer(
+        options,
+        device,
+        args.output_dir,
+        max_batch=args.max_batch,
+        batch_window=args.batch_window_ms / 1000,
+        max_pending=args.max_pending,
+        cache=ResultCache() if args.use_result_cache else None,
+    )
+    serve(design_server, args.host, args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from dataclasses_json import dataclass_json
+from latch.executions import rename_current_execution
+from latch.functions.messages import message
+from latch.resources.tasks import large_task, medium_task, small_gpu_task, small_task
+from latch.types.directory import LatchDir, LatchOutputDir
+from latch.types.file import LatchFile
+
+from wf.cache import ResultCache
+from wf.execution import EXECUTION_PROFILES, preload_engine, split_work
+from wf.metrics import (
+    METRICS,
+    METRICS_FILE,
+    combine_snapshots,
+    report_metrics,
+)
+from wf.options import DesignOptions
+from wf.outputs import collect_design_tables, merge_design_dirs
+from wf.preflight import needs_structures
+from wf.scoring import scoring_key
+from wf.staging import InputStager, list_remote_pdbs, remove_if_exists
+from wf.task import (
+    check_options_or_exit,
+    load_sweep_or_exit,
+    localize_options,
+    open_output_stream,
+    rank_designs,
+    run_designs,
+    run_scoring,
+    stage_sequences,
+)
+
+sys.stdout.reconfigure(line_buffering=True)
+
+
+@dataclass_json
+@dataclass
+class DesignShard:
+    """One slice of a design run: some structures and a range of batches."""
+
+    run_name: str
+    shard_index: int
+    input_pdbs: List[LatchFile]
+    batch_start: int
+    batch_end: int
+    per_pdb_outputs: bool
+    options: DesignOptions
+    execution_profile: str = "gpu"
+    design_workers: int = 0
+    packing_workers: int = 0
+    use_result_cache: int = 1
+    result_cache_path: Optional[str] = None
+    bias_AA_jsonl: Optional[LatchFile] = None
+    omit_AA_jsonl: Optional[LatchFile] = None
+    bias_AA_per_residue_jsonl: Optional[LatchFile] = None
+    omit_AA_per_residue_jsonl: Optional[LatchFile] = None
+    sweep_grid: Optional[str] = None
+    sweep_csv: Optional[LatchFile] = None
+    stream_to: Optional[str] = None
+    sequences_to_score: Optional[LatchFile] = None
+    single_aa_score: int = 0
+
+
+@small_task
+def plan_shards_task(
+    run_name: str,
+    input_pdb: Optional[LatchFile] = None,
+    input_pdb_directory: Optional[LatchDir] = None,
+    output_directory: Optional[LatchOutputDir] = None,
+    number_of_shards: int = 1,
+    execution_profile: str = "gpu",
+    design_workers: int = 0,
+    use_result_cache: int = 1,
+    result_cache_path: Optional[str] = None,
+    model_type: str = "ligand_mpnn",
+    seed: int = 111,
+    temperature: float = 0.1,
+    number_of_batches: int = 1,
+    batch_size: int = 1,
+    auto_batch_size: int = 0,
+    low_memory: int = 0,
+    unique_designs: int = 0,
+    min_confidence: float = 0.0,
+    checkpoint_ligand_mpnn: Optional[str] = None,
+    ligand_mpnn_use_atom_context: int = 1,
+    ligand_mpnn_use_side_chain_context: int = 0,
+    pack_side_chains: int = 0,
+    number_of_packs_per_design: int = 0,
+    pack_with_ligand_context: int = 1,
+    pack_top_k: int = 0,
+    packing_workers: int = 0,
+    fixed_residues: Optional[str] = None,
+    redesigned_residues: Optional[str] = None,
+    chains_to_design: Optional[str] = None,
+    bias_AA: Optional[str] = None,
+    bias_AA_jsonl: Optional[LatchFile] = None,
+    omit_AA: Optional[str] = None,
+    omit_AA_jsonl: Optional[LatchFile] = None,
+    save_stats: int = 0,
+    parse_these_chains_only: Optional[str] = None,
+    symmetry_residues: Optional[str] = None,
+    symmetry_weights: Optional[str] = None,
+    homo_oligomer: int = 0,
+    bias_AA_per_residue_jsonl: Optional[LatchFile] = None,
+    omit_AA_per_residue_jsonl: Optional[LatchFile] = None,
+    parse_atoms_with_zero_occupancy: int = 0,
+    sweep_grid: Optional[str] = None,
+    sweep_csv: Optional[LatchFile] = None,
+    stream_outputs: int = 1,
+    sequences_to_score: Optional[LatchFile] = None,
+    single_aa_score: int = 0,
+) -> List[DesignShard]:
+    rename_current_execution(str(run_name))
+
+    input_pdbs = []
+    if input_pdb is not None:
+        input_pdbs.append(input_pdb)
+    if input_pdb_directory is not None:
+        input_pdbs.extend(list_remote_pdbs(input_pdb_directory))
+    if len(input_pdbs) == 0:
+        message(
+            "error",
+            {
+                "title": "No input structures",
+                "body": "Provide an input PDB file or a directory of PDB files",
+            },
+        )
+        sys.exit(1)
+    if execution_profile not in EXECUTION_PROFILES:
+        message(
+            "error",
+            {
+                "title": "Unknown execution profile",
+                "body": f"Choose one of {', '.join(EXECUTION_PROFILES)}",
+            },
+        )
+        sys.exit(1)
+    options = DesignOptions(
+        model_type=model_type,
+        seed=seed,
+        temperature=temperature,
+        number_of_batches=number_of_batches,
+        batch_size=batch_size,
+        auto_batch_size=auto_batch_size,
+        low_memory=low_memory,
+        unique_designs=unique_designs,
+        min_confidence=min_confidence,
+        checkpoint_ligand_mpnn=checkpoint_ligand_mpnn,
+        ligand_mpnn_use_atom_context=ligand_mpnn_use_atom_context,
+        ligand_mpnn_use_side_chain_context=ligand_mpnn_use_side_chain_context,
+        pack_side_chains=pack_side_chains,
+        number_of_packs_per_design=number_of_packs_per_design,
+        pack_with_ligand_context=pack_with_ligand_context,
+        pack_top_k=pack_top_k,
+        fixed_residues=fixed_residues,
+        redesigned_residues=redesigned_residues,
+        chains_to_design=chains_to_design,
+        bias_AA=bias_AA,
+        omit_AA=omit_AA,
+        save_stats=save_stats,
+        parse_these_chains_only=parse_these_chains_only,
+        symmetry_residues=symmetry_residues,
+        symmetry_weights=symmetry_weights,
+        homo_oligomer=homo_oligomer,
+        parse_atoms_with_zero_occupancy=parse_atoms_with_zero_occupancy,
+    )
+
+    # Fail here, on a CPU node, rather than in every shard. Structures are
+    # only downloaded when the options name their residues or chains.
+    sweep = load_sweep_or_exit(sweep_grid, sweep_csv)
+    pdb_paths = []
+    if needs_structures(options, sweep):
+        stager = InputStager()
+        pdb_paths = [stager.stage_file(pdb) for pdb in input_pdbs]
+    check_options_or_exit(options, pdb_paths, sweep)
+
+    stream_to = None
+    if stream_outputs and output_directory is not None:
+        stream_to = f"{output_directory.remote_path.rstrip('/')}/{run_name}"
+
+    shards = []
+    for i, (pdbs, batch_indices) in enumerate(
+        split_work(
+            input_pdbs,
+            list(range(number_of_batches)),
+            number_of_shards,
+            # Scoring averages over all batches, so shards split structures
+            split_batches=not unique_designs and sequences_to_score is None,
+        )
+    ):
+        shards.append(
+            DesignShard(
+                run_name=run_name,
+                shard_index=i,
+                input_pdbs=pdbs,
+                batch_start=batch_indices[0],
+                batch_end=batch_indices[-1] + 1,
+                per_pdb_outputs=input_pdb_directory is not None,
+                options=options,
+                execution_profile=execution_profile,
+                design_workers=design_workers,
+                packing_workers=packing_workers,
+                use_result_cache=use_result_cache,
+                result_cache_path=result_cache_path,
+                bias_AA_jsonl=bias_AA_jsonl,
+                omit_AA_jsonl=omit_AA_jsonl,
+                bias_AA_per_residue_jsonl=bias_AA_per_residue_jsonl,
+                omit_AA_per_residue_jsonl=omit_AA_per_residue_jsonl,
+                sweep_grid=sweep_grid,
+                sweep_csv=sweep_csv,
+                stream_to=stream_to,
+                sequences_to_score=sequences_to_score,
+                single_aa_score=single_aa_score,
+            )
+        )
+    print(f"Planned {len(shards)} shards")
+    return shards
+
+
+def run_shard(shard: DesignShard) -> LatchDir:
+    METRICS.reset()
+    preload_engine()
+    # Structures download in the background while the rest is set up
+    stager = InputStager()
+    pdb_paths = [stager.stage_file(pdb) for pdb in shard.input_pdbs]
+    options = localize_options(
+        shard.options,
+        stager,
+        bias_AA_jsonl=shard.bias_AA_jsonl,
+        omit_AA_jsonl=shard.omit_AA_jsonl,
+        bias_AA_per_residue_jsonl=shard.bias_AA_per_residue_jsonl,
+        omit_AA_per_residue_jsonl=shard.omit_AA_per_residue_jsonl,
+    )
+    local_output_dir = Path(f"/root/outputs/shard_{shard.shard_index}")
+    local_output_dir.mkdir(parents=True, exist_ok=True)
+
+    batch_indices = list(range(shard.batch_start, shard.batch_end))
+    print(
+        f"Shard {shard.shard_index}: {len(pdb_paths)} structures, "
+        f"batches {shard.batch_start}-{shard.batch_end - 1}"
+    )
+    sweep = load_sweep_or_exit(shard.sweep_grid, shard.sweep_csv)
+    sequences_path = stage_sequences(shard.sequences_to_score, stager)
+    stream = None
+    if shard.stream_to is not None:
+        # Per-design files go straight to the merged output location
+        stream = open_output_stream(
+            shard.stream_to,
+            f"{shard.stream_to}/.parts/shard_{shard.shard_index}",
+            pdb_paths,
+            options,
+            shard.per_pdb_outputs,
+            batch_indices=batch_indices,
+            sweep=sweep,
+            scoring=(
+                scoring_key(sequences_path, shard.single_aa_score)
+                if sequences_path is not None
+                else None
+            ),
+        )
+    if sequences_path is not None:
+        run_scoring(
+            pdb_paths,
+            options,
+            sequences_path,
+            local_output_dir,
+            per_pdb_outputs=True,
+            single_aa_score=bool(shard.single_aa_score),
+            batch_indices=batch_indices,
+            execution_profile=shard.execution_profile,
+            stream=stream,
+        )
+    else:
+        run_designs(
+            pdb_paths,
+            options,
+            local_output_dir,
+            per_pdb_outputs=True,
+            batch_indices=batch_indices,
+            execution_profile=shard.execution_profile,
+            design_workers=shard.design_workers,
+            result_cache=(
+                ResultCache(remote_path=shard.result_cache_path)
+                if shard.use_result_cache
+                else None
+            ),
+            sweep=sweep,
+            stream=stream,
+            packing_workers=shard.packing_workers,
+        )
+    METRICS.write(
+        local_output_dir / METRICS_FILE,
+        shard_index=shard.shard_index,
+        execution_profile=shard.execution_profile,
+    )
+    return LatchDir(str(local_output_dir))
+
+
+# No Latch task caching: a shard carries its run name and streams to the
+# run's output location, so a cached shard would never match another run
+# and could stand in for outputs that have since been removed. Repeated
+# designs are reused through the result cache instead.
+@small_gpu_task
+def ligandmpnn_shard_task(shard: DesignShard) -> LatchDir:
+    return run_shard(shard)
+
+
+@small_task
+def ligandmpnn_shard_task_cpu_small(shard: DesignShard) -> LatchDir:
+    return run_shard(shard)
+
+
+@medium_task
+def ligandmpnn_shard_task_cpu_medium(shard: DesignShard) -> LatchDir:
+    return run_shard(shard)
+
+
+@large_task
+def ligandmpnn_shard_task_cpu_large(shard: DesignShard) -> LatchDir:
+    return run_shard(shard)
+
+
+@small_task
+def merge_shards_task(
+    run_name: str,
+    shards: List[DesignShard],
+    shard_outputs: List[LatchDir],
+    output_directory: LatchOutputDir,
+    top_k_designs: int = 100,
+) -> LatchOutputDir:
+    local_output_dir = Path(f"/root/outputs/{run_name}")
+    local_output_dir.mkdir(parents=True, exist_ok=True)
+    per_pdb_outputs = shards[0].per_pdb_outputs
+
+    print("-" * 60)
+    print(f"Merging {len(shard_outputs)} shards")
+    ordered = sorted(zip(shards, shard_outputs), key=lambda x: x[0].shard_index)
+    merge_design_dirs(
+        [Path(shard_output.local_path) for _, shard_output in ordered],
+        local_output_dir,
+        per_pdb_outputs,
+    )
+    collect_design_tables(local_output_dir)
+    rank_designs(local_output_dir, top_k_designs)
+
+    snapshots = []
+    for _, shard_output in ordered:
+        shard_metrics = Path(shard_output.local_path) / METRICS_FILE
+        if shard_metrics.exists():
+            snapshots.append(json.loads(shard_metrics.read_text()))
+    combined = combine_snapshots(snapshots)
+    combined["execution_profile"] = shards[0].execution_profile
+    (local_output_dir / METRICS_FILE).write_text(json.dumps(combined, indent=2))
+    report_metrics("LigandMPNN metrics", combined)
+
+    print("-" * 60)
+    print("Returning results")
+    return LatchOutputDir(str("/root/outputs"), output_directory.remote_path)
+
+
+@small_task
+def remove_stream_parts_task(
+    shards: List[DesignShard], merged_output: LatchOutputDir
+) -> LatchOutputDir:
+    """Delete the chunk copies kept for resuming streamed shards.
+
+    Runs once the merged output is uploaded; nothing resumes from the parts
+    after that.
+    """
+    stream_to = shards[0].stream_to
+    if stream_to is not None:
+        try:
+            remove_if_exists(f"{stream_to}/.parts")
+        except Exception as e:
+            print(f"Could not remove {stream_to}/.parts: {e}")
+    return merged_output
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from latch.ldata.path import LPath
+from latch.ldata.type import LatchPathError
+from latch.types.directory import LatchDir
+from latch.types.file import LatchFile
+
+from wf.cache import DEFAULT_CACHE_DIR, file_digest
+from wf.metrics import METRICS
+
+STAGING_WORKERS = int(os.environ.get("LIGANDMPNN_STAGING_WORKERS", "8"))
+STAGING_DIR = Path("/root/inputs")
+REMOTE_PREFIXES = ("latch://", "s3://")
+# LatchPathError message for a path that does not exist
+MISSING_PATH = "no such Latch file or directory"
+# A file with this suffix next to a remote file holds its SHA-256, as written
+# by sha256sum ("<hex digest>  <name>")
+CHECKSUM_SUFFIX = ".sha256"
+
+# Inputs still downloading, so design can wait for just the one it needs
+_pending: Dict[Path, Future] = {}
+_lock = threading.Lock()
+
+
+def list_remote_pdbs(directory: LatchDir) -> List[LatchFile]:
+    pdbs = []
+    for child in directory.iterdir():
+        if isinstance(child, LatchDir):
+            pdbs.extend(list_remote_pdbs(child))
+        elif child.remote_path.endswith(".pdb"):
+            pdbs.append(child)
+    return sorted(pdbs, key=lambda f: f.remote_path)
+
+
+def is_remote(path: Optional[str]) -> bool:
+    return path is not None and str(path).startswith(REMOTE_PREFIXES)
+
+
+def download_if_exists(remote_path: str, local_path: Path) -> bool:
+    """Download a remote file; False if there is nothing at remote_path.
+
+    Any other failure is raised.
+    """
+    try:
+        LPath(remote_path).download(local_path)
+    except LatchPathError as e:
+        if e.message != MISSING_PATH:
+            raise
+        return False
+    return True
+
+
+def remove_if_exists(remote_path: str) -> None:
+    """Recursively delete a remote path, if there is anything at it."""
+    try:
+        LPath(remote_path).rmr()
+    except LatchPathError as e:
+        if e.message != MISSING_PATH:
+            raise
+
+
+def remote_sha256(remote_path: str, local_path: Path) -> Optional[str]:
+    """The SHA-256 recorded in the checksum file next to remote_path, if any."""
+    checksum_path = local_path.with_name(local_path.name + CHECKSUM_SUFFIX)
+    try:
+        if not download_if_exists(remote_path + CHECKSUM_SUFFIX, checksum_path):
+            return None
+        digest = checksum_path.read_text().split()
+    finally:
+        checksum_path.unlink(missing_ok=True)
+    return digest[0].lower() if digest else None
+
+
+def _download(remote_path: str, local_path: Path) -> Path:
+    """Download, retrying when the file does not match the remote.
+
+    Latch Data reports no content hash, so the size is always compared and
+    the SHA-256 only when a checksum file sits next to the remote file
+    (CHECKSUM_SUFFIX). The SHA-256 is taken here either way, on the staging
+    thread, for the cache keys computed later.
+    """
+    start = time.time()
+    remote = LPath(remote_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    expected_size = remote.size()
+    expected_sha256 = remote_sha256(remote_path, local_path)
+    for _ in range(3):
+        remote.download(local_path)
+        size = local_path.stat().st_size
+        sha256 = file_digest(local_path)
+        if size == expected_size and expected_sha256 in (None, sha256):
+            break
+        print(f"{remote_path} does not match the remote, downloading again")
+    else:
+        raise IOError(
+            f"{remote_path}: got {size} bytes with SHA-256 {sha256}, expected "
+            f"{expected_size} bytes"
+            + (f" with SHA-256 {expected_sha256}" if expected_sha256 else "")
+        )
+    with _lock:
+        METRICS.add_time("staging", time.time() - start)
+    return local_path
+
+
+class InputStager:
+    """Downloads task inputs concurrently on a bounded thread pool.
+
+    stage() returns the local path at once; wait_for_inputs() blocks until
+    given paths are on disk, so design can start on the first structures
+    (and the model can load) while later ones are still downloading.
+    """
+
+    def __init__(self, local_root: Path = STAGING_DIR, workers: int = STAGING_WORKERS):
+        self.local_root = Path(local_root)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def stage(self, remote_path: str, rel: Path) -> Path:
+        local_path = self.local_root / rel
+        future = self._pool.submit(_download, remote_path, local_path)
+        with _lock:
+            _pending[local_path] = future
+        return local_path
+
+    def stage_file(self, latch_file: LatchFile) -> Path:
+        """Stage a LatchFile, or use it as is when it is already local."""
+        if not is_remote(latch_file.remote_path):
+            return Path(latch_file.local_path)
+        rel = Path(latch_file.remote_path.split("://", 1)[1].lstrip("/"))
+        return self.stage(latch_file.remote_path, rel)
+
+    def stage_pdb_directory(self, latch_dir: LatchDir) -> List[Path]:
+        """Stage every PDB under a LatchDir, in sorted order."""
+        if not is_remote(latch_dir.remote_path):
+            local_dir = Path(latch_dir.local_path)
+            return sorted(p for p in local_dir.rglob("*.pdb") if p.is_file())
+        return [self.stage_file(pdb) for pdb in list_remote_pdbs(latch_dir)]
+
+
+def wait_for_inputs(paths: Iterable[Path]) -> None:
+    """Block until the given staged paths are downloaded; others pass."""
+    with _lock:
+        futures = [_pending.get(Path(p)) for p in paths]
+    futures = [f for f in futures if f is not None]
+    if not all(f.done() for f in futures):
+        with METRICS.stage("staging_wait"):
+            for future in futures:
+                future.exception()
+    for future in futures:
+        future.result()
+
+
+def stage_checkpoint(path: Optional[str]) -> Optional[str]:
+    """Local copy of a remote checkpoint, kept in the node-local cache.
+
+    Entries are keyed by the remote path and version and store the SHA-256
+    of the file, which is checked again before an entry is reused.
+    """
+    if not is_remote(path):
+        return path
+    remote = LPath(path)
+    key = hashlib.sha256(f"{path}@{remote.version_id()}".encode("utf-8")).hexdigest()
+    entry = DEFAULT_CACHE_DIR / "checkpoints" / key
+    local_path = entry / Path(path).name
+    meta_path = entry / "meta.json"
+    if meta_path.exists() and local_path.exists():
+        meta = json.loads(meta_path.read_text())
+        if file_digest(local_path) == meta["sha256"]:
+            print(f"Using cached checkpoint {local_path}")
+            return str(local_path)
+        print(f"Cached checkpoint {local_path} is corrupt, downloading again")
+
+    with METRICS.stage("checkpoint_download"):
+        tmp = entry.with_name(f"{key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        _download(path, tmp / local_path.name)
+        (tmp / "meta.json").write_text(
+            json.dumps(
+                {"remote_path": path, "sha256": file_digest(tmp / local_path.name)}
+            )
+        )
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            tmp.rename(entry)
+        except OSError:
+            # Another task on this node finished the same download first
+            shutil.rmtree(tmp, ignore_errors=True)
+    return str(local_path)
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from latch.ldata.path import LPath
+
+from wf.cache import result_key
+from wf.checkpoints import resolve_checkpoint
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+from wf.staging import download_if_exists
+
+MANIFEST = "manifest.json"
+
+# Per-design files never need merging, so they are uploaded straight to their
+# final location. Per-structure files (FASTA, stats, sweep tables) are merged
+# at the end; their chunk copies are kept under the parts path for resuming.
+# Score parts are named by structure and part, so they are final as well.
+FINAL_SUBDIRS = {"backbones", "packed", "scores"}
+
+
+def run_fingerprint(
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    batch_indices: List[int],
+    sweep: Optional[List[Dict]] = None,
+    scoring: Optional[Dict] = None,
+) -> str:
+    """Identifies a run well enough to decide whether its chunks can be reused."""
+    checkpoint_path = resolve_checkpoint(
+        options.model_type, options.checkpoint_ligand_mpnn
+    )
+    payload = {
+        "results": [
+            result_key(pdb_path, options, checkpoint_path, batch_indices)
+            for pdb_path in pdb_paths
+        ],
+        "sweep": sweep,
+        "scoring": scoring,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def chunk_batches(batch_indices: List[int], batches_per_chunk: int) -> List[List[int]]:
+    batches_per_chunk = max(1, batches_per_chunk)
+    return [
+        batch_indices[i : i + batches_per_chunk]
+        for i in range(0, len(batch_indices), batches_per_chunk)
+    ]
+
+
+class OutputStream:
+    """Uploads finished chunks of a design run while later ones are designed.
+
+    A chunk directory is laid out as <pdb name>/<subdir>/... and holds some
+    batches of every structure. Chunks are uploaded by a bounded thread pool;
+    once all of a chunk's files are up it is recorded in a manifest next to
+    the parts, so a restarted task with the same inputs skips it.
+    """
+
+    def __init__(
+        self,
+        remote_path: str,
+        parts_path: str,
+        fingerprint: str,
+        per_pdb_outputs: bool,
+        upload_workers: int = 4,
+        max_pending_chunks: int = 8,
+    ):
+        self.remote_path = remote_path.rstrip("/")
+        self.parts_path = parts_path.rstrip("/")
+        self.fingerprint = fingerprint
+        self.per_pdb_outputs = per_pdb_outputs
+        self._pool = ThreadPoolExecutor(max_workers=upload_workers)
+        # Designing blocks once this many chunks wait for upload
+        self._slots = threading.BoundedSemaphore(max_pending_chunks)
+        self._lock = threading.Lock()
+        self._futures: List[Future] = []
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict:
+        manifest = None
+        with tempfile.TemporaryDirectory() as tmp:
+            local = Path(tmp) / MANIFEST
+            try:
+                if download_if_exists(f"{self.parts_path}/{MANIFEST}", local):
+                    manifest = json.loads(local.read_text())
+            except Exception as e:
+                print(f"Could not read the manifest of an earlier attempt: {e}")
+        if manifest is None or manifest.get("fingerprint") != self.fingerprint:
+            return {"fingerprint": self.fingerprint, "chunks": {}}
+        print(f"Found {len(manifest['chunks'])} uploaded chunks from an earlier attempt")
+        return manifest
+
+    def _write_manifest(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            local = Path(tmp) / MANIFEST
+            local.write_text(json.dumps(self.manifest, indent=2))
+            LPath(f"{self.parts_path}/{MANIFEST}").upload_from(local)
+
+    def is_durable(self, chunk_name: str) -> bool:
+        return chunk_name in self.manifest["chunks"]
+
+    def restore(self, chunk_name: str, chunk_dir: Path) -> None:
+        """Download the parts of an uploaded chunk that still need merging."""
+        chunk_dir.mkdir(parents=True, exist_ok=True)
+        with METRICS.stage("restore"):
+            self._download_parts(chunk_name, chunk_dir)
+
+    def _download_parts(self, chunk_name: str, chunk_dir: Path) -> None:
+        for rel in self.manifest["chunks"][chunk_name]["parts"]:
+            destination = chunk_dir / rel
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            LPath(f"{self.parts_path}/{chunk_name}/{rel}").download(destination)
+
+    def _final_path(self, rel: Path) -> str:
+        if not self.per_pdb_outputs:
+            rel = Path(*rel.parts[1:])
+        return f"{self.remote_path}/{rel}"
+
+    def _upload(self, chunk_name: str, chunk_dir: Path) -> None:
+        start = time.time()
+        try:
+            final = []
+            parts = []
+            for f in sorted(chunk_dir.rglob("*")):
+                if not f.is_file():
+                    continue
+                rel = f.relative_to(chunk_dir)
+                if f.parent.name in FINAL_SUBDIRS:
+                    LPath(self._final_path(rel)).upload_from(f)
+                    final.append(f)
+                else:
+                    LPath(f"{self.parts_path}/{chunk_name}/{rel}").upload_from(f)
+                    parts.append(str(rel))
+            with self._lock:
+                self.manifest["chunks"][chunk_name] = {
+                    "parts": parts,
+                    "final_files": len(final),
+                }
+                self._write_manifest()
+                # Runs in the background, overlapping with design
+                METRICS.add_time("upload", time.time() - start)
+            # Durable now, so the final upload does not need to send them again
+            for f in final:
+                f.unlink()
+            print(f"Uploaded {chunk_name}")
+        finally:
+            self._slots.release()
+
+    def submit(self, chunk_name: str, chunk_dir: Path) -> None:
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._upload, chunk_name, chunk_dir))
+
+    def close(self) -> None:
+        """Wait for pending uploads.
+
+        A chunk that failed to upload keeps its files on disk, so they are
+        still sent with the task's final output.
+        """
+        with METRICS.stage("upload_wait"):
+            self._wait()
+
+    def _wait(self) -> None:
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Streaming upload failed, sending with final outputs: {e}")
+        self._pool.shutdown()
@@ -0,0 +1,147 @@
+import csv
+import itertools
+from dataclasses import fields, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from wf.cache import ResultCache, cached_design
+from wf.options import DesignOptions
+from wf.outputs import DESIGN_TABLE, DesignResult, write_design_table
+
+# Options that only change decoding, so every combination can share one
+# encoder pass per structure.
+SWEEPABLE_OPTIONS = [
+    "temperature",
+    "seed",
+    "bias_AA",
+    "omit_AA",
+    "fixed_residues",
+    "redesigned_residues",
+    "chains_to_design",
+    "symmetry_residues",
+    "symmetry_weights",
+]
+
+SWEEP_TABLE = "sweep.csv"
+
+_OPTION_TYPES = {f.name: f.type for f in fields(DesignOptions)}
+
+
+def _convert(name: str, value: str):
+    if name not in SWEEPABLE_OPTIONS:
+        raise ValueError(
+            f"Cannot sweep over {name}, choose from {', '.join(SWEEPABLE_OPTIONS)}"
+        )
+    value = value.strip()
+    if _OPTION_TYPES[name] is float:
+        return float(value)
+    if _OPTION_TYPES[name] is int:
+        return int(value)
+    return value if value else None
+
+
+def parse_sweep_grid(spec: str) -> List[Dict]:
+    """Expand a grid spec into one row per combination.
+
+    Parameters are separated by ";" and their values by "|", e.g.
+    "temperature=0.1|0.2;seed=1|2;bias_AA=W:3.0,P:3.0|A:-1.0".
+    """
+    axes = []
+    for part in spec.split(";"):
+        if not part.strip():
+            continue
+        if "=" not in part:
+            raise ValueError(
+                f"Expected name=value|value... in the sweep grid, got {part!r}"
+            )
+        name, values = part.split("=", 1)
+        name = name.strip()
+        axes.append([(name, _convert(name, v)) for v in values.split("|")])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def read_sweep_csv(path: Path) -> List[Dict]:
+    """Read explicit sweep rows. Empty cells keep the workflow's value."""
+    rows = []
+    with open(path, newline="") as f:
+        for record in csv.DictReader(f):
+            rows.append(
+                {
+                    k.strip(): _convert(k.strip(), v)
+                    for k, v in record.items()
+                    if v is not None and v.strip()
+                }
+            )
+    return rows
+
+
+def load_sweep(
+    sweep_grid: Optional[str] = None, sweep_csv: Optional[Path] = None
+) -> Optional[List[Dict]]:
+    rows = []
+    if sweep_grid:
+        rows.extend(parse_sweep_grid(sweep_grid))
+    if sweep_csv is not None:
+        rows.extend(read_sweep_csv(Path(sweep_csv)))
+    return rows or None
+
+
+def run_sweep(
+    engine,
+    cache: Optional[ResultCache],
+    pdb_path: Path,
+    options: DesignOptions,
+    rows: List[Dict],
+    out_folder: Path,
+    batch_indices: List[int],
+    packing=None,
+) -> List[DesignResult]:
+    """Design every sweep row on one structure, encoding it only once.
+
+    Row i writes its usual outputs to sweep_{i:04d}/ (sweep_0003/ for the
+    fourth row) and all designs are listed in a single sweep.csv table
+    indexed by sweep_index and design_id.
+    """
+    swept = [k for k in SWEEPABLE_OPTIONS if any(k in row for row in rows)]
+    results = []
+    table = []
+    with engine.reuse_encodings():
+        for i, row in enumerate(rows):
+            row_options = replace(options, **row)
+            row_folder = out_folder / f"sweep_{i:04d}"
+            result = cached_design(
+                engine, cache, pdb_path, row_options, row_folder, batch_indices, packing
+            )
+            write_design_table(
+                row_folder / DESIGN_TABLE,
+                result,
+                row_options.batch_size,
+                row_options.temperature,
+                sweep_index=i,
+            )
+            results.append(result)
+            for j, design_id in enumerate(result.design_ids):
+                table.append(
+                    {
+                        "sweep_index": i,
+                        "pdb": result.name,
+                        **{k: getattr(row_options, k) for k in swept},
+                        "design_id": design_id,
+                        "sequence": result.sequences[j],
+                        "overall_confidence": result.overall_confidence[j],
+                        "ligand_confidence": result.ligand_confidence[j],
+                        "seq_rec": result.seq_rec[j],
+                    }
+                )
+
+    columns = (
+        ["sweep_index", "pdb"]
+        + swept
+        + ["design_id", "sequence", "overall_confidence", "ligand_confidence", "seq_rec"]
+    )
+    out_folder.mkdir(parents=True, exist_ok=True)
+    with open(out_folder / SWEEP_TABLE, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(table)
+    return results
@@ -1,153 +1,484 @@
-import subprocess
+import shutil
 import sys
+from dataclasses import replace
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
-from latch.executions import rename_current_execution
 from latch.functions.messages import message
-from latch.resources.tasks import large_gpu_task, small_gpu_task
-from latch.types.directory import LatchOutputDir
 from latch.types.file import LatchFile
 
+from wf.analysis import analyze_designs
+from wf.cache import ResultCache
+from wf.constraints import CONSTRAINT_OPTIONS, constraint_index, index_constraint_file
+from wf.execution import (
+    MICRO_BATCH_STRUCTURES,
+    can_micro_batch,
+    configure_threads,
+    design_structure,
+    design_structures,
+    detect_device,
+    plan_workers,
+    report_device,
+    run_worker_pool,
+    split_work,
+)
+from wf.metrics import METRICS
+from wf.options import DesignOptions
+from wf.outputs import merge_design_dirs
+from wf.packing import PackingPool
+from wf.preflight import needs_structures, preflight
+from wf.scoring import score_part_path, score_parts, write_score_part
+from wf.staging import InputStager, stage_checkpoint, wait_for_inputs
+from wf.streaming import OutputStream, chunk_batches, run_fingerprint
+from wf.sweep import load_sweep
+
 sys.stdout.reconfigure(line_buffering=True)
 
 
-@small_gpu_task(cache=True)
-def ligandmpnn_task(
-    run_name: str,
-    input_pdb: LatchFile,
-    output_directory: LatchOutputDir = LatchOutputDir("latch:///LigandMPNN"),
-    model_type: str = "ligand_mpnn",
-    seed: int = 111,
-    temperature: float = 0.1,
-    number_of_batches: int = 1,
-    batch_size: int = 1,
-    checkpoint_ligand_mpnn: Optional[str] = None,
-    ligand_mpnn_use_atom_context: int = 1,
-    ligand_mpnn_use_side_chain_context: int = 0,
-    pack_side_chains: int = 0,
-    number_of_packs_per_design: int = 0,
-    pack_with_ligand_context: int = 1,
-    fixed_residues: Optional[str] = None,
-    redesigned_residues: Optional[str] = None,
-    chains_to_design: Optional[str] = None,
-    bias_AA: Optional[str] = None,
+def localize_options(
+    options: DesignOptions,
+    stager: InputStager,
     bias_AA_jsonl: Optional[LatchFile] = None,
-    omit_AA: Optional[str] = None,
     omit_AA_jsonl: Optional[LatchFile] = None,
-    save_stats: int = 0,
-    parse_these_chains_only: Optional[str] = None,
-    symmetry_residues: Optional[str] = None,
-    symmetry_weights: Optional[str] = None,
-    homo_oligomer: int = 0,
     bias_AA_per_residue_jsonl: Optional[LatchFile] = None,
     omit_AA_per_residue_jsonl: Optional[LatchFile] = None,
-    parse_atoms_with_zero_occupancy: int = 0,
-) -> LatchOutputDir:
-    rename_current_execution(str(run_name))
-
-    print("-" * 60)
-    print("Creating local directories")
-    local_output_dir = Path(f"/root/outputs/{run_name}")
-    local_output_dir.mkdir(parents=True, exist_ok=True)
+) -> DesignOptions:
+    """Point the constraint file options at indexes of local copies of the
+    LatchFiles, and a remote checkpoint at its node-local copy."""
+    files = {
+        "bias_AA_jsonl": bias_AA_jsonl,
+        "omit_AA_jsonl": omit_AA_jsonl,
+        "bias_AA_per_residue_jsonl": bias_AA_per_residue_jsonl,
+        "omit_AA_per_residue_jsonl": omit_AA_per_residue_jsonl,
+    }
+    local_paths = {
+        k: str(stager.stage_file(v)) for k, v in files.items() if v is not None
+    }
+    try:
+        wait_for_inputs(Path(p) for p in local_paths.values())
+        checkpoint = stage_checkpoint(options.checkpoint_ligand_mpnn)
+    except Exception as e:
+        message("error", {"title": "Failed to download inputs", "body": f"{e}"})
+        sys.exit(1)
+    # Indexed once here, so workers and later structures only read their
+    # own entries
+    with METRICS.stage("constraint_index"):
+        try:
+            for k, path in local_paths.items():
+                kind, per_pdb = CONSTRAINT_OPTIONS[k]
+                local_paths[k] = str(index_constraint_file(path, kind, per_pdb))
+                # Checks that a prebuilt index was given for the right option
+                constraint_index(local_paths[k], kind, per_pdb)
+        except (ValueError, KeyError, AttributeError) as e:
+            message("error", {"title": "Invalid constraint file", "body": f"{e}"})
+            sys.exit(1)
+    return replace(options, checkpoint_ligand_mpnn=checkpoint, **local_paths)
 
-    print("-" * 60)
-    subprocess.run(["nvidia-smi"], check=True)
-    subprocess.run(["nvcc", "--version"], check=True)
 
-    print("-" * 60)
-    print("Running LigandMPNN")
-    ligandmpnn_dir = Path("/tmp/docker-build/work/LigandMPNN")
-
-    command = [
-        "python",
-        f"{ligandmpnn_dir}/run.py",
-        "--model_type",
-        model_type,
-        "--seed",
-        str(seed),
-        "--pdb_path",
-        str(input_pdb.local_path),
-        "--out_folder",
-        str(local_output_dir),
-        "--number_of_batches",
-        str(number_of_batches),
-        "--batch_size",
-        str(batch_size),
-        "--temperature",
-        str(temperature),
-    ]
-
-    # Tahir: ToDo - Make this nicer
-
-    if checkpoint_ligand_mpnn:
-        command.extend(["--checkpoint_ligand_mpnn", checkpoint_ligand_mpnn])
-    if ligand_mpnn_use_atom_context == 0:
-        command.extend(
-            ["--ligand_mpnn_use_atom_context", str(ligand_mpnn_use_atom_context)]
-        )
-    if ligand_mpnn_use_side_chain_context == 1:
-        command.extend(
-            [
-                "--ligand_mpnn_use_side_chain_context",
-                str(ligand_mpnn_use_side_chain_context),
-            ]
-        )
-    if pack_side_chains == 1:
-        command.extend(["--pack_side_chains", str(pack_side_chains)])
-    if number_of_packs_per_design > 0:
-        command.extend(
-            ["--number_of_packs_per_design", str(number_of_packs_per_design)]
+def load_sweep_or_exit(
+    sweep_grid: Optional[str], sweep_csv: Optional[LatchFile]
+) -> Optional[List[Dict]]:
+    try:
+        return load_sweep(
+            sweep_grid, Path(sweep_csv.local_path) if sweep_csv is not None else None
         )
-    if pack_with_ligand_context == 1:
-        command.extend(["--pack_with_ligand_context", "1"])
-    if fixed_residues:
-        command.extend(["--fixed_residues", fixed_residues])
-    if redesigned_residues:
-        command.extend(["--redesigned_residues", redesigned_residues])
-    if chains_to_design:
-        command.extend(["--chains_to_design", chains_to_design])
-    if bias_AA:
-        command.extend(["--bias_AA", bias_AA])
-    if bias_AA_jsonl:
-        command.extend(["--bias_AA_jsonl", str(bias_AA_jsonl.local_path)])
-    if omit_AA:
-        command.extend(["--omit_AA", omit_AA])
-    if omit_AA_jsonl:
-        command.extend(["--omit_AA_jsonl", str(omit_AA_jsonl.local_path)])
-    if symmetry_residues:
-        command.extend(["--symmetry_residues", symmetry_residues])
-    if symmetry_weights:
-        command.extend(["--symmetry_weights", symmetry_weights])
-    if homo_oligomer == 1:
-        command.extend(["--homo_oligomer", str(homo_oligomer)])
-    if bias_AA_per_residue_jsonl:
-        command.extend(
-            ["--bias_AA_per_residue_jsonl", str(bias_AA_per_residue_jsonl.local_path)]
+    except (ValueError, KeyError) as e:
+        message("error", {"title": "Invalid parameter sweep", "body": f"{e}"})
+        sys.exit(1)
+
+
+def stage_sequences(
+    sequences_to_score: Optional[LatchFile], stager: InputStager
+) -> Optional[Path]:
+    """Local copy of the sequences to score, or None to design instead."""
+    if sequences_to_score is None:
+        return None
+    try:
+        sequences_path = stager.stage_file(sequences_to_score)
+        wait_for_inputs([sequences_path])
+    except Exception as e:
+        message("error", {"title": "Failed to download inputs", "body": f"{e}"})
+        sys.exit(1)
+    return sequences_path
+
+
+def check_options_or_exit(
+    options: DesignOptions,
+    pdb_paths: List[Path],
+    sweep: Optional[List[Dict]] = None,
+) -> None:
+    """Fail on malformed options, and on residues or chains that the input
+    structures do not have, before any structure is designed."""
+    if needs_structures(options, sweep):
+        try:
+            wait_for_inputs(pdb_paths)
+        except Exception as e:
+            message("error", {"title": "Failed to download inputs", "body": f"{e}"})
+            sys.exit(1)
+    else:
+        pdb_paths = []
+    problems = preflight(options, pdb_paths, sweep)
+    if problems:
+        print("\n".join(problems))
+        message("error", {"title": "Invalid options", "body": "\n".join(problems)})
+        sys.exit(1)
+    if pdb_paths:
+        print(f"Checked residue and chain options against {len(pdb_paths)} structures")
+
+
+def design_batches(
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    local_output_dir: Path,
+    per_pdb_outputs: bool,
+    batch_indices: List[int],
+    device: str,
+    workers: int,
+    threads: int,
+    result_cache: Optional[ResultCache] = None,
+    sweep: Optional[List[Dict]] = None,
+    packing: Optional[PackingPool] = None,
+) -> None:
+    if workers > 1:
+        # Worker processes cannot wait on this process's downloads
+        wait_for_inputs(pdb_paths)
+    work_items = len(
+        split_work(
+            pdb_paths, batch_indices, workers, split_batches=not options.unique_designs
         )
-    if omit_AA_per_residue_jsonl:
-        command.extend(
-            ["--omit_AA_per_residue_jsonl", str(omit_AA_per_residue_jsonl.local_path)]
+    )
+    if workers > 1 and work_items > 1:
+        print(f"Designing with {workers} workers x {threads} threads")
+        work_dir = local_output_dir.parent / f".workers_{local_output_dir.name}"
+        try:
+            part_dirs = run_worker_pool(
+                pdb_paths,
+                options,
+                device,
+                work_dir,
+                batch_indices,
+                workers,
+                threads,
+                result_cache,
+                sweep,
+            )
+            with METRICS.stage("merging"):
+                merge_design_dirs(part_dirs, local_output_dir, per_pdb_outputs)
+            shutil.rmtree(work_dir, ignore_errors=True)
+            print("Done")
+        except Exception as e:
+            print("FAILED")
+            message("error", {"title": "LigandMPNN failed", "body": f"{e}"})
+            sys.exit(1)
+        return
+
+    try:
+        from wf.engine import get_engine
+
+        engine = get_engine(options, device)
+    except Exception as e:
+        print("FAILED")
+        message("error", {"title": "Loading LigandMPNN failed", "body": f"{e}"})
+        sys.exit(1)
+
+    if (
+        per_pdb_outputs
+        and packing is None
+        and can_micro_batch(pdb_paths, options, sweep)
+    ):
+        for start in range(0, len(pdb_paths), MICRO_BATCH_STRUCTURES):
+            group = pdb_paths[start : start + MICRO_BATCH_STRUCTURES]
+            print("-" * 60)
+            print(f"Running LigandMPNN on {len(group)} structures together")
+            try:
+                design_structures(
+                    engine,
+                    result_cache,
+                    group,
+                    options,
+                    [local_output_dir / pdb_path.stem for pdb_path in group],
+                    batch_indices,
+                )
+                print("Done")
+            except Exception as e:
+                print("FAILED")
+                title = f"LigandMPNN failed on {group[0].name} to {group[-1].name}"
+                message("error", {"title": title, "body": f"{e}"})
+                sys.exit(1)
+        return
+
+    for pdb_path in pdb_paths:
+        print("-" * 60)
+        print(f"Running LigandMPNN on {pdb_path.name}")
+        out_folder = local_output_dir
+        if per_pdb_outputs:
+            out_folder = local_output_dir / pdb_path.stem
+        try:
+            design_structure(
+                engine,
+                result_cache,
+                pdb_path,
+                options,
+                out_folder,
+                batch_indices,
+                sweep,
+                packing,
+            )
+            print("Done")
+        except Exception as e:
+            print("FAILED")
+            message(
+                "error",
+                {"title": f"LigandMPNN failed on {pdb_path.name}", "body": f"{e}"},
+            )
+            sys.exit(1)
+
+
+def run_designs(
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    local_output_dir: Path,
+    per_pdb_outputs: bool,
+    batch_indices: Optional[List[int]] = None,
+    execution_profile: str = "gpu",
+    design_workers: int = 0,
+    result_cache: Optional[ResultCache] = None,
+    sweep: Optional[List[Dict]] = None,
+    stream: Optional[OutputStream] = None,
+    packing_workers: int = 0,
+) -> None:
+    print("-" * 60)
+    device = detect_device(execution_profile)
+    report_device(device)
+    if batch_indices is None:
+        batch_indices = list(range(options.number_of_batches))
+
+    workers, threads = plan_workers(device, design_workers)
+    configure_threads(threads)
+    print("Loading LigandMPNN")
+    if sweep:
+        print(f"Sweeping {len(sweep)} parameter combinations per structure")
+
+    # Packing gets its own processes only when designs are sampled in this
+    # one; design worker processes already pack alongside each other.
+    packing = None
+    if options.pack_side_chains and packing_workers > 0:
+        if workers > 1:
+            print("Packing inline in each design worker")
+        else:
+            print(f"Packing side chains on {packing_workers} workers")
+            packing = PackingPool(packing_workers, device)
+
+    if stream is None:
+        design_batches(
+            pdb_paths,
+            options,
+            local_output_dir,
+            per_pdb_outputs,
+            batch_indices,
+            device,
+            workers,
+            threads,
+            result_cache,
+            sweep,
+            packing,
         )
-    if parse_atoms_with_zero_occupancy == 1:
-        command.extend(
-            ["--parse_atoms_with_zero_occupancy", str(parse_atoms_with_zero_occupancy)]
+        close_packing(packing)
+        return
+
+    # Design a few batches at a time (enough to keep every worker busy) and
+    # hand each finished chunk to the uploader before starting the next.
+    staging_dir = local_output_dir.parent / f".chunks_{local_output_dir.name}"
+    chunk_dirs = []
+    # Deduplicating designs needs all batches of a structure in one chunk
+    batches_per_chunk = len(batch_indices) if options.unique_designs else workers
+    for chunk in chunk_batches(batch_indices, batches_per_chunk):
+        chunk_name = f"batches_{chunk[0]:05d}_{chunk[-1]:05d}"
+        chunk_dir = staging_dir / chunk_name
+        chunk_dirs.append(chunk_dir)
+        if stream.is_durable(chunk_name):
+            print(f"Restoring {chunk_name} from an earlier attempt")
+            stream.restore(chunk_name, chunk_dir)
+            continue
+        print("-" * 60)
+        print(f"Designing batches {chunk[0]}-{chunk[-1]}")
+        design_batches(
+            pdb_paths,
+            options,
+            chunk_dir,
+            True,
+            chunk,
+            device,
+            workers,
+            threads,
+            result_cache,
+            sweep,
+            packing,
         )
-    if save_stats == 1:
-        command.extend(["--save_stats", str(save_stats)])
-    if parse_these_chains_only:
-        command.extend(["--parse_these_chains_only", parse_these_chains_only])
+        if packing is not None:
+            # Upload the chunk once its packed PDBs exist
+            packing.after_pending(partial(stream.submit, chunk_name, chunk_dir))
+        else:
+            stream.submit(chunk_name, chunk_dir)
+
+    close_packing(packing)
+    print("-" * 60)
+    print("Waiting for uploads")
+    stream.close()
+    with METRICS.stage("merging"):
+        merge_design_dirs(chunk_dirs, local_output_dir, per_pdb_outputs)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def close_packing(packing: Optional[PackingPool]) -> None:
+    if packing is None:
+        return
+    print("-" * 60)
+    print("Waiting for side-chain packing")
+    try:
+        with METRICS.stage("packing_wait"):
+            packing.close()
+    except Exception as e:
+        print("FAILED")
+        message("error", {"title": "Side-chain packing failed", "body": f"{e}"})
+        sys.exit(1)
 
-    print(f"Running command: {' '.join(command)}")
 
+def run_scoring(
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    sequences_path: Path,
+    local_output_dir: Path,
+    per_pdb_outputs: bool,
+    single_aa_score: bool = False,
+    batch_indices: Optional[List[int]] = None,
+    execution_profile: str = "gpu",
+    stream: Optional[OutputStream] = None,
+) -> None:
+    """Score existing sequences instead of designing new ones.
+
+    Scores are written as Parquet parts under scores/, one per part of the
+    sequence file and structure. When streaming, each part is uploaded as
+    soon as it is written, and parts uploaded by an earlier attempt are not
+    scored again.
+    """
+    print("-" * 60)
+    device = detect_device(execution_profile)
+    report_device(device)
+    if batch_indices is None:
+        batch_indices = list(range(options.number_of_batches))
+    # One process keeps the device busy; the model and encodings stay resident
+    _, threads = plan_workers(device, 1)
+    configure_threads(threads)
+    print("Loading LigandMPNN")
     try:
-        subprocess.run(command, check=True, cwd=ligandmpnn_dir)
-        print("Done")
+        from wf.engine import get_engine
+
+        engine = get_engine(options, device)
     except Exception as e:
         print("FAILED")
-        message("error", {"title": "LigandMPNN failed", "body": f"{e}"})
+        message("error", {"title": "Loading LigandMPNN failed", "body": f"{e}"})
         sys.exit(1)
 
+    staging_dir = local_output_dir.parent / f".chunks_{local_output_dir.name}"
+    chunk_dirs = []
+    for pdb_path in pdb_paths:
+        print("-" * 60)
+        print(f"Scoring sequences against {pdb_path.name}")
+        wait_for_inputs([pdb_path])
+        out_folder = local_output_dir
+        if per_pdb_outputs:
+            out_folder = local_output_dir / pdb_path.stem
+
+        def chunk_name(part_index: int) -> str:
+            return f"scores_{pdb_path.stem}_{part_index:05d}"
+
+        try:
+            for part_index, table in score_parts(
+                engine,
+                pdb_path,
+                options,
+                sequences_path,
+                single_aa_score,
+                batch_indices,
+                skip=lambda k: stream is not None and stream.is_durable(chunk_name(k)),
+            ):
+                if stream is None:
+                    write_score_part(
+                        score_part_path(out_folder, pdb_path.stem, part_index), table
+                    )
+                    continue
+                chunk_dir = staging_dir / chunk_name(part_index)
+                write_score_part(
+                    score_part_path(chunk_dir / pdb_path.stem, pdb_path.stem, part_index),
+                    table,
+                )
+                chunk_dirs.append(chunk_dir)
+                stream.submit(chunk_name(part_index), chunk_dir)
+            print("Done")
+        except Exception as e:
+            print("FAILED")
+            message(
+                "error",
+                {"title": f"Scoring failed on {pdb_path.name}", "body": f"{e}"},
+            )
+            sys.exit(1)
+
+    if stream is None:
+        return
     print("-" * 60)
-    print("Returning results")
-    return LatchOutputDir(str("/root/outputs"), output_directory.remote_path)
+    print("Waiting for uploads")
+    stream.close()
+    # Only parts whose upload failed are left to send with the final output
+    with METRICS.stage("merging"):
+        merge_design_dirs(chunk_dirs, local_output_dir, per_pdb_outputs)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def rank_designs(local_output_dir: Path, top_k: int) -> None:
+    """Compute design metrics and write the top_k designs of a merged run.
+
+    Runs after the designs are complete, so a failure here only loses the
+    metrics.
+    """
+    if top_k <= 0:
+        return
+    print("-" * 60)
+    print("Ranking designs")
+    try:
+        summary = analyze_designs(local_output_dir, top_k)
+    except Exception as e:
+        print("FAILED")
+        message("warning", {"title": "Design analysis failed", "body": f"{e}"})
+        return
+    if summary is None:
+        return
+    lines = [f"{k}: {v}" for k, v in summary.items()]
+    for line in lines:
+        print(line)
+    message("info", {"title": "Design metrics", "body": "\n".join(lines)})
+
+
+def open_output_stream(
+    remote_path: str,
+    parts_path: str,
+    pdb_paths: List[Path],
+    options: DesignOptions,
+    per_pdb_outputs: bool,
+    batch_indices: Optional[List[int]] = None,
+    sweep: Optional[List[Dict]] = None,
+    scoring: Optional[Dict] = None,
+) -> OutputStream:
+    if batch_indices is None:
+        batch_indices = list(range(options.number_of_batches))
+    # The fingerprint hashes every input
+    wait_for_inputs(pdb_paths)
+    return OutputStream(
+        remote_path=remote_path,
+        parts_path=parts_path,
+        fingerprint=run_fingerprint(
+            pdb_paths, options, batch_indices, sweep, scoring
+        ),
+        per_pdb_outputs=per_pdb_outputs,
+    )